@@ -0,0 +1,74 @@
+"""
+Computed fields for the list serializers, in SQL.
+
+ANNOTATIONS declares, per model, named expressions for values a serializer would
+otherwise look up with a query per row: counts of related rows and "next"/"latest"
+lookups. Serializers name the ones they use in QueryNeedsMixin.annotations, the list
+query computes them (crm_back.mixins.SerializerQuerysetMixin), and the serializer
+methods read them with computed(), falling back to the per-row lookup for objects
+loaded without them (create and update responses, custom actions).
+
+Counts are correlated subqueries rather than Count() over a join, so they neither
+GROUP BY the select_related columns nor multiply with each other.
+"""
+from django.apps import apps
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def related_count(label, field, **filters):
+    """
+    Number of label rows whose field points at the outer row
+    """
+    def expression():
+        rows = apps.get_model(label).objects.filter(**{field: OuterRef('pk')}, **filters).order_by()
+        counted = rows.values(field).annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+    return expression
+
+
+def first_related(label, field, value, ordering, **filters):
+    """
+    value of the first label row, by ordering, whose field points at the outer row
+    """
+    def expression():
+        rows = apps.get_model(label).objects.filter(**{field: OuterRef('pk')}, **filters)
+        return Subquery(rows.order_by(*ordering).values(value)[:1])
+    return expression
+
+
+ANNOTATIONS = {
+    'masterdata.customer': {
+        # Next scheduled or in-progress site visit
+        'upcoming_visit_id': first_related(
+            'sitevisits.sitevisit', 'customer', 'pk', ('scheduled_at',), status__in=['SCHEDULED', 'IN_PROGRESS']
+        ),
+    },
+    'transactiondata.estimate': {
+        'items_count': related_count('transactiondata.estimatelineitem', 'estimate'),
+        'document_signing_token': first_related('transactiondata.documentsigningbatch', 'estimate', 'signing_token', ('pk',)),
+    },
+    'transactiondata.estimatetemplate': {
+        'items_count': related_count('transactiondata.templatelineitem', 'template'),
+    },
+}
+
+
+def for_model(model, names):
+    """
+    {name: expression} of the named annotations of model
+    """
+    declared = ANNOTATIONS.get(model._meta.label_lower, {})
+    missing = set(names) - set(declared)
+    if missing:
+        raise KeyError(f"No annotation {', '.join(sorted(missing))} for {model._meta.label_lower}")
+    return {name: declared[name]() for name in names}
+
+
+def computed(obj, name, fallback):
+    """
+    obj's annotation name when its query computed it, else fallback()
+    """
+    if hasattr(obj, name):
+        return getattr(obj, name)
+    return fallback()
@@ -0,0 +1,95 @@
+"""
+Response compression for the API.
+
+CompressionMiddleware compresses JSON responses of at least COMPRESSION_MIN_BYTES with
+brotli when the client accepts it and the optional brotli package is installed
+(`pip install brotli`), and with gzip otherwise. Smaller bodies, streaming responses
+(the CSV, Arrow and Parquet exports) and other content types are left alone; WhiteNoise
+serves static files pre-compressed.
+
+gzip output gets the same random filename padding as Django's GZipMiddleware, which
+blurs response lengths against BREACH-style attacks. A compressed body is only kept when
+it is smaller than the original.
+"""
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+ACCEPT_ENCODING = re.compile(r'\s*([\w*]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+JSON_TYPES = ('application/json', 'application/problem+json')
+
+
+def accepted_encodings(header):
+    """
+    Content codings of an Accept-Encoding header, without those refused with q=0
+    """
+    accepted = set()
+    for part in (header or '').split(','):
+        match = ACCEPT_ENCODING.match(part)
+        if not match:
+            continue
+        coding, quality = match.groups()
+        try:
+            if quality is not None and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.lower())
+    return accepted
+
+
+def compress(content, coding):
+    if coding == 'br':
+        return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return compress_string(content, max_random_bytes=100)
+
+
+class CompressionMiddleware:
+    """
+    Compress JSON responses above COMPRESSION_MIN_BYTES with brotli or gzip
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if (
+            response.streaming
+            or response.status_code != 200
+            or response.has_header('Content-Encoding')
+            or content_type not in JSON_TYPES
+        ):
+            return response
+
+        if len(response.content) < settings.COMPRESSION_MIN_BYTES:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if brotli is not None and 'br' in accepted:
+            coding = 'br'
+        elif 'gzip' in accepted or '*' in accepted:
+            coding = 'gzip'
+        else:
+            return response
+
+        compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        # The compressed body is a different byte sequence; a strong ETag has to become weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
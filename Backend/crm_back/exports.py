@@ -0,0 +1,252 @@
+"""
+Streaming exports for the list endpoints.
+
+ExportMixin adds GET <list>/export/ to a viewset. The rows come from the viewset's own
+queryset (organization scoping and list filters), narrowed by the dashboard filters
+(branch_id, rep_id, f_*) and an optional start_date/end_date on the model's date field.
+They are read with values_list().iterator(), so no model instances are built and
+memory stays flat however many rows are exported:
+
+    ?output=csv      text/csv, written while the rows are read (default)
+    ?output=arrow    Arrow IPC stream, one record batch per chunk
+    ?output=parquet  Parquet file, spooled to a temporary file because the format's
+                     footer is written last
+
+Arrow and Parquet need pyarrow, which is optional (`pip install pyarrow`).
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+
+OUTPUTS = ('csv', 'arrow', 'parquet')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def csv_chunks(headers, rows, chunk_size=None):
+    """
+    CSV text for headers and rows, one string per chunk of rows
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for chunk in chunked(rows, chunk_size or export_chunk_size()):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def records_table(records):
+    """
+    (headers, rows) for a list of dicts; the headers are every key, in first-seen order
+    """
+    headers = list(dict.fromkeys(key for record in records for key in record))
+    return headers, ([record.get(header) for header in headers] for record in records)
+
+
+def resolve_field(model, lookup):
+    """
+    The model field a values_list() lookup such as 'customer__full_name' ends on
+    """
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    field = model._meta.get_field(name)
+    if field.is_relation:
+        return field.target_field
+    return field
+
+
+def arrow_type(field):
+    import pyarrow as pa
+
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.AutoField, models.IntegerField)):
+        return pa.int64()
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(model, columns):
+    import pyarrow as pa
+    return pa.schema([(header, arrow_type(resolve_field(model, lookup))) for header, lookup in columns])
+
+
+def arrow_batches(schema, rows, chunk_size=None):
+    import pyarrow as pa
+
+    for chunk in chunked(rows, chunk_size or export_chunk_size()):
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)],
+            schema=schema
+        )
+
+
+class _Drain:
+    """
+    Write-only file for pyarrow whose contents are collected after each batch
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def arrow_stream(schema, rows):
+    import pyarrow as pa
+
+    sink = _Drain()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield sink.drain()
+        for batch in arrow_batches(schema, rows):
+            writer.write_batch(batch)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def parquet_file(schema, rows):
+    import pyarrow.parquet as pq
+
+    output = tempfile.TemporaryFile()
+    with pq.ParquetWriter(output, schema) as writer:
+        for batch in arrow_batches(schema, rows):
+            writer.write_batch(batch)
+    output.seek(0)
+    return output
+
+
+def date_range(model, date_field, start=None, end=None):
+    """
+    Q for the days start through end on date_field; datetimes are compared with the
+    day boundaries so the column's index can be used
+    """
+    bounds = {}
+    if isinstance(model._meta.get_field(date_field), models.DateTimeField):
+        if start:
+            bounds[f'{date_field}__gte'] = timezone.make_aware(datetime.combine(start, time.min))
+        if end:
+            bounds[f'{date_field}__lt'] = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    else:
+        if start:
+            bounds[f'{date_field}__gte'] = start
+        if end:
+            bounds[f'{date_field}__lte'] = end
+    return Q(**bounds)
+
+
+def export_response(queryset, columns, name, output='csv'):
+    """
+    queryset as a CSV, Arrow or Parquet download of columns, [(header, lookup)]
+    """
+    headers = [header for header, _lookup in columns]
+    # Relations loaded for the serializers are not needed by the columns
+    queryset = queryset.select_related(None).prefetch_related(None)
+    rows = queryset.values_list(*[lookup for _header, lookup in columns]).iterator(chunk_size=export_chunk_size())
+    filename = f"{name}-{timezone.localdate().isoformat()}.{output}"
+
+    if output == 'csv':
+        response = StreamingHttpResponse(csv_chunks(headers, rows), content_type=CONTENT_TYPES['csv'])
+    else:
+        schema = arrow_schema(queryset.model, columns)
+        if output == 'arrow':
+            response = StreamingHttpResponse(arrow_stream(schema, rows), content_type=CONTENT_TYPES['arrow'])
+        else:
+            response = FileResponse(parquet_file(schema, rows), content_type=CONTENT_TYPES['parquet'])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+class ExportMixin:
+    """
+    GET <list>/export/ for a viewset with export_columns = [(header, lookup), ...]
+    """
+    export_columns = ()
+    export_name = None
+
+    def get_export_queryset(self):
+        from dashboard.filters import get_registry
+
+        queryset = self.filter_queryset(self.get_queryset())
+        params = self.request.query_params
+        registry = get_registry()
+        queryset = queryset.filter(registry.resolve(
+            queryset.model,
+            branch_id=params.get('branch_id'),
+            rep_id=params.get('rep_id'),
+            filters={key: value for key, value in params.items() if key.startswith('f_')},
+        ))
+
+        date_field = registry.date_lookup(queryset.model)
+        start, end = parse_date(params.get('start_date') or ''), parse_date(params.get('end_date') or '')
+        if date_field and (start or end):
+            queryset = queryset.filter(date_range(queryset.model, date_field, start, end))
+        return queryset.order_by('pk')
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the filtered rows as CSV (default), Arrow or Parquet: ?output=csv|arrow|parquet
+        """
+        output = request.query_params.get('output', 'csv').lower()
+        if output not in OUTPUTS:
+            return Response({'error': f"output must be one of {', '.join(OUTPUTS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if output != 'csv':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                return Response({'error': 'Arrow and Parquet exports need pyarrow'}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        name = self.export_name or self.get_queryset().model._meta.model_name
+        return export_response(self.get_export_queryset(), self.export_columns, name, output)
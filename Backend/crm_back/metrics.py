@@ -0,0 +1,110 @@
+"""
+Declarative multi-count queries.
+
+A MetricSpec names a set of measures (Count/Sum/Avg over the rows matching an optional
+condition, optionally split into buckets such as one count per stage) and evaluates them
+for any number of periods with a single aggregate() call built from filter=Q(...)
+clauses. A KPI with its previous period, a funnel or a statistics panel therefore costs
+one query instead of one per number.
+"""
+from django.db.models import Count, Q
+
+
+class Measure:
+    """
+    An aggregate of `field` over the rows matching `where`. With bucket_field and buckets
+    the measure becomes {bucket: value}, one entry per value of bucket_field.
+    """
+
+    def __init__(self, aggregate=Count, field='pk', where=None, bucket_field=None, buckets=()):
+        self.aggregate = aggregate
+        self.field = field
+        self.where = where if where is not None else Q()
+        self.bucket_field = bucket_field
+        self.buckets = tuple(buckets)
+
+    def conditions(self):
+        """
+        (bucket, Q) pairs; bucket is None for an unsplit measure
+        """
+        if not self.bucket_field:
+            return [(None, self.where)]
+        return [(bucket, self.where & Q(**{self.bucket_field: bucket})) for bucket in self.buckets]
+
+
+def breakdown(queryset, field):
+    """
+    {value: row count} for every value of field that occurs, with one GROUP BY. Unlike a
+    bucketed Measure it keeps values outside the field's choices (e.g. ingested lead sources).
+    """
+    rows = queryset.values(field).annotate(count=Count('pk')).order_by()
+    return {row[field]: row['count'] for row in rows}
+
+
+def period(field, start, end):
+    """
+    Q for field__range=[start, end]; an empty Q (every row) when start is None
+    """
+    if start is None:
+        return Q()
+    return Q(**{f'{field}__range': [start, end]})
+
+
+def kpi_periods(field, start, end, prev_start, prev_end):
+    """
+    The current period and, when there is one, the previous period for a KPI
+    """
+    periods = {'current': period(field, start, end)}
+    if start and prev_start:
+        periods['previous'] = period(field, prev_start, prev_end)
+    return periods
+
+
+class MetricSpec:
+    """
+    Named measures evaluated together:
+
+        spec = MetricSpec(total=Measure(), won=Measure(where=Q(stage__in=['booked', 'closed'])))
+        spec.evaluate(queryset, kpi_periods('created_at', start, end, prev_start, prev_end))
+        # {'current': {'total': 12, 'won': 5}, 'previous': {'total': 9, 'won': 2}}
+
+    Without periods evaluate() returns the measures directly. Missing values (a Sum or
+    Avg over no rows) are returned as `empty`.
+    """
+
+    def __init__(self, empty=0, **measures):
+        self.measures = measures
+        self.empty = empty
+
+    def compile(self, periods):
+        """
+        aggregate() kwargs plus the alias -> (period, measure, bucket) map to unpack the result
+        """
+        aggregates = {}
+        targets = {}
+        for period_name, period_q in periods.items():
+            for measure_name, measure in self.measures.items():
+                for bucket, condition in measure.conditions():
+                    condition = period_q & condition
+                    alias = f'metric_{len(aggregates)}'
+                    aggregates[alias] = measure.aggregate(measure.field, filter=condition if condition else None)
+                    targets[alias] = (period_name, measure_name, bucket)
+        return aggregates, targets
+
+    def evaluate(self, queryset, periods=None):
+        aggregates, targets = self.compile(periods if periods is not None else {None: Q()})
+        result = queryset.aggregate(**aggregates) if aggregates else {}
+
+        values = {}
+        for alias, (period_name, measure_name, bucket) in targets.items():
+            value = result[alias]
+            value = self.empty if value is None else value
+            period_values = values.setdefault(period_name, {})
+            if bucket is None:
+                period_values[measure_name] = value
+            else:
+                period_values.setdefault(measure_name, {})[bucket] = value
+
+        if periods is None:
+            return values.get(None, {})
+        return values
@@ -47,3 +47,287 @@ class OrganizationContextMixin:
         
         # Default to empty if no org context and not superuser
         return queryset.none()
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin for sparse fieldsets on GET requests: ?fields=a,b keeps only those
+    fields and ?omit=a,b drops them. Applies to the top-level serializer of the response;
+    nested serializers keep their fields. Unknown names are ignored.
+    """
+    fields_param = 'fields'
+    omit_param = 'omit'
+
+    def get_fields(self):
+        from rest_framework.serializers import ListSerializer
+
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return fields
+        parent = getattr(self, 'parent', None)
+        if parent is not None and not (isinstance(parent, ListSerializer) and parent.parent is None):
+            return fields
+
+        keep = _names(request.query_params.get(self.fields_param))
+        omit = _names(request.query_params.get(self.omit_param))
+        return {
+            name: field for name, field in fields.items()
+            if (not keep or name in keep) and name not in omit
+        }
+
+
+def _names(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class QueryNeedsMixin(SparseFieldsMixin):
+    """
+    Serializer mixin declaring the relations its fields read, so a list of N rows costs
+    a fixed number of queries instead of one or more per row:
+
+        select_related    forward foreign keys and one-to-ones read by the fields
+        prefetch_related  reverse and many-to-many relations read by the fields
+        annotations       computed fields from crm_back.annotations, named like the
+                          serializer fields that read them
+        field_sources     {field: lookups} for fields that do not map to a model field
+                          (method fields, properties), used to prune columns with only()
+
+    Nested serializers declared on the class are prefetched with their own needs, and
+    only the needs of the fields left after ?fields=/?omit= are applied.
+    Views apply them with SerializerQuerysetMixin.
+    """
+    select_related = ()
+    prefetch_related = ()
+    annotations = ()
+    field_sources = {}
+
+    def get_annotations(self):
+        from crm_back.annotations import for_model
+        return for_model(self.Meta.model, [name for name in self.annotations if name in self.fields])
+
+    def setup_queryset(self, queryset, columns=None):
+        """
+        queryset with the relations and annotations of the serializer's fields; with
+        columns (see model_columns), only the relations those columns traverse
+        """
+        from django.db.models import Prefetch
+        from rest_framework.serializers import ListSerializer
+
+        related = self.select_related
+        if columns is not None:
+            related = [path for path in related if any(_within(column, path) for column in columns)]
+        if related:
+            queryset = queryset.select_related(*related)
+
+        lookups = list(self.prefetch_related)
+        for name, field in self.fields.items():
+            nested = field.child if isinstance(field, ListSerializer) else field
+            if isinstance(nested, QueryNeedsMixin) and not field.write_only:
+                lookups.append(Prefetch(
+                    field.source, queryset=nested.setup_queryset(nested.Meta.model._default_manager.all())
+                ))
+        if lookups:
+            queryset = queryset.prefetch_related(*lookups)
+
+        annotations = self.get_annotations()
+        if annotations:
+            queryset = queryset.annotate(**annotations)
+        return queryset
+
+
+def _within(column, path):
+    return column == path or column.startswith(path + '__')
+
+
+def model_columns(serializer):
+    """
+    Model field lookups a serializer's fields read, for only(); None when a field reads
+    something that cannot be told from its declaration
+    """
+    from django.core.exceptions import FieldDoesNotExist
+    from rest_framework.serializers import SerializerMethodField
+
+    model = serializer.Meta.model
+    sources = getattr(serializer, 'field_sources', {})
+    annotations = getattr(serializer, 'annotations', ())
+    columns = []
+    for name, field in serializer.fields.items():
+        if name in sources:
+            columns.extend(sources[name])
+            continue
+        if field.write_only or name in annotations:
+            continue
+        if isinstance(field, SerializerMethodField) or field.source == '*':
+            return None
+        path = field.source.replace('.', '__')
+        try:
+            model_field = model._meta.get_field(path.split('__')[0])
+        except FieldDoesNotExist:
+            return None
+        # Reverse and many-to-many relations are read by their own queries
+        if model_field.one_to_many or model_field.many_to_many or (model_field.one_to_one and not model_field.concrete):
+            continue
+        columns.append(path)
+    return columns
+
+
+class SerializerQuerysetMixin:
+    """
+    Viewset mixin fitting get_queryset to the serializer of the action:
+
+    - serializer_action_classes ({action: serializer class}) picks a lighter serializer
+      for an action, e.g. 'list', falling back to serializer_class
+    - the QueryNeedsMixin declarations of the fields left after ?fields=/?omit= are applied
+    - lists, and retrieves narrowed with ?fields=/?omit=, load only the columns those
+      fields read (plus the pagination ordering field)
+    """
+    serializer_action_classes = {}
+
+    def get_serializer_class(self):
+        return self.serializer_action_classes.get(self.action) or super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer = self.get_serializer()
+
+        columns = None
+        params = self.request.query_params
+        sparse = SparseFieldsMixin.fields_param in params or SparseFieldsMixin.omit_param in params
+        if self.action == 'list' or (self.action == 'retrieve' and sparse):
+            columns = model_columns(serializer)
+
+        if isinstance(serializer, QueryNeedsMixin):
+            queryset = serializer.setup_queryset(queryset, columns)
+        if columns is not None:
+            ordering_field = getattr(self, 'cursor_ordering_field', None) or getattr(self.paginator, 'ordering_field', None)
+            if ordering_field:
+                columns.append(ordering_field)
+            # Relations traversed by the columns are joined, not loaded per row
+            related = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+            if related:
+                queryset = queryset.select_related(*related)
+            queryset = queryset.only(*columns)
+        return queryset
+
+
+class ConditionalGetMixin:
+    """
+    Viewset mixin answering If-None-Match (and, for one object, If-Modified-Since) with
+    304 Not Modified before the rows are serialized. The weak ETag comes from one
+    aggregate over the rows the response would contain:
+
+        list      max(updated_at) and count of the filtered rows, plus the query string
+        retrieve  the object's id and updated_at
+
+    etag_related ({lookup: timestamp field}) adds the max timestamp and count of related
+    rows the representation reads but whose changes do not touch updated_at, e.g. the
+    payments on an invoice. The forward relations the serializer reads (its
+    select_related and the relations its fields traverse, such as assigned_to for
+    assigned_to_name) are added automatically when their model has etag_field, so
+    renaming a user or a service type changes the ETag of the rows showing the name.
+    Responses are sent with Cache-Control: private, no-cache so browsers store them but
+    always revalidate.
+    """
+    etag_field = 'updated_at'
+    etag_related = {}
+
+    def etag_relations(self):
+        """
+        {lookup: timestamp field} of the related rows the response reads
+        """
+        from django.core.exceptions import FieldDoesNotExist
+
+        serializer = self.get_serializer()
+        model = serializer.Meta.model
+        paths = set(getattr(serializer, 'select_related', ()))
+        columns = model_columns(serializer)
+        if columns is not None:
+            # Only the relations the fields left after ?fields=/?omit= read
+            paths = {path for path in paths if any(_within(column, path) for column in columns)}
+            paths.update(column.rsplit('__', 1)[0] for column in columns if '__' in column)
+
+        relations = {}
+        for path in sorted(paths):
+            related = model
+            try:
+                for part in path.split('__'):
+                    related = related._meta.get_field(part).related_model
+                related._meta.get_field(self.etag_field)
+            except (AttributeError, FieldDoesNotExist):
+                continue
+            relations[path] = self.etag_field
+        return {**relations, **self.etag_related}
+
+    def etag_validators(self, queryset):
+        """
+        (weak ETag, last modified) of queryset's rows, or None when there are none
+        """
+        import hashlib
+        from django.db.models import Count, Max
+
+        aggregates = {'count': Count('pk', distinct=True), 'modified': Max(self.etag_field)}
+        for lookup, field in self.etag_relations().items():
+            aggregates[f'{lookup}_count'] = Count(lookup, distinct=True)
+            aggregates[f'{lookup}_modified'] = Max(f'{lookup}__{field}')
+        values = queryset.model._default_manager.filter(
+            pk__in=queryset.order_by().values('pk')
+        ).aggregate(**aggregates)
+        if not values['count'] and self.action == 'retrieve':
+            return None
+
+        request = self.request
+        organization = getattr(request, 'organization', None)
+        key = repr((
+            sorted(values.items()), request.path, sorted(request.query_params.lists()),
+            getattr(organization, 'id', None), request.user.pk, request.accepted_media_type,
+            self.get_serializer_class().__name__,
+        ))
+        modified = [value for name, value in values.items() if name.endswith('modified') and value]
+        etag = f'W/"{hashlib.md5(key.encode()).hexdigest()}"'
+        return etag, max(modified) if modified else None
+
+    def conditional_response(self, queryset, respond):
+        """
+        304 when the request's validators match queryset's, else respond() with the validators set
+        """
+        from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+        from django.utils.http import http_date
+
+        validators = self.etag_validators(queryset)
+        if validators is None:
+            return respond()
+        etag, modified = validators
+        # A deletion leaves a list's max(updated_at) unchanged, so lists only compare ETags
+        last_modified = int(modified.timestamp()) if modified and self.action == 'retrieve' else None
+
+        response = get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = respond()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if modified:
+                response['Last-Modified'] = http_date(modified.timestamp())
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Authorization', 'X-Organization-Id'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(
+            queryset, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        from django.core.exceptions import ValidationError
+
+        respond = lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, ValidationError):
+            # Malformed ids get the usual 404
+            return respond()
+        return self.conditional_response(queryset, respond)
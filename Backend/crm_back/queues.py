@@ -0,0 +1,281 @@
+"""
+Django Q lanes.
+
+Each lane in Q_CLUSTER['ALT_CLUSTERS'] is its own cluster with its own workers,
+timeout and retry, started with `Q_CLUSTER_NAME=<lane> python manage.py qcluster`:
+
+    interactive  customer-facing emails that should go out within seconds
+    pdf          emails with a rendered PDF attached, CPU-bound
+    bulk         scheduled sweeps (send_pending_*, receivables re-aging, retention) and write-behind rows
+    ingestion    raw endpoint lead processing
+
+enqueue() routes a task to its function's lane and records when it was queued, so the
+wait before a worker picked it up can be reported per lane; schedules are routed by
+setting Schedule.cluster (masterdata.signals). Routing only applies with
+TASK_QUEUES_ENABLED; otherwise everything runs on the default cluster.
+
+enqueue(..., idempotency_key=...) drops a call while the same function and key is
+queued or running, and for `debounce` seconds after it finished. The key is held in
+the default cache from enqueue until the post_execute hook releases it (or the lane's
+retry window runs out), so deployments with several processes need a shared backend
+via CACHE_URL. claimed() holds the same key while a sweep does the work inline.
+"""
+import hashlib
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count, Max, Min, Q
+from django.utils import timezone
+from django_q.utils import get_func_repr
+
+
+INTERACTIVE = 'interactive'
+PDF = 'pdf'
+BULK = 'bulk'
+INGESTION = 'ingestion'
+
+LOCK_KEY = 'queues:lock:{digest}'
+TASK_LOCK_KEY = 'queues:task:{task_id}'
+DEDUPE_KEY = 'queues:dedupe:{func}:{outcome}'
+DEDUPE_FUNCS_KEY = 'queues:dedupe:funcs'
+
+TASK_ROUTES = {
+    'transactiondata.tasks.send_new_lead_welcome_email': INTERACTIVE,
+    'transactiondata.tasks.send_booked_async': INTERACTIVE,
+    'transactiondata.tasks.send_closed_async': INTERACTIVE,
+    'transactiondata.tasks.send_invoice_async': PDF,
+    'transactiondata.tasks.send_receipt_async': PDF,
+    'transactiondata.tasks.send_estimate_async': PDF,
+    'transactiondata.tasks.process_document_signing': PDF,
+    'transactiondata.tasks.send_pending_invoices': BULK,
+    'transactiondata.tasks.send_pending_receipts': BULK,
+    'transactiondata.tasks.send_pending_estimates': BULK,
+    'transactiondata.receivables.reage': BULK,
+    'transactiondata.activity.write_activity_rows': BULK,
+    'crm_back.retention.run': BULK,
+    'masterdata.tasks.process_raw_endpoint_leads': INGESTION,
+}
+
+
+def default_queue():
+    return settings.Q_CLUSTER.get('cluster_name', settings.Q_CLUSTER['name'])
+
+
+def lanes():
+    """
+    {lane: cluster options} from Q_CLUSTER['ALT_CLUSTERS']
+    """
+    return settings.Q_CLUSTER.get('ALT_CLUSTERS', {})
+
+
+def queue_for(func):
+    """
+    Lane of a task function (dotted path or callable), or None for the default cluster
+    """
+    if not getattr(settings, 'TASK_QUEUES_ENABLED', False):
+        return None
+    queue = TASK_ROUTES.get(get_func_repr(func))
+    return queue if queue in lanes() else None
+
+
+def hold_seconds(queue):
+    """
+    How long a task on queue can stay queued or running, retries included
+    """
+    config = {**settings.Q_CLUSTER, **lanes().get(queue, {})}
+    return config.get('retry', 60) * max(1, config.get('max_attempts') or 1)
+
+
+def lock_key(func, idempotency_key):
+    digest = hashlib.md5(f'{get_func_repr(func)}:{idempotency_key!r}'.encode()).hexdigest()
+    return LOCK_KEY.format(digest=digest)
+
+
+def record_dedupe(func, outcome):
+    func = get_func_repr(func)
+    funcs = cache.get(DEDUPE_FUNCS_KEY, set())
+    if func not in funcs:
+        cache.set(DEDUPE_FUNCS_KEY, funcs | {func}, timeout=None)
+    key = DEDUPE_KEY.format(func=func, outcome=outcome)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def dedupe_stats():
+    """
+    {func: {'enqueued', 'duplicates'}} for the calls made with an idempotency key
+    """
+    funcs = sorted(cache.get(DEDUPE_FUNCS_KEY, set()))
+    keys = [DEDUPE_KEY.format(func=f, outcome=o) for f in funcs for o in ('enqueued', 'duplicate')]
+    values = cache.get_many(keys)
+    return {
+        func: {
+            'enqueued': values.get(DEDUPE_KEY.format(func=func, outcome='enqueued'), 0),
+            'duplicates': values.get(DEDUPE_KEY.format(func=func, outcome='duplicate'), 0),
+        }
+        for func in funcs
+    }
+
+
+def enqueue(func, *args, idempotency_key=None, debounce=0, **kwargs):
+    """
+    async_task on the function's lane; returns the task id, or None when idempotency_key
+    (e.g. (object id, version)) is already queued, running or within its debounce seconds
+    """
+    from django_q.tasks import async_task
+    from masterdata.models import TaskExecution
+
+    q_options = dict(kwargs.pop('q_options', None) or {})
+    queue = queue_for(func)
+    if queue:
+        q_options.setdefault('cluster', queue)
+
+    lock = None
+    if idempotency_key is not None:
+        lock = lock_key(func, idempotency_key)
+        hold = hold_seconds(queue) + debounce
+        if not cache.add(lock, True, timeout=hold):
+            record_dedupe(func, 'duplicate')
+            return None
+        record_dedupe(func, 'enqueued')
+
+    # Taken first: in sync mode or with a fast worker the task can finish before async_task returns
+    enqueued_at = timezone.now()
+    try:
+        task_id = async_task(func, *args, q_options=q_options, **kwargs)
+    except Exception:
+        if lock:
+            cache.delete(lock)
+        raise
+    if lock:
+        cache.set(TASK_LOCK_KEY.format(task_id=task_id), (lock, debounce), timeout=hold)
+
+    # Filled in when the task finishes (masterdata.automation.record_execution)
+    execution, created = TaskExecution.objects.get_or_create(
+        task_id=task_id,
+        defaults={'queue': q_options.get('cluster') or default_queue(), 'enqueued_at': enqueued_at},
+    )
+    if not created and execution.enqueued_at is None:
+        # The task was recorded before this row was written; keep what it recorded
+        TaskExecution.objects.filter(pk=execution.pk, enqueued_at__isnull=True).update(
+            enqueued_at=enqueued_at,
+            wait=(execution.started - enqueued_at).total_seconds() if execution.started else None,
+        )
+    return task_id
+
+
+def release(task):
+    """
+    Free the idempotency key of a finished task package, keeping it for its debounce
+    window; failed tasks the broker will retry keep it
+    """
+    if not (task.get('success') or task.get('ack_failure')):
+        return
+    task_lock = TASK_LOCK_KEY.format(task_id=task['id'])
+    entry = cache.get(task_lock)
+    if not entry:
+        return
+    lock, debounce = entry
+    cache.delete(task_lock)
+    if debounce:
+        cache.touch(lock, debounce)
+    else:
+        cache.delete(lock)
+
+
+@contextmanager
+def claimed(func, idempotency_key):
+    """
+    Hold func's idempotency key while doing its work inline; yields False, and the caller
+    should skip the work, when that call is already queued or running
+    """
+    lock = lock_key(func, idempotency_key)
+    acquired = cache.add(lock, True, timeout=hold_seconds(queue_for(func)))
+    if not acquired:
+        record_dedupe(func, 'duplicate')
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(lock)
+
+
+def schedule_cluster(schedule):
+    """
+    Cluster a Schedule should run on: its function's lane, keeping clusters set by hand
+    """
+    if schedule.cluster and schedule.cluster not in lanes():
+        return schedule.cluster
+    return queue_for(schedule.func)
+
+
+def route_schedules(registry=apps):
+    """
+    Apply the routing to every schedule; returns the number changed
+    """
+    Schedule = registry.get_model('django_q', 'Schedule')
+    changed = 0
+    for schedule in Schedule.objects.all():
+        cluster = schedule_cluster(schedule)
+        if cluster != schedule.cluster:
+            Schedule.objects.filter(pk=schedule.pk).update(cluster=cluster)
+            changed += 1
+    return changed
+
+
+def queue_stats(window=timedelta(hours=1)):
+    """
+    Per lane: configuration, current depth and age of the oldest queued task, and the
+    runs that finished within window with their wait (queued to started) and duration
+    """
+    from django_q.brokers import get_broker
+    from django_q.models import OrmQ
+    from masterdata.models import TaskExecution
+
+    now = timezone.now()
+    queued = {
+        row['key']: row
+        for row in OrmQ.objects.values('key').annotate(depth=Count('id'), oldest=Min('lock')).order_by()
+    }
+    finished = {
+        row['queue']: row
+        for row in TaskExecution.objects.filter(stopped__gte=now - window).values('queue').annotate(
+            runs=Count('id'),
+            failures=Count('id', filter=Q(success=False)),
+            avg_wait=Avg('wait'),
+            max_wait=Max('wait'),
+            avg_duration=Avg('duration'),
+            max_duration=Max('duration'),
+        ).order_by()
+    }
+
+    options = {default_queue(): settings.Q_CLUSTER, **lanes()}
+    stats = []
+    for queue, config in options.items():
+        depth = queued.get(queue, {})
+        if settings.Q_CLUSTER.get('orm'):
+            size, oldest = depth.get('depth', 0), depth.get('oldest')
+        else:
+            size, oldest = get_broker(queue).queue_size(), None
+        runs = finished.get(queue, {})
+        stats.append({
+            'queue': queue,
+            'workers': config.get('workers', settings.Q_CLUSTER.get('workers')),
+            'timeout': config.get('timeout', settings.Q_CLUSTER.get('timeout')),
+            'retry': config.get('retry', settings.Q_CLUSTER.get('retry')),
+            'depth': size,
+            'oldest_queued_seconds': (now - oldest).total_seconds() if oldest else None,
+            'runs': runs.get('runs', 0),
+            'failures': runs.get('failures', 0),
+            'avg_wait': runs.get('avg_wait'),
+            'max_wait': runs.get('max_wait'),
+            'avg_duration': runs.get('avg_duration'),
+            'max_duration': runs.get('max_duration'),
+        })
+    return stats
@@ -0,0 +1,68 @@
+"""
+orjson-backed JSON renderer and parser for the API (REST_FRAMEWORK in settings).
+
+Output matches DRF's JSONRenderer: UTF-8, compact, Decimals outside serializer fields as
+numbers, non-string dict keys as strings. Everything orjson does not encode natively
+(Decimal, lazy translations, querysets, timedeltas, ...) goes through DRF's own encoder,
+and so do datetimes, dates and times, whose precision differs between orjson and some
+DRF releases (which cut microseconds to milliseconds); timestamps are therefore
+formatted exactly as the installed DRF formats them.
+"""
+import decimal
+
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+_encoder = JSONEncoder()
+
+
+def default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    return _encoder.default(obj)
+
+
+def dumps(data, indent=False):
+    """
+    data as JSON bytes
+    """
+    options = OPTIONS | orjson.OPT_INDENT_2 if indent else OPTIONS
+    return orjson.dumps(data, default=default, option=options)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on orjson; an indent requested through the Accept header (or by the
+    browsable API) gives two-space indentation, the only one orjson has
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        return dumps(data, indent=bool(indent))
+
+
+class ORJSONParser(JSONParser):
+    """
+    JSONParser on orjson
+    """
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            return orjson.loads(body)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError(f'JSON parse error - {exc}')
@@ -0,0 +1,212 @@
+"""
+Retention for the log tables.
+
+Each policy names a table, its date field and the rows that may leave it. Rows older
+than RETENTION_DAYS[label] are written to gzipped JSONL files under
+RETENTION_ARCHIVE_ROOT/<label>/ and then deleted, one chunk of RETENTION_CHUNK_SIZE rows
+per transaction, so the hot tables and their indexes only hold recent rows. A chunk's
+file is complete on disk before its rows are deleted.
+
+`run` is the daily Django Q job and stops after RETENTION_MAX_SECONDS, leaving the
+rest for the next run. `manage.py archive_rows` runs it by hand and
+`manage.py restore_archive` loads archived rows back.
+"""
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = '.jsonl.gz'
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder keeping microseconds, so restored timestamps match the originals
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class RetentionPolicy:
+    """
+    Rows of label older than the retention window on date_field, narrowed by only
+    """
+
+    def __init__(self, label, date_field, only=None):
+        self.label = label
+        self.date_field = date_field
+        self.only = only or Q()
+
+    @property
+    def model(self):
+        return apps.get_model(self.label)
+
+    @property
+    def days(self):
+        return getattr(settings, 'RETENTION_DAYS', {}).get(self.label)
+
+    def expired(self, now=None):
+        """
+        Rows due for archival, oldest first; none when the policy is disabled
+        """
+        if not self.days:
+            return self.model.objects.none()
+        cutoff = (now or timezone.now()) - timedelta(days=self.days)
+        return self.model.objects.filter(self.only, **{f'{self.date_field}__lt': cutoff}).order_by('pk')
+
+
+POLICIES = {
+    policy.label: policy for policy in (
+        RetentionPolicy('transactiondata.emaillog', 'sent_at'),
+        RetentionPolicy('transactiondata.customeractivity', 'created_at'),
+        RetentionPolicy('users.useractivities', 'created_at'),
+        # Unprocessed leads are the endpoint backlog
+        RetentionPolicy('masterdata.rawendpointlead', 'created_at', only=Q(processed=True)),
+        RetentionPolicy('masterdata.taskexecution', 'stopped'),
+    )
+}
+
+
+def archive_root():
+    return Path(settings.RETENTION_ARCHIVE_ROOT)
+
+
+def archive_dir(label):
+    return archive_root() / label
+
+
+def write_archive(policy, rows):
+    """
+    Write rows to a new archive file named after their date and id range; returns its path
+    """
+    dates = [getattr(row, policy.date_field) for row in rows]
+    first, last = min(dates), max(dates)
+    directory = archive_dir(policy.label)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{first:%Y%m%d}_{last:%Y%m%d}_{rows[0].pk}-{rows[-1].pk}{ARCHIVE_SUFFIX}"
+
+    partial = path.with_name(path.name + '.part')
+    with gzip.open(partial, 'wt', encoding='utf-8') as archive:
+        for record in serializers.serialize('python', rows):
+            archive.write(json.dumps(record, cls=ArchiveEncoder) + '\n')
+    os.replace(partial, path)
+    return path
+
+
+def archive(policy, now=None, chunk_size=None, deadline=None):
+    """
+    Move the policy's expired rows to archive files, chunk by chunk; returns the rows moved
+    """
+    chunk_size = chunk_size or settings.RETENTION_CHUNK_SIZE
+    expired = policy.expired(now)
+    moved = 0
+    while deadline is None or time.monotonic() < deadline:
+        rows = list(expired[:chunk_size])
+        if not rows:
+            break
+        path = write_archive(policy, rows)
+        with transaction.atomic():
+            policy.model.objects.filter(pk__in=[row.pk for row in rows]).delete()
+        moved += len(rows)
+        logger.info(f"Archived {len(rows)} {policy.label} rows to {path}")
+    return moved
+
+
+def run(labels=None, now=None):
+    """
+    Daily Django Q job: archive the expired rows of every policy within RETENTION_MAX_SECONDS
+    """
+    deadline = time.monotonic() + settings.RETENTION_MAX_SECONDS
+    moved = {}
+    for label, policy in POLICIES.items():
+        if labels and label not in labels:
+            continue
+        moved[label] = archive(policy, now=now, deadline=deadline)
+    return moved
+
+
+def archive_files(label, since=None, until=None):
+    """
+    Archive files of label whose rows overlap since..until (dates), oldest first
+    """
+    directory = archive_dir(label)
+    if not directory.exists():
+        return []
+    files = []
+    for path in sorted(directory.glob(f'*{ARCHIVE_SUFFIX}')):
+        first, last = path.name.split('_')[:2]
+        if since and last < f'{since:%Y%m%d}':
+            continue
+        if until and first > f'{until:%Y%m%d}':
+            continue
+        files.append(path)
+    return files
+
+
+def _relink(obj, known):
+    """
+    Clear nullable relations whose row is gone; False when a required one is gone
+    """
+    for field in obj._meta.concrete_fields:
+        value = getattr(obj, field.attname) if field.many_to_one else None
+        if value is None:
+            continue
+        key = (field.related_model._meta.label_lower, value)
+        if key not in known:
+            known[key] = field.related_model._base_manager.filter(pk=value).exists()
+        if not known[key]:
+            if not field.null:
+                return False
+            setattr(obj, field.attname, None)
+    return True
+
+
+def restore_file(path):
+    """
+    Load an archive file back into its table and remove it. Rows whose id exists again
+    or whose required related rows are gone are skipped. Returns (restored, skipped).
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        records = [json.loads(line) for line in archive if line.strip()]
+
+    restored = skipped = 0
+    known = {}
+    with transaction.atomic():
+        for item in serializers.deserialize('python', records, ignorenonexistent=True):
+            obj = item.object
+            if type(obj)._base_manager.filter(pk=obj.pk).exists() or not _relink(obj, known):
+                skipped += 1
+                continue
+            item.save()
+            restored += 1
+    path.unlink()
+    return restored, skipped
+
+
+def restore(label, since=None, until=None):
+    """
+    Restore every archive file of label overlapping since..until; returns (files, restored, skipped)
+    """
+    files = archive_files(label, since, until)
+    restored = skipped = 0
+    for path in files:
+        file_restored, file_skipped = restore_file(path)
+        restored += file_restored
+        skipped += file_skipped
+    return len(files), restored, skipped
@@ -0,0 +1,249 @@
+"""
+Full-text search over customers, estimates and documents.
+
+Each index is a shadow table next to the model table: an FTS5 virtual table on SQLite
+and a tsvector table with a GIN index on PostgreSQL. Rows are kept in sync by the
+post_save/post_delete receivers in masterdata.signals and transactiondata.signals and
+can be rebuilt from scratch with `manage.py rebuild_search_index`. On any other
+database backend search falls back to the old icontains filters.
+
+The index matches word prefixes: "jan wal" finds "Jane Walker", but a term inside a
+word ("alker") does not. Terms with a word shorter than SUBSTRING_MAX_LENGTH or with
+digits (partial phone numbers, job numbers) keep the icontains filters, so "ob" still
+finds "Bob" and "1234" still finds "5551234567".
+"""
+import re
+from functools import lru_cache
+
+from django.apps import apps
+from django.db import connection as default_connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+
+# Columns are model field paths; the weight letter follows the tsvector convention
+# (A is the most important) and is mapped to bm25 column weights on SQLite.
+SEARCH_INDEXES = {
+    'customers': {
+        'model': 'masterdata.Customer',
+        'table': 'search_customer_fts',
+        'columns': (('full_name', 'A'), ('email', 'A'), ('phone', 'B'), ('company', 'B')),
+        'select_related': (),
+    },
+    'estimates': {
+        'model': 'transactiondata.Estimate',
+        'table': 'search_estimate_fts',
+        'columns': (('customer__full_name', 'A'), ('customer__email', 'A'), ('notes', 'C')),
+        'select_related': ('customer',),
+    },
+    'documents': {
+        'model': 'masterdata.DocumentLibrary',
+        'table': 'search_document_fts',
+        'columns': (('title', 'A'), ('subject', 'B'), ('document_type', 'B'), ('description', 'C')),
+        'select_related': (),
+    },
+}
+
+BM25_WEIGHTS = {'A': 10.0, 'B': 4.0, 'C': 2.0, 'D': 1.0}
+# Words shorter than this are matched anywhere in a column rather than as a prefix
+SUBSTRING_MAX_LENGTH = 3
+REBUILD_CHUNK_SIZE = 1000
+
+
+@lru_cache(maxsize=None)
+def _sqlite_has_fts5():
+    import sqlite3
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(content)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def is_supported(connection=None):
+    connection = connection or default_connection
+    if connection.vendor == 'sqlite':
+        return _sqlite_has_fts5()
+    return connection.vendor == 'postgresql'
+
+
+def _column_name(path):
+    return path.replace('__', '_')
+
+
+def _resolve(instance, path):
+    value = instance
+    for part in path.split('__'):
+        value = getattr(value, part, None)
+        if value is None:
+            return ''
+    return str(value)
+
+
+def build_match_query(term, vendor):
+    """
+    Turn free text into a prefix query: every word must match the start of a token.
+    """
+    tokens = re.findall(r'\w+', (term or '').lower())
+    if not tokens:
+        return None
+    if vendor == 'postgresql':
+        return ' & '.join(f'{token}:*' for token in tokens)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def needs_substring_match(term):
+    """
+    Whether term has a short word or digits, which the prefix index cannot find inside words
+    """
+    tokens = re.findall(r'\w+', term or '')
+    return any(len(token) < SUBSTRING_MAX_LENGTH or any(c.isdigit() for c in token) for token in tokens)
+
+
+def search_queryset(queryset, index_name, term, rank=True):
+    """
+    Restrict queryset to rows matching term, annotated with search_rank and, with rank,
+    ordered best match first; callers pass rank=False when the client asked for an ordering.
+    """
+    spec = SEARCH_INDEXES[index_name]
+    vendor = default_connection.vendor
+    match = build_match_query(term, vendor)
+
+    if match is None or not is_supported() or needs_substring_match(term):
+        fallback = Q()
+        for path, _weight in spec['columns']:
+            fallback |= Q(**{f'{path}__icontains': term})
+        return queryset.filter(fallback)
+
+    table = spec['table']
+    model = queryset.model
+    outer_pk = f'"{model._meta.db_table}"."{model._meta.pk.column}"'
+
+    if vendor == 'postgresql':
+        matches_sql = f"SELECT object_id FROM {table} WHERE document @@ to_tsquery('simple', %s)"
+        rank_sql = (
+            f"SELECT -ts_rank(document, to_tsquery('simple', %s)) FROM {table} "
+            f"WHERE object_id = {outer_pk}"
+        )
+    else:
+        weights = ', '.join(str(BM25_WEIGHTS[weight]) for _path, weight in spec['columns'])
+        matches_sql = f"SELECT rowid FROM {table} WHERE {table} MATCH %s"
+        rank_sql = (
+            f"SELECT bm25({table}, {weights}) FROM {table} "
+            f"WHERE {table} MATCH %s AND rowid = {outer_pk}"
+        )
+
+    queryset = queryset.filter(
+        pk__in=RawSQL(matches_sql, [match])
+    ).annotate(
+        search_rank=RawSQL(rank_sql, [match])
+    )
+    return queryset.order_by('search_rank', '-pk') if rank else queryset
+
+
+def create_index(index_name, connection=None):
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return
+    spec = SEARCH_INDEXES[index_name]
+    table = spec['table']
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} (object_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_document ON {table} USING GIN (document)")
+        else:
+            columns = ', '.join(_column_name(path) for path, _weight in spec['columns'])
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+                f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+
+def drop_index(index_name, connection=None):
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_INDEXES[index_name]['table']}")
+
+
+def _row_params(spec, instance):
+    return [instance.pk] + [_resolve(instance, path) for path, _weight in spec['columns']]
+
+
+def _write_rows(spec, rows, connection):
+    table = spec['table']
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            document = ' || '.join(
+                f"setweight(to_tsvector('simple', %s), '{weight}')" for _path, weight in spec['columns']
+            )
+            cursor.executemany(
+                f"INSERT INTO {table} (object_id, document) VALUES (%s, {document}) "
+                f"ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+        else:
+            columns = [_column_name(path) for path, _weight in spec['columns']]
+            cursor.executemany(f"DELETE FROM {table} WHERE rowid = %s", [[row[0]] for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {table} (rowid, {', '.join(columns)}) "
+                f"VALUES (%s, {', '.join(['%s'] * len(columns))})",
+                rows
+            )
+
+
+def index_instance(index_name, instance, connection=None):
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return
+    spec = SEARCH_INDEXES[index_name]
+    _write_rows(spec, [_row_params(spec, instance)], connection)
+
+
+def index_queryset(index_name, queryset, connection=None):
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return 0
+    spec = SEARCH_INDEXES[index_name]
+    if spec['select_related']:
+        queryset = queryset.select_related(*spec['select_related'])
+
+    count = 0
+    rows = []
+    for instance in queryset.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+        rows.append(_row_params(spec, instance))
+        if len(rows) >= REBUILD_CHUNK_SIZE:
+            _write_rows(spec, rows, connection)
+            count += len(rows)
+            rows = []
+    if rows:
+        _write_rows(spec, rows, connection)
+        count += len(rows)
+    return count
+
+
+def remove_instance(index_name, pk, connection=None):
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return
+    table = SEARCH_INDEXES[index_name]['table']
+    key = 'object_id' if connection.vendor == 'postgresql' else 'rowid'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {key} = %s", [pk])
+
+
+def rebuild_index(index_name, model=None, connection=None):
+    """
+    Empty the shadow table and re-index every row of model (default: the index's model).
+    """
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return 0
+    spec = SEARCH_INDEXES[index_name]
+    model = model or apps.get_model(spec['model'])
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {spec['table']}")
+    return index_queryset(index_name, model._default_manager.all(), connection=connection)
@@ -62,6 +62,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'crm_back.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,7 +70,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware'
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'transactiondata.activity.ActivityBatchMiddleware',
 ]
 ROOT_URLCONF = 'crm_back.urls'
 
@@ -101,6 +103,12 @@ DATABASES = {
     }
 }
 
+# Cache used for ingestion rate limits and analytics results.
+# Point CACHE_URL at redis/memcached/db when running more than one process.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -159,8 +167,23 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [],
     'DEFAULT_AUTHENTICATION_CLASSES': [],
     'EXCEPTION_HANDLER': 'crm_back.custom_methods.custom_exception_handler',
+    'DEFAULT_RENDERER_CLASSES': [
+        'crm_back.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'crm_back.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# JSON responses of at least this many bytes are compressed (crm_back.compression):
+# brotli when the client accepts it and the brotli package is installed, gzip otherwise
+COMPRESSION_MIN_BYTES = env.int('COMPRESSION_MIN_BYTES', default=1024)
+# 0-11; 5 compresses about as fast as gzip's default level and noticeably smaller
+COMPRESSION_BROTLI_QUALITY = env.int('COMPRESSION_BROTLI_QUALITY', default=5)
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_HOST_USER = env('EMAIL_HOST_USER')
@@ -181,7 +204,54 @@ Q_CLUSTER = {
     'cpu_affinity': 1,
     'label': 'Django Q',
     'orm': 'default',  # Use Django ORM backend
+    # Lanes (crm_back.queues), each started with Q_CLUSTER_NAME=<lane> python manage.py qcluster
+    'ALT_CLUSTERS': {
+        # Customer-facing emails that should go out within seconds
+        'interactive': {'workers': env.int('Q_INTERACTIVE_WORKERS', default=2), 'timeout': 30, 'retry': 60, 'max_attempts': 3},
+        # Emails with a rendered PDF attached; CPU-bound
+        'pdf': {'workers': env.int('Q_PDF_WORKERS', default=2), 'timeout': 120, 'retry': 180, 'max_attempts': 2},
+        # Scheduled sweeps and write-behind rows; one long job must not hold up the others
+        'bulk': {'workers': env.int('Q_BULK_WORKERS', default=1), 'timeout': 1800, 'retry': 2400, 'max_attempts': 1},
+        # Raw endpoint lead processing
+        'ingestion': {'workers': env.int('Q_INGESTION_WORKERS', default=2), 'timeout': 300, 'retry': 420, 'max_attempts': 2},
+    },
+}
+
+# Route tasks and schedules to the Q_CLUSTER lanes by function; enable once a cluster runs for every lane
+TASK_QUEUES_ENABLED = env.bool('TASK_QUEUES_ENABLED', default=False)
+# Seconds after a stage automation or signature request ran during which the same call is dropped
+TASK_DEBOUNCE_SECONDS = env.int('TASK_DEBOUNCE_SECONDS', default=300)
+
+# Customer activity log: queue non-critical events (e.g. email opens) to Django Q
+ACTIVITY_LOG_WRITE_BEHIND = env.bool('ACTIVITY_LOG_WRITE_BEHIND', default=True)
+
+# Dashboard data endpoint: threads used for ?parallel=true
+DASHBOARD_DATA_WORKERS = env.int('DASHBOARD_DATA_WORKERS', default=4)
+
+# Serve time-range dashboard metrics from the daily rollup tables (dashboard.rollups)
+ANALYTICS_USE_ROLLUPS = env.bool('ANALYTICS_USE_ROLLUPS', default=True)
+
+# Live dashboards (dashboard.live, served only by the ASGI app): seconds between recomputes of a stream's stale widgets,
+# and the pub/sub class carrying change notifications to open streams
+DASHBOARD_LIVE_INTERVAL = env.float('DASHBOARD_LIVE_INTERVAL', default=2.0)
+DASHBOARD_LIVE_BROKER = env('DASHBOARD_LIVE_BROKER', default='dashboard.live.LocalBroker')
+
+# Streaming exports (crm_back.exports): rows read from the database and written per chunk
+EXPORT_CHUNK_SIZE = env.int('EXPORT_CHUNK_SIZE', default=2000)
+
+# Retention (crm_back.retention): days rows stay in the log tables before they are archived
+# (0 keeps them), where the archive files go, and how the daily job deletes
+RETENTION_DAYS = {
+    'transactiondata.emaillog': env.int('RETENTION_EMAIL_LOG_DAYS', default=365),
+    'transactiondata.customeractivity': env.int('RETENTION_CUSTOMER_ACTIVITY_DAYS', default=730),
+    'users.useractivities': env.int('RETENTION_USER_ACTIVITY_DAYS', default=180),
+    'masterdata.rawendpointlead': env.int('RETENTION_RAW_LEAD_DAYS', default=90),
+    'masterdata.taskexecution': env.int('RETENTION_TASK_EXECUTION_DAYS', default=90),
 }
+# Outside MEDIA_ROOT, which is served under /media/
+RETENTION_ARCHIVE_ROOT = env('RETENTION_ARCHIVE_ROOT', default=str(BASE_DIR / 'archive'))
+RETENTION_CHUNK_SIZE = env.int('RETENTION_CHUNK_SIZE', default=1000)
+RETENTION_MAX_SECONDS = env.int('RETENTION_MAX_SECONDS', default=45)
 
 # Frontend URL - change this when deploying to production
 FRONTEND_URL = env('FRONTEND_URL')
@@ -0,0 +1,147 @@
+"""
+Shared fixtures and assertions for the API tests in the app tests.py files.
+
+OrganizationTestCase holds the fixtures (an organization admin with a customer, estimate,
+invoice, payment and activity) and runs on any database. QueryPlanTestCase adds nothing
+but is skipped off SQLite, for classes that only check query plans; assertNoFullScans
+checks the plans on SQLite and only the response elsewhere.
+"""
+import re
+from datetime import date
+from io import StringIO
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+
+# Tables that grow with every tenant; a plain SCAN over one of these is a regression
+HOT_TABLES = {
+    'masterdata_customer',
+    'transactiondata_estimate',
+    'transactiondata_invoice',
+    'transactiondata_paymentreceipt',
+    'transactiondata_customeractivity',
+    'transactiondata_expense',
+    'transactiondata_purchase',
+    'sitevisits_sitevisit',
+    'masterdata_taskexecution',
+}
+
+ALIAS_PATTERN = re.compile(r'"(\w+)" (?:AS )?"?([A-Z]\d+)"?')
+# Any SCAN, with or without USING [COVERING] INDEX, reads the whole table or index; SEARCH does not
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (\w+)')
+
+
+class OrganizationTestCase(TestCase):
+    """
+    Issues real API requests as an organization admin
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        from users.models import CustomUser, Organization, OrganizationRole, OrganizationMember
+        from masterdata.models import Customer, ServiceType
+        from transactiondata.models import Estimate, Invoice, PaymentReceipt, CustomerActivity
+        from crm_back.utils import get_access_token
+        from django.core.management import call_command
+
+        call_command('seed_permissions', stdout=StringIO())
+        cls.organization = Organization.objects.create(name='Plan Test Movers')
+        role = OrganizationRole.objects.create(organization=cls.organization, name='Admin', is_default_admin=True)
+        cls.user = CustomUser.objects.create(fullname='Plan Tester', email='plans@example.com', role='Admin')
+        OrganizationMember.objects.create(user=cls.user, organization=cls.organization, role=role, is_default=True)
+        cls.token = get_access_token({'user_id': cls.user.id}, 1)
+
+        service_type = ServiceType.objects.create(service_type='Local Move', organization=cls.organization)
+        cls.customer = Customer.objects.create(
+            full_name='Jane Walker', email='jane@example.com', organization=cls.organization,
+            stage='booked', move_date=date.today(), service_type=service_type
+        )
+        cls.estimate = Estimate.objects.create(
+            customer=cls.customer, organization=cls.organization, service_type=service_type, status='sent'
+        )
+        cls.invoice = Invoice.objects.create(
+            organization=cls.organization, estimate=cls.estimate, customer=cls.customer,
+            invoice_number='INV-PLAN-1', issue_date=date.today(), due_date=date.today(),
+            total_amount=100, balance_due=100, status='sent', pdf_file='invoices/plan-test.pdf'
+        )
+        PaymentReceipt.objects.create(
+            organization=cls.organization, invoice=cls.invoice, amount=40, payment_date=date.today(),
+            payment_method='cash', pdf_file='payments/plan-test.pdf'
+        )
+        CustomerActivity.objects.create(
+            customer=cls.customer, organization=cls.organization, activity_type='note_added', title='Called customer'
+        )
+
+    def setUp(self):
+        from django.core.cache import cache
+        # Cached analytics results would hide the queries under test
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Bearer {self.token}',
+            HTTP_X_ORGANIZATION_ID=str(self.organization.id)
+        )
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, sql):
+        aliases = {alias: table for table, alias in ALIAS_PATTERN.findall(sql)}
+        scans = []
+        for detail in self.explain(sql):
+            match = FULL_SCAN_PATTERN.match(detail)
+            if match and aliases.get(match.group(1), match.group(1)) in HOT_TABLES:
+                scans.append(detail)
+        return scans
+
+    def assertNoFullScans(self, url, params=None):
+        """
+        GET url and, on SQLite, fail on a full scan of a hot table in any of its SELECTs
+        """
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200, f'{url} returned {response.status_code}: {response.content[:200]}')
+        if connection.vendor != 'sqlite':
+            return response
+
+        failures = []
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            scans = self.full_scans(sql)
+            if scans:
+                failures.append(f"{', '.join(scans)}\n    {sql}")
+        self.assertFalse(failures, f'Full table scans for {url} {params or ""}:\n' + '\n'.join(failures))
+        return response
+
+    def assertConstantQueries(self, url, params=None, sizes=(2, 10)):
+        """
+        A list page costs the same number of queries whatever its size
+        """
+        params = {**(params or {}), 'cursor': ''}
+        # Per-user lookups are cached after the first request
+        self.client.get(url, params)
+        counts = {}
+        for size in sizes:
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url, {**params, 'page_size': size})
+            self.assertEqual(response.status_code, 200, f'{url} returned {response.status_code}: {response.content[:200]}')
+            self.assertEqual(len(response.data['results']), size, f'{url} needs more than {size} rows')
+            counts[size] = len(captured)
+        self.assertEqual(len(set(counts.values())), 1, f'Queries per page size for {url}: {counts}')
+        return response
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN checks are written for SQLite')
+class QueryPlanTestCase(OrganizationTestCase):
+    """
+    Captures every SELECT the requests run and fails when EXPLAIN QUERY PLAN shows a
+    full scan of a hot table
+    """
@@ -3,7 +3,7 @@ from datetime import datetime,timedelta
 from django.conf import settings
 from users.models import CustomUser
 
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
 
 def get_access_token(payload,days):
     # For PyJWT library
@@ -32,8 +32,136 @@ def decodeJWT(bearer):
         
 class CustomPagination(PageNumberPagination):
     page_size=20
-    
 
 
+class KeysetPagination(BasePagination):
+    """
+    Opt-in cursor pagination ordered newest first on (created_at, id).
+    Lists stay unpaginated unless the request carries ?cursor= (left empty for the first page),
+    so no COUNT(*) or OFFSET is issued. Add ?include_total=true for an approximate total.
+    Views can order on another timestamp with `cursor_ordering_field`.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    total_query_param = 'include_total'
+    ordering_field = 'created_at'
+    total_cache_seconds = 60
+
+    def paginate_queryset(self, queryset, request, view=None):
+        from django.core.exceptions import ValidationError
+        from django.db.models import Q
+        from rest_framework.exceptions import NotFound
+
+        if self.cursor_query_param not in request.query_params:
+            return None
+
+        self.request = request
+        self.field_name = getattr(view, 'cursor_ordering_field', self.ordering_field)
+        self.page_size = self.get_page_size(request)
+        self.total = None
+        if request.query_params.get(self.total_query_param, '').lower() == 'true':
+            self.total = self.get_approximate_total(queryset)
+
+        try:
+            position, reverse = self.decode_cursor(request, queryset.model)
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound('Invalid cursor')
+
+        field = self.field_name
+        if position is not None:
+            value, pk = position
+            if reverse:
+                queryset = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'pk__gt': pk}))
+            else:
+                queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+
+        ordering = (field, 'pk') if reverse else (f'-{field}', '-pk')
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = has_more if reverse else position is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request, model):
+        import base64
+        import json
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        value = model._meta.get_field(self.field_name).to_python(payload['v'])
+        pk = model._meta.pk.to_python(payload['id'])
+        return (value, pk), bool(payload.get('r'))
+
+    def encode_cursor(self, obj, reverse):
+        import base64
+        import json
+        from django.utils.http import urlencode
+
+        field = obj._meta.get_field(self.field_name)
+        payload = {'v': field.value_to_string(obj), 'id': str(obj.pk), 'r': reverse}
+        cursor = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+        params = self.request.query_params.copy()
+        params[self.cursor_query_param] = cursor
+        return self.request.build_absolute_uri(self.request.path) + '?' + urlencode(params, doseq=True)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_approximate_total(self, queryset):
+        """
+        Planner row estimate on PostgreSQL, otherwise an exact count cached for a short while.
+        """
+        import hashlib
+        import json
+        from django.core.cache import cache
+        from django.db import connections
+
+        connection = connections[queryset.db]
+        sql, params = queryset.query.sql_with_params()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+
+        key = 'pagination:total:' + hashlib.md5(f'{sql}|{params}'.encode('utf-8')).hexdigest()
+        return cache.get_or_set(key, queryset.count, self.total_cache_seconds)
+
+    def get_paginated_response(self, data):
+        from collections import OrderedDict
+        from rest_framework.response import Response
 
+        body = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if self.total is not None:
+            body['count'] = self.total
+        return Response(body)
 
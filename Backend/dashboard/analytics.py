@@ -0,0 +1,955 @@
+"""
+Data sources behind the dashboard widgets.
+
+AnalyticsParams normalizes a widget request (source, date range, branch/rep and the
+f_* interactive filters) and compute_source_data() evaluates one source for an
+organization. AnalyticsDataView serves the result through the analytics cache, and
+compute_dashboard_data() evaluates every widget of a dashboard in one go.
+"""
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Sum, Avg, Q, F, QuerySet
+from django.db.models.functions import TruncMonth, TruncDay
+from django.utils import timezone
+from crm_back.metrics import Measure, MetricSpec, kpi_periods, period
+from transactiondata.models import Estimate, Invoice, PaymentReceipt, Expense, Purchase, ReceivableSnapshot
+from transactiondata.receivables import BUCKET_LABELS, BUCKET_NAMES, bucket_conditions, receivable_invoices
+from masterdata.models import Customer
+from sitevisits.models import SiteVisit
+from .formulas import FormulaError, compile_formula
+from .models import CustomMetric
+from . import cache as analytics_cache
+from . import rollups
+from .filters import get_registry
+from .timeseries import PERIODS, Series
+
+logger = logging.getLogger(__name__)
+
+# Sources DataFetchWrapper never sends the CRM filters (rep, branch, customer, source) to
+NON_CRM_SOURCES = {
+    'expenses', 'purchases', 'total_expenses', 'expense_trends',
+    'expense_by_category', 'purchase_orders', 'vendor_spending',
+}
+CRM_FILTER_KEYS = {'f_rep_id', 'f_branch_id', 'f_customer_id', 'f_source'}
+# Sources that look ahead, so the current month is not capped at today
+UPCOMING_SOURCES = {'upcoming_jobs', 'site_visits'}
+
+_shared_results = contextvars.ContextVar('analytics_shared_results', default=None)
+
+
+class AnalyticsError(Exception):
+    """
+    Raised when a source cannot be computed from the given parameters
+    """
+
+
+def calculate_trend(current, previous):
+    if not previous or previous == 0:
+        return 100.0 if current > 0 else 0.0
+    return round(((current - previous) / previous) * 100, 1)
+
+
+def resolve_date_range(start_date, end_date, time_range):
+    """
+    Turn the requested dates and widget time_range into (start, end, prev_start, prev_end).
+    All four are None when no range applies.
+    """
+    start = end = prev_start = prev_end = None
+    if start_date and end_date:
+        try:
+            from django.utils.dateparse import parse_date
+            from dateutil.relativedelta import relativedelta
+
+            # The user's selected date (usually the end of a month)
+            target_end = parse_date(end_date)
+            target_start = parse_date(start_date)
+
+            # Base end point for all relative calculations
+            end = target_end
+
+            # Default start point
+            start = target_start
+
+            # Overrides based on widget-specific time_range, anchored to the selected end_date
+            if time_range == 'last_7_days':
+                start = end - timedelta(days=7)
+            elif time_range == 'last_30_days':
+                # Anchor to start of the selected month
+                start = (end + timedelta(days=1)) - relativedelta(months=1)
+            elif time_range == 'last_90_days':
+                start = (end + timedelta(days=1)) - relativedelta(months=3)
+            elif time_range == 'last_6_months':
+                start = (end + timedelta(days=1)) - relativedelta(months=6)
+            elif time_range == 'last_12_months':
+                start = (end + timedelta(days=1)) - relativedelta(months=12)
+            elif time_range == 'this_year':
+                start = end.replace(month=1, day=1)
+            elif time_range == 'future':
+                start = target_start # Keep future logic
+                end = start + timedelta(days=730)
+            elif time_range == 'all_time':
+                start = end = None
+
+            # Standard period-over-period comparison (length-normalized)
+            if start and end:
+                days_diff = (end - start).days
+                prev_start = start - timedelta(days=days_diff + 1)
+                prev_end = start - timedelta(days=1)
+            else:
+                prev_start = prev_end = None
+
+        except Exception as e:
+            print(f"Date parsing error: {e}")
+            start = end = prev_start = prev_end = None
+    return start, end, prev_start, prev_end
+
+
+class AnalyticsParams:
+    """
+    Normalized parameters for one analytics source
+    """
+
+    def __init__(self, source, start_date=None, end_date=None, time_range=None,
+                 branch_id=None, rep_id=None, limit=10, filters=None,
+                 history_period=None, cumulative=False, rolling=None):
+        self.source = source
+        self.time_range = time_range
+        self.branch_id = branch_id
+        self.rep_id = rep_id
+        self.limit = int(limit)
+        self.filters = dict(filters or {})
+        self.start, self.end, self.prev_start, self.prev_end = resolve_date_range(start_date, end_date, time_range)
+        # History post-processing (dashboard.timeseries); unknown values are ignored
+        self.history_period = history_period if history_period in PERIODS else None
+        self.cumulative = str(cumulative).lower() in ('1', 'true')
+        try:
+            self.rolling = int(rolling) if rolling and int(rolling) > 1 else None
+        except (TypeError, ValueError):
+            self.rolling = None
+
+    @classmethod
+    def from_query_params(cls, query_params, **overrides):
+        params = {
+            'source': query_params.get('source'),
+            'start_date': query_params.get('start_date'),
+            'end_date': query_params.get('end_date'),
+            'time_range': query_params.get('time_range'),
+            'branch_id': query_params.get('branch_id'),
+            'rep_id': query_params.get('rep_id'),
+            'limit': query_params.get('limit', 10),
+            'filters': {key: value for key, value in query_params.items() if key.startswith('f_')},
+            'history_period': query_params.get('history_period'),
+            'cumulative': query_params.get('cumulative', False),
+            'rolling': query_params.get('rolling'),
+        }
+        params.update({key: value for key, value in overrides.items() if value not in (None, '')})
+        return cls(**params)
+
+    @classmethod
+    def for_widget(cls, widget, query_params):
+        """
+        Parameters DataFetchWrapper would send for widget: the month of ?date= (capped at
+        today for the current month unless the widget looks ahead), the widget's time
+        range, branch, rep and limit, and the f_* filters that apply to its source.
+        """
+        from dateutil.relativedelta import relativedelta
+        from django.utils.dateparse import parse_date
+
+        config = widget.config or {}
+        source = widget.data_source
+        start_date = query_params.get('start_date')
+        end_date = query_params.get('end_date')
+
+        selected = parse_date(query_params.get('date') or '')
+        if selected:
+            start = selected.replace(day=1)
+            end = start + relativedelta(months=1) - timedelta(days=1)
+            today = timezone.localdate()
+            looks_ahead = source in UPCOMING_SOURCES or widget.widget_type == 'Calendar'
+            if (start.year, start.month) == (today.year, today.month) and not looks_ahead:
+                end = today
+            start_date, end_date = start.isoformat(), end.isoformat()
+
+        filters = {
+            key: value for key, value in query_params.items()
+            if key.startswith('f_') and value not in (None, '')
+            and not (source in NON_CRM_SOURCES and key in CRM_FILTER_KEYS)
+        }
+
+        return cls(
+            source=source,
+            start_date=start_date,
+            end_date=end_date,
+            time_range=config.get('timeRange') or None,
+            branch_id=str(config['branch_id']) if config.get('branch_id') else None,
+            rep_id=str(config['rep_id']) if config.get('rep_id') else None,
+            limit=config.get('limit') or query_params.get('limit', 10),
+            filters=filters,
+            history_period=config.get('historyPeriod'),
+            cumulative=config.get('cumulative', False),
+            rolling=config.get('rolling'),
+        )
+
+    def cache_parts(self):
+        """
+        Everything that changes the result, in a stable order
+        """
+        return (
+            self.source, self.start, self.end, self.prev_start, self.prev_end, self.time_range,
+            self.branch_id, self.rep_id, self.limit, tuple(sorted(self.filters.items())),
+            self.history_period, self.cumulative, self.rolling,
+        )
+
+
+class SharedQuerySet(QuerySet):
+    """
+    QuerySet whose count() and aggregate() results are reused inside shared_queries(),
+    so widgets asking the database the same question only run it once.
+    """
+
+    def count(self):
+        return _shared_result(self, ('count',), super().count)
+
+    def aggregate(self, *args, **kwargs):
+        op = ('aggregate', repr(args), repr(sorted(kwargs.items())))
+        return _shared_result(self, op, functools.partial(super().aggregate, *args, **kwargs))
+
+
+def _shared_result(queryset, op, run):
+    results = _shared_results.get()
+    if results is None:
+        return run()
+    sql, sql_params = queryset.query.sql_with_params()
+    key = (queryset.db, sql, tuple(sql_params), op)
+    if key not in results:
+        results[key] = run()
+    return results[key]
+
+
+def shared(queryset):
+    return SharedQuerySet(model=queryset.model, query=queryset.query.chain(), using=queryset._db, hints=queryset._hints)
+
+
+@contextmanager
+def shared_queries():
+    """
+    Share count/aggregate results of SharedQuerySets between the sources computed in the block.
+    """
+    token = _shared_results.set({})
+    try:
+        yield
+    finally:
+        _shared_results.reset(token)
+
+
+def apply_filters(queryset, params):
+    """
+    queryset narrowed by the branch, rep and f_* filters in params that apply to its model
+    """
+    return shared(queryset.filter(get_registry().resolve_params(queryset.model, params)))
+
+
+WIN_RATE_SPEC = MetricSpec(
+    total=Measure(),
+    won=Measure(where=Q(stage__in=['booked', 'closed'])),
+)
+
+FUNNEL_STAGES = ('new_lead', 'opportunity', 'booked', 'closed')
+FUNNEL_SPEC = MetricSpec(count=Measure(bucket_field='stage', buckets=FUNNEL_STAGES))
+
+
+def kpi_values(queryset, measure, date_field, params):
+    """
+    (value, previous value) of measure in one query; the previous value is 0 without a previous period
+    """
+    result = MetricSpec(value=measure).evaluate(
+        queryset, kpi_periods(date_field, params.start, params.end, params.prev_start, params.prev_end)
+    )
+    return result['current']['value'], result.get('previous', {}).get('value', 0)
+
+
+def receivables_snapshot(org_id, params):
+    """
+    The organization's ReceivableSnapshot rows narrowed by the filters in params, or
+    None when a filter needs the invoice rows (such as the invoice's rep)
+    """
+    conditions = get_registry().resolve_params(Invoice, params).children
+    if any(lookup != 'customer_id' and not lookup.startswith('customer__') for lookup, _value in conditions):
+        return None
+    return shared(ReceivableSnapshot.objects.filter(Q(*conditions), organization_id=org_id))
+
+
+def history_start(params):
+    """
+    First day the history rows have to cover: the previous period's start when there is one
+    """
+    return params.prev_start or params.start
+
+
+def history_fields(rows, params, datetime_field=False, integer=False, previous=True):
+    """
+    "history" and, when the range has a previous period, "previous_history" lined up
+    with it, from daily (day, value) rows starting at history_start(params). Datetime
+    fields are filtered with __range on dates, so their window stops the day before end.
+    """
+    if not params.start:
+        return {"history": []}
+
+    rows = list(rows)
+    last = (lambda day: day - timedelta(days=1)) if datetime_field else (lambda day: day)
+    integer = integer and not params.rolling
+    options = {'period': params.history_period, 'cumulative': params.cumulative, 'rolling': params.rolling}
+
+    current = Series.from_rows(rows, params.start, last(params.end)).transform(**options)
+    fields = {"history": current.points(as_datetime=datetime_field, integer=integer)}
+    if previous and params.prev_start:
+        prior = Series.from_rows(rows, params.prev_start, last(params.prev_end)).transform(**options)
+        fields["previous_history"] = current.align(prior).points(as_datetime=datetime_field, integer=integer)
+    return fields
+
+
+# Base metrics a CustomMetric formula can use: (model, period date field or None for
+# point-in-time values, aggregate, aggregated field, rows counted)
+FORMULA_VARIABLES = {
+    'total_leads': (Customer, 'created_at', Count, 'id', Q()),
+    'total_revenue': (PaymentReceipt, 'payment_date', Sum, 'amount', Q()),
+    'payment_count': (PaymentReceipt, 'payment_date', Count, 'id', Q()),
+    'active_jobs': (Customer, None, Count, 'id', Q(stage__in=['booked', 'opportunity', 'in_progress'])),
+    'pipeline_value': (Estimate, None, Sum, 'total_amount', Q(status__in=['sent', 'approved', 'booked'])),
+    'due_invoices_amount': (Invoice, None, Sum, 'balance_due', ~Q(status='void')),
+    'total_expenses': (Expense, 'expense_date', Sum, 'amount', Q()),
+    'total_purchases': (Purchase, 'purchase_date', Sum, 'total_amount', Q()),
+}
+
+
+def resolve_formula_variables(org_id, variables, params):
+    """
+    Values of the formula variables for the current and previous period, with one
+    conditional aggregate query per model. Returns (current, previous); previous is
+    None when the range has no previous period. Unknown variables count as 0.
+    """
+    current = {}
+    previous = {} if params.prev_start else None
+    periods = [('current', current, params.start, params.end)]
+    if previous is not None:
+        periods.append(('previous', previous, params.prev_start, params.prev_end))
+
+    by_model = {}
+    for name in variables:
+        if name in FORMULA_VARIABLES:
+            by_model.setdefault(FORMULA_VARIABLES[name][0], []).append(name)
+        else:
+            current[name] = 0
+            if previous is not None:
+                previous[name] = 0
+
+    for model, names in by_model.items():
+        measures = {}
+        for name in names:
+            _model, date_field, function, field, rows = FORMULA_VARIABLES[name]
+            for period_name, _values, start, end in periods:
+                where = rows & period(date_field, start, end) if date_field else rows
+                measures[f'{name}_{period_name}'] = Measure(function, field, where=where)
+
+        result = MetricSpec(**measures).evaluate(apply_filters(model.objects.filter(organization_id=org_id), params))
+        for name in names:
+            for period_name, values, _start, _end in periods:
+                values[name] = float(result[f'{name}_{period_name}'])
+
+    return current, previous
+
+
+def compute_source_data(org, params):
+    """
+    Compute the widget payload for params.source
+    """
+    source = params.source
+    start, end = params.start, params.end
+    prev_start, prev_end = params.prev_start, params.prev_end
+    time_range = params.time_range
+    limit = params.limit
+    org_id = org.id
+    data = []
+
+    # Check if source is a Custom Metric ID
+    custom_metric = None
+    if source and source.startswith('custom_'):
+        try:
+            cm_id = source.split('_')[1]
+            custom_metric = CustomMetric.objects.get(id=cm_id, organization=org)
+        except:
+            pass
+
+    # Handle Custom Metric Formula Calculation
+    if custom_metric:
+        try:
+            formula = compile_formula(custom_metric.formula)
+        except FormulaError as e:
+            raise AnalyticsError(f"Formula calculation failed: {str(e)}")
+
+        current, previous = resolve_formula_variables(org_id, formula.variables, params)
+        value = formula.evaluate(current)
+        prev_value = formula.evaluate(previous) if previous is not None else None
+        trend = calculate_trend(value, prev_value) if value is not None and prev_value is not None else 0
+
+        return {
+            "value": round(value, 2) if value is not None else None,
+            "trend": trend,
+            "subtext": custom_metric.description or custom_metric.name,
+            "prefix": custom_metric.unit if custom_metric.unit == '$' else "",
+            "suffix": custom_metric.unit if custom_metric.unit != '$' else "",
+            "is_custom": True
+        }
+
+    if source == 'total_leads':
+        rows = rollups.rollup_rows(org_id, 'leads', params)
+        if rows is not None:
+            value = rollups.totals('leads', rows, start, end)[0]
+            prev_value = rollups.totals('leads', rows, prev_start, prev_end)[0] if prev_start else 0
+            history = rollups.history('leads', rows, history_start(params), end) if start else []
+        else:
+            qs = Customer.objects.filter(organization_id=org_id)
+            qs = apply_filters(qs, params)
+
+            value, prev_value = kpi_values(qs, Measure(), 'created_at', params)
+
+            history = qs.filter(created_at__range=[history_start(params), end]).annotate(
+                day=TruncDay('created_at')
+            ).values('day').annotate(value=Count('id')).order_by('day') if start else []
+
+        data = {
+            "value": value,
+            "trend": calculate_trend(value, prev_value),
+            "subtext": "Results for this period",
+            **history_fields(history, params, datetime_field=True, integer=True)
+        }
+
+    elif source == 'total_revenue':
+        # definitively use PaymentReceipt for actual money in
+        rows = rollups.rollup_rows(org_id, 'payments', params)
+        if rows is not None:
+            value = rollups.totals('payments', rows, start, end)[1]
+            prev_value = rollups.totals('payments', rows, prev_start, prev_end)[1] if start and prev_start else 0
+            history = rollups.history('payments', rows, history_start(params), end, measure='total') if start else []
+        else:
+            qs = PaymentReceipt.objects.filter(organization_id=org_id)
+            qs = apply_filters(qs, params)
+
+            # If start is None (e.g., for 'all_time' or no date range specified), calculate for all time
+            value, prev_value = kpi_values(qs, Measure(Sum, 'amount'), 'payment_date', params)
+
+            history = qs.filter(payment_date__range=[history_start(params), end]).annotate(
+                day=TruncDay('payment_date')
+            ).values('day').annotate(value=Sum('amount')).order_by('day') if start else []
+
+        data = {
+            "value": float(value),
+            "trend": calculate_trend(value, prev_value),
+            "subtext": "Actual cash collected",
+            **history_fields(history, params),
+            "prefix": "$"
+        }
+
+    elif source == 'payment_count':
+        rows = rollups.rollup_rows(org_id, 'payments', params)
+        if rows is not None:
+            value = rollups.totals('payments', rows, start, end)[0]
+            prev_value = rollups.totals('payments', rows, prev_start, prev_end)[0] if start and prev_start else 0
+            history = rollups.history('payments', rows, history_start(params), end) if start else []
+        else:
+            qs = PaymentReceipt.objects.filter(organization_id=org_id)
+            qs = apply_filters(qs, params)
+
+            value, prev_value = kpi_values(qs, Measure(), 'payment_date', params)
+
+            history = qs.filter(payment_date__range=[history_start(params), end]).annotate(
+                day=TruncDay('payment_date')
+            ).values('day').annotate(value=Count('id')).order_by('day') if start else []
+
+        data = {
+            "value": value,
+            "trend": calculate_trend(value, prev_value),
+            "subtext": "Activity for this period",
+            **history_fields(history, params, integer=True)
+        }
+
+    elif source == 'average_payment':
+        rows = rollups.rollup_rows(org_id, 'payments', params)
+        if rows is not None:
+            def average(count, total):
+                return total / count if count else 0
+
+            value = average(*rollups.totals('payments', rows, start, end))
+            prev_value = average(*rollups.totals('payments', rows, prev_start, prev_end)) if start and prev_start else 0
+        else:
+            qs = PaymentReceipt.objects.filter(organization_id=org_id)
+            qs = apply_filters(qs, params)
+
+            value, prev_value = kpi_values(qs, Measure(Avg, 'amount'), 'payment_date', params)
+
+        data = {
+            "value": round(float(value), 2),
+            "trend": calculate_trend(value, prev_value),
+            "subtext": "Performance this period",
+            "prefix": "$"
+        }
+
+    elif source == 'win_rate':
+        qs = Customer.objects.filter(organization_id=org_id)
+        qs = apply_filters(qs, params)
+
+        if time_range != 'all_time' and start:
+            periods = kpi_periods('created_at', start, end, prev_start, prev_end)
+        else:
+            periods = kpi_periods('created_at', None, None, None, None)
+        counts = WIN_RATE_SPEC.evaluate(qs, periods)
+
+        def get_rate(period_counts):
+            if not period_counts or period_counts['total'] == 0: return 0
+            return (period_counts['won'] / period_counts['total'] * 100)
+
+        curr_rate = get_rate(counts['current'])
+        prev_rate = get_rate(counts.get('previous'))
+
+        data = {
+            "value": round(curr_rate, 1),
+            "trend": round(curr_rate - prev_rate, 1),
+            "subtext": "Conversion for this period",
+            "suffix": "%"
+        }
+
+    elif source == 'lead_volume':
+        rows = rollups.rollup_rows(org_id, 'leads', params)
+        if rows is not None:
+            leads = rollups.history('leads', rows, start, end)
+        else:
+            qs = Customer.objects.filter(organization_id=org_id)
+            qs = apply_filters(qs, params)
+            if start and end:
+                qs = qs.filter(created_at__range=[start, end])
+
+            leads = qs.annotate(
+                day=TruncDay('created_at')
+            ).values('day').annotate(value=Count('id')).order_by('day')
+        if start and end:
+            data = history_fields(leads, params, datetime_field=True, integer=True, previous=False)["history"]
+        else:
+            series = Series.from_rows(leads).transform(params.history_period, params.cumulative, params.rolling)
+            data = series.points(as_datetime=True, integer=not params.rolling)
+
+    elif source == 'revenue_trends':
+        period = params.history_period or ('day' if start and end and (end-start).days <= 31 else 'month')
+        daily = period != 'month'
+        rows = rollups.rollup_rows(org_id, 'paid_invoices', params)
+        if rows is not None:
+            revenue = rollups.history(
+                'paid_invoices', rows, start, end, measure='total', period='day' if daily else 'month'
+            )
+        else:
+            qs = Invoice.objects.filter(organization_id=org_id, status='paid')
+            qs = apply_filters(qs, params)
+            if start and end:
+                qs = qs.filter(issue_date__range=[start, end])
+
+            revenue = qs.annotate(
+                day=TruncDay('issue_date') if daily else TruncMonth('issue_date')
+            ).values('day').annotate(value=Sum('total_amount')).order_by('day')
+        series = Series.from_rows(revenue, start, end, period='day' if daily else 'month')
+        data = series.transform(period, params.cumulative, params.rolling).points()
+
+    elif source == 'branch_performance':
+        qs = Customer.objects.filter(organization_id=org_id, stage__in=['booked', 'closed'])
+        qs = apply_filters(qs, params)
+        if start and end:
+            qs = qs.filter(move_date__range=[start, end])
+
+        performance = qs.values(name=F('branch__name')).annotate(
+            value=Count('id')
+        ).order_by('-value')
+        data = [{"name": i['name'] or "Unassigned", "value": i['value']} for i in performance]
+
+    elif source == 'deals_by_stage':
+        qs = Customer.objects.filter(organization_id=org_id)
+        qs = apply_filters(qs, params)
+        stages = qs.values(name=F('stage')).annotate(value=Count('id')).order_by('-value')
+        data = [{"name": i['name'], "value": i['value']} for i in stages]
+
+    elif source == 'lead_source_distribution':
+        qs = Customer.objects.filter(organization_id=org_id)
+        qs = apply_filters(qs, params)
+        if start and end:
+            qs = qs.filter(created_at__range=[start, end])
+
+        sources = qs.values('source').annotate(value=Count('id')).order_by('-value')
+
+        # Map keys to labels for better visualization
+        labels = {
+            'moveit': 'Moveit',
+            'mymovingloads': 'MyMovingLoads',
+            'moving24': 'Moving24',
+            'baltic_website': 'Baltic Website',
+            'n1m_website': 'N1M Website',
+            'google': 'Google',
+            'referral': 'Referral',
+            'other': 'Other'
+        }
+
+        data = [
+            {
+                "name": labels.get(i['source'], (i['source'] or "Other").replace('_', ' ').title()), 
+                "value": i['value']
+            } 
+            for i in sources
+        ]
+
+    elif source == 'upcoming_jobs':
+        # Include all booked customers that are either in the future or have no date set yet
+        qs = Customer.objects.filter(
+            organization_id=org_id, 
+            stage='booked'
+        ).filter(
+            Q(move_date__gte=timezone.now().date()) | Q(move_date__isnull=True)
+        )
+        qs = apply_filters(qs, params)
+        # Order nulls last (assuming they are less urgent than dated jobs)
+        customers = qs.order_by(F('move_date').asc(nulls_last=True))[:limit]
+
+        data = []
+        for c in customers:
+            est = c.estimates.filter(status__in=['approved', 'booked', 'invoiced']).first()
+            data.append({
+                "id": c.id,
+                "customer": c.full_name,
+                "date": c.move_date,
+                "amount": float(est.total_amount) if est else 0,
+                "service": c.service_type.service_type if c.service_type else "General",
+                "estimate_id": est.id if est else None
+            })
+
+    elif source == 'active_jobs':
+        qs = Customer.objects.filter(organization_id=org_id, stage__in=['booked', 'opportunity', 'in_progress'])
+        qs = apply_filters(qs, params)
+
+        value = qs.count()
+        data = {
+            "value": value,
+            "trend": 0,
+            "subtext": "Current status",
+            "history": [] 
+        }
+
+    elif source == 'average_deal_size':
+        qs = Invoice.objects.filter(organization_id=org_id, status='paid')
+        qs = apply_filters(qs, params)
+        avg = qs.aggregate(avg=Avg('total_amount'))['avg'] or 0
+        data = {
+            "value": round(float(avg), 2),
+            "trend": 0,
+            "prefix": "$"
+        }
+
+    elif source == 'pipeline_value':
+        qs = Estimate.objects.filter(organization_id=org_id, status__in=['sent', 'approved', 'booked'])
+        qs = apply_filters(qs, params)
+        value = qs.aggregate(total=Sum('total_amount'))['total'] or 0
+        data = {
+            "value": float(value),
+            "trend": 0,
+            "prefix": "$"
+        }
+
+    elif source == 'due_invoices_amount':
+        qs = Invoice.objects.filter(organization_id=org_id).exclude(status='void')
+        qs = apply_filters(qs, params)
+        total = qs.aggregate(total=Sum('balance_due'))['total'] or 0
+
+        # Simple history for the trend
+        history = qs.filter(issue_date__range=[start, end]).annotate(
+            day=TruncDay('issue_date')
+        ).values('day').annotate(value=Sum('balance_due')).order_by('day') if start else []
+
+        data = {
+            "value": float(total),
+            "trend": 0,
+            "subtext": "Total outstanding balance",
+            "prefix": "$",
+            **history_fields(history, params, previous=False)
+        }
+
+    elif source == 'accounts_receivable':
+        snapshots = receivables_snapshot(org_id, params)
+        if snapshots is not None:
+            receivables = snapshots.filter(open_balance__gt=0).values(
+                'customer__id', 'customer__full_name',
+                pending_amount=F('open_balance'), invoices=F('open_invoice_count')
+            ).order_by('-open_balance')[:limit]
+        else:
+            qs = receivable_invoices().filter(organization_id=org_id, balance_due__gt=0)
+            qs = apply_filters(qs, params)
+            receivables = qs.values(
+                'customer__id', 'customer__full_name'
+            ).annotate(
+                pending_amount=Sum('balance_due'),
+                invoices=Count('id')
+            ).order_by('-pending_amount')[:limit]
+
+        data = [
+            {
+                "id": r['customer__id'],
+                "customer": r['customer__full_name'],
+                "amount": float(r['pending_amount']),
+                "count": r['invoices'],
+                "type": "Pending Balance",
+                "date": timezone.now().date()
+            }
+            for r in receivables
+        ]
+
+    elif source == 'receivables_aging':
+        snapshots = receivables_snapshot(org_id, params)
+        if snapshots is not None:
+            totals = snapshots.aggregate(**{bucket: Sum(bucket) for bucket in BUCKET_NAMES})
+        else:
+            qs = receivable_invoices().filter(organization_id=org_id, balance_due__gt=0)
+            qs = apply_filters(qs, params)
+            totals = qs.aggregate(**{
+                bucket: Sum('balance_due', filter=condition)
+                for bucket, condition in bucket_conditions(timezone.localdate()).items()
+            })
+        data = [{"name": BUCKET_LABELS[bucket], "value": float(totals[bucket] or 0)} for bucket in BUCKET_NAMES]
+
+    elif source == 'due_invoices':
+        qs = Invoice.objects.filter(organization_id=org_id, balance_due__gt=0).exclude(status='void')
+        qs = apply_filters(qs, params)
+        invoices = qs.select_related('customer').order_by('-balance_due')[:limit]
+
+        data = [
+            {
+                "id": inv.id,
+                "invoice_id": inv.id,
+                "title": inv.invoice_number,
+                "customer": inv.customer.full_name,
+                "date": inv.issue_date,
+                "amount": float(inv.balance_due),
+                "total_amount": float(inv.total_amount),
+                "type": f"Invoice {inv.invoice_number}",
+                "status": inv.get_status_display()
+            }
+            for inv in invoices
+        ]
+
+    elif source == 'revenue_by_service_type':
+        qs = Invoice.objects.filter(organization_id=org_id, status='paid')
+        qs = apply_filters(qs, params)
+        breakdown = qs.values(name=F('service_type__service_type')).annotate(
+            value=Sum('total_amount')
+        ).order_by('-value')
+        data = [{"name": i['name'] or "General", "value": float(i['value'] or 0)} for i in breakdown]
+
+    elif source == 'recent_activities':
+        qs = Customer.objects.filter(organization_id=org_id).order_by('-updated_at')[:limit]
+        data = [
+            {
+                "id": c.id,
+                "customer": c.full_name,
+                "date": c.updated_at,
+                "type": "Stage Update",
+                "description": f"Moved to {c.get_stage_display()}"
+            }
+            for c in qs
+        ]
+
+    elif source == 'recent_invoices':
+        qs = Invoice.objects.filter(organization_id=org_id).order_by('-issue_date')[:limit]
+        data = [
+            {
+                "id": inv.id,
+                "title": inv.invoice_number,
+                "customer": inv.customer.full_name,
+                "date": inv.issue_date,
+                "amount": float(inv.total_amount),
+                "status": inv.get_status_display()
+            }
+            for inv in qs
+        ]
+
+    elif source == 'recent_payments':
+        qs = PaymentReceipt.objects.filter(organization_id=org_id).order_by('-payment_date')[:limit]
+        data = [
+            {
+                "id": p.id,
+                "title": f"Payment for {p.invoice.invoice_number}",
+                "customer": p.invoice.customer.full_name,
+                "date": p.payment_date,
+                "amount": float(p.amount),
+                "type": p.get_payment_method_display()
+            }
+            for p in qs
+        ]
+
+    elif source == 'service_funnel':
+        qs = Customer.objects.filter(organization_id=org_id)
+        qs = apply_filters(qs, params)
+        if start and end:
+            qs = qs.filter(created_at__range=[start, end])
+
+        counts = FUNNEL_SPEC.evaluate(qs)['count']
+        data = [
+            {"step": stage.replace('_', ' ').title(), "value": counts[stage]}
+            for stage in FUNNEL_STAGES
+        ]
+
+    elif source == 'site_visits':
+        qs = SiteVisit.objects.filter(organization_id=org_id)
+        qs = apply_filters(qs, params)
+        if start and end:
+            qs = qs.filter(scheduled_at__date__range=[start, end])
+
+        # Simple list for calendar
+        visits = qs.select_related('customer').order_by('scheduled_at')
+        data = [
+            {
+                "id": v.id,
+                "title": v.customer.full_name,
+                "start": v.scheduled_at,
+                "end": v.scheduled_at + timedelta(hours=2), # Default 2hr duration for viz
+                "status": v.status,
+                "description": v.notes
+            }
+            for v in visits
+        ]
+
+    elif source == 'total_expenses':
+        rows = rollups.rollup_rows(org_id, 'expenses', params)
+        if rows is not None:
+            value = rollups.totals('expenses', rows, start, end)[1]
+            prev_value = rollups.totals('expenses', rows, prev_start, prev_end)[1] if start and prev_start else 0
+            history = rollups.history('expenses', rows, history_start(params), end, measure='total') if start else []
+        else:
+            qs = Expense.objects.filter(organization_id=org_id)
+            qs = apply_filters(qs, params)
+
+            value, prev_value = kpi_values(qs, Measure(Sum, 'amount'), 'expense_date', params)
+
+            history = qs.filter(expense_date__range=[history_start(params), end]).annotate(
+                day=TruncDay('expense_date')
+            ).values('day').annotate(value=Sum('amount')).order_by('day') if start else []
+
+        data = {
+            "value": float(value),
+            "trend": calculate_trend(value, prev_value),
+            "subtext": "Operational expenses",
+            "prefix": "$",
+            **history_fields(history, params)
+        }
+
+    elif source == 'total_purchases':
+        rows = rollups.rollup_rows(org_id, 'purchases', params)
+        if rows is not None:
+            value = rollups.totals('purchases', rows, start, end)[1]
+            prev_value = rollups.totals('purchases', rows, prev_start, prev_end)[1] if start and prev_start else 0
+            history = rollups.history('purchases', rows, history_start(params), end, measure='total') if start else []
+        else:
+            qs = Purchase.objects.filter(organization_id=org_id)
+            qs = apply_filters(qs, params)
+
+            value, prev_value = kpi_values(qs, Measure(Sum, 'total_amount'), 'purchase_date', params)
+
+            history = qs.filter(purchase_date__range=[history_start(params), end]).annotate(
+                day=TruncDay('purchase_date')
+            ).values('day').annotate(value=Sum('total_amount')).order_by('day') if start else []
+
+        data = {
+            "value": float(value),
+            "trend": calculate_trend(value, prev_value),
+            "subtext": "Asset & Inventory purchases",
+            "prefix": "$",
+            **history_fields(history, params)
+        }
+
+    elif source == 'recent_expenses':
+        qs = Expense.objects.filter(organization_id=org_id).order_by('-expense_date')[:limit]
+        data = [
+            {
+                "id": e.id,
+                "title": e.title,
+                "category": e.category.name if e.category else "Uncategorized",
+                "date": e.expense_date,
+                "amount": float(e.amount),
+                "type": "Expense"
+            }
+            for e in qs
+        ]
+
+    elif source == 'recent_purchases':
+        qs = Purchase.objects.filter(organization_id=org_id).order_by('-purchase_date')[:limit]
+        data = [
+            {
+                "id": p.id,
+                "title": p.item_name,
+                "vendor": p.vendor,
+                "date": p.purchase_date,
+                "amount": float(p.total_amount),
+                "type": "Purchase"
+            }
+            for p in qs
+        ]
+
+    return data
+
+
+def _widget_payload(org, params):
+    try:
+        data, cache_hit = analytics_cache.get_or_compute(org, params, compute_source_data)
+    except AnalyticsError as e:
+        return {"source": params.source, "error": str(e)}
+    except Exception:
+        logger.exception(f"Dashboard widget source {params.source} failed")
+        return {"source": params.source, "error": "Failed to load data"}
+    return {"source": params.source, "data": data, "cache": 'hit' if cache_hit else 'miss'}
+
+
+def _widget_payload_in_thread(org, params):
+    try:
+        return _widget_payload(org, params)
+    finally:
+        # Worker threads open their own connections; don't leave them behind
+        connections.close_all()
+
+
+def compute_dashboard_data(org, widgets, query_params, parallel=False):
+    """
+    Evaluate widgets for one dashboard request and return {widget_id: payload}.
+
+    Widgets with identical parameters are computed once, and identical count/aggregate
+    queries are shared between the remaining sources. With parallel=True the distinct
+    parameter groups run on a thread pool of DASHBOARD_DATA_WORKERS threads.
+    """
+    groups = {}
+    for widget in widgets:
+        params = AnalyticsParams.for_widget(widget, query_params)
+        groups.setdefault(params.cache_parts(), (params, []))[1].append(widget.id)
+
+    with shared_queries():
+        workers = min(getattr(settings, 'DASHBOARD_DATA_WORKERS', 4), len(groups))
+        if parallel and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    key: pool.submit(contextvars.copy_context().run, _widget_payload_in_thread, org, params)
+                    for key, (params, _widget_ids) in groups.items()
+                }
+                payloads = {key: future.result() for key, future in futures.items()}
+        else:
+            payloads = {key: _widget_payload(org, params) for key, (params, _widget_ids) in groups.items()}
+
+    return {
+        widget_id: payloads[key]
+        for key, (_params, widget_ids) in groups.items()
+        for widget_id in widget_ids
+    }
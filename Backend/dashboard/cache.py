@@ -0,0 +1,172 @@
+"""
+Result cache for analytics sources.
+
+Entries are keyed by organization, source and the normalized AnalyticsParams, plus a
+generation counter for every model the source reads. dashboard.signals bumps an
+organization's counter for a model on post_save/post_delete, which moves the affected
+sources to new keys, so results stay cached until the underlying data changes instead
+of expiring on a short TTL.
+
+Counters and entries live in the default cache. Deployments running several processes
+(web workers plus the Django Q cluster) need a shared backend via CACHE_URL.
+"""
+import hashlib
+import pickle
+
+from django.core.cache import cache
+from django.utils import timezone
+
+
+CACHE_TIMEOUT = 60 * 60 * 24
+GENERATION_KEY = 'analytics:gen:{org_id}:{model}'
+ENTRY_KEY = 'analytics:data:{org_id}:{digest}'
+STATS_KEY = 'analytics:stats:{source}:{outcome}'
+STATS_SOURCES_KEY = 'analytics:stats:sources'
+
+CUSTOMER = 'masterdata.customer'
+BRANCH = 'masterdata.branch'
+SERVICE_TYPE = 'masterdata.servicetype'
+ESTIMATE = 'transactiondata.estimate'
+INVOICE = 'transactiondata.invoice'
+PAYMENT = 'transactiondata.paymentreceipt'
+EXPENSE = 'transactiondata.expense'
+PURCHASE = 'transactiondata.purchase'
+TRANSACTION_CATEGORY = 'transactiondata.transactioncategory'
+SITE_VISIT = 'sitevisits.sitevisit'
+CUSTOM_METRIC = 'dashboard.custommetric'
+
+TRACKED_MODELS = (
+    CUSTOMER, BRANCH, SERVICE_TYPE, ESTIMATE, INVOICE, PAYMENT,
+    EXPENSE, PURCHASE, TRANSACTION_CATEGORY, SITE_VISIT, CUSTOM_METRIC,
+)
+
+# Models each source reads, including the ones reached through branch/rep/f_* filters
+SOURCE_DEPENDENCIES = {
+    'total_leads': (CUSTOMER,),
+    'total_revenue': (PAYMENT, INVOICE, CUSTOMER),
+    'payment_count': (PAYMENT, INVOICE, CUSTOMER),
+    'average_payment': (PAYMENT, INVOICE, CUSTOMER),
+    'win_rate': (CUSTOMER,),
+    'lead_volume': (CUSTOMER,),
+    'revenue_trends': (INVOICE, CUSTOMER),
+    'branch_performance': (CUSTOMER, BRANCH),
+    'deals_by_stage': (CUSTOMER,),
+    'lead_source_distribution': (CUSTOMER,),
+    'upcoming_jobs': (CUSTOMER, ESTIMATE, SERVICE_TYPE),
+    'active_jobs': (CUSTOMER,),
+    'average_deal_size': (INVOICE, CUSTOMER),
+    'pipeline_value': (ESTIMATE, CUSTOMER),
+    'due_invoices_amount': (INVOICE, CUSTOMER),
+    'accounts_receivable': (INVOICE, CUSTOMER),
+    'receivables_aging': (INVOICE, CUSTOMER),
+    'due_invoices': (INVOICE, CUSTOMER),
+    'revenue_by_service_type': (INVOICE, CUSTOMER),
+    'recent_activities': (CUSTOMER,),
+    'recent_invoices': (INVOICE, CUSTOMER),
+    'recent_payments': (PAYMENT, INVOICE, CUSTOMER),
+    'service_funnel': (CUSTOMER,),
+    'site_visits': (SITE_VISIT, CUSTOMER),
+    'total_expenses': (EXPENSE, CUSTOMER),
+    'total_purchases': (PURCHASE,),
+    'recent_expenses': (EXPENSE, TRANSACTION_CATEGORY),
+    'recent_purchases': (PURCHASE,),
+}
+
+
+def get_dependencies(source):
+    # Custom metrics and unknown sources may read anything
+    return SOURCE_DEPENDENCIES.get(source, TRACKED_MODELS)
+
+
+def _generation_key(org_id, model):
+    return GENERATION_KEY.format(org_id=org_id if org_id is not None else 'global', model=model)
+
+
+def bump_generation(org_id, model):
+    key = _generation_key(org_id, model)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_generations(org_id, models):
+    # Rows without an organization (shared lookups) invalidate every organization
+    keys = [_generation_key(org_id, model) for model in models]
+    keys += [_generation_key(None, model) for model in models]
+    values = cache.get_many(keys)
+    return tuple(values.get(key, 0) for key in keys)
+
+
+def build_key(org_id, params):
+    parts = (
+        params.cache_parts(),
+        get_generations(org_id, get_dependencies(params.source)),
+        # Sources such as upcoming_jobs are relative to today
+        timezone.localdate(),
+    )
+    digest = hashlib.sha1(pickle.dumps(parts)).hexdigest()
+    return ENTRY_KEY.format(org_id=org_id, digest=digest)
+
+
+def get_or_compute(org, params, compute):
+    """
+    Return (data, cache_hit) for params, calling compute(org, params) on a miss.
+    """
+    key = build_key(org.id, params)
+    data = cache.get(key)
+    if data is not None:
+        record(params.source, 'hit')
+        return data, True
+
+    data = compute(org, params)
+    cache.set(key, data, timeout=CACHE_TIMEOUT)
+    record(params.source, 'miss')
+    return data, False
+
+
+def _stats_source(source):
+    if source and source.startswith('custom_'):
+        return 'custom'
+    return source or 'unknown'
+
+
+def record(source, outcome):
+    source = _stats_source(source)
+    sources = cache.get(STATS_SOURCES_KEY, set())
+    if source not in sources:
+        cache.set(STATS_SOURCES_KEY, sources | {source}, timeout=None)
+    key = STATS_KEY.format(source=source, outcome=outcome)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def _rate(hits, misses):
+    total = hits + misses
+    return round(hits / total * 100, 1) if total else 0.0
+
+
+def get_stats():
+    sources = sorted(cache.get(STATS_SOURCES_KEY, set()))
+    keys = [STATS_KEY.format(source=s, outcome=o) for s in sources for o in ('hit', 'miss')]
+    values = cache.get_many(keys)
+
+    by_source = {}
+    total_hits = total_misses = 0
+    for source in sources:
+        hits = values.get(STATS_KEY.format(source=source, outcome='hit'), 0)
+        misses = values.get(STATS_KEY.format(source=source, outcome='miss'), 0)
+        total_hits += hits
+        total_misses += misses
+        by_source[source] = {'hits': hits, 'misses': misses, 'hit_rate': _rate(hits, misses)}
+
+    return {
+        'hits': total_hits,
+        'misses': total_misses,
+        'hit_rate': _rate(total_hits, total_misses),
+        'sources': by_source,
+    }
@@ -0,0 +1,192 @@
+"""
+Dashboard filters for the models the analytics read.
+
+FILTER_PATHS declares, per model, the lookups behind the branch_id and rep_id
+parameters, the model's reporting date field and the relation path to its Customer.
+FilterRegistry compiles each entry once into a whitelist of the f_* keys the model
+accepts (its own fields, then the Customer's fields through that path), and
+resolve() turns a request's parameters into one Q for a model. Keys outside the
+whitelist are ignored: dashboard-wide filters reach every widget, and most of them
+only apply to some sources.
+
+The analytics sources, the rollup tables and the exports share the registry, so a
+filter means the same thing wherever it is applied.
+"""
+from django.apps import apps
+from django.db.models import Q
+
+
+class FilterPaths:
+    """
+    Where a model's branch, rep, date and customer live. customer is the lookup prefix
+    of the related Customer ('' for Customer itself, None when there is none).
+    """
+
+    def __init__(self, branch=None, rep=None, date=None, customer=None):
+        self.branch = branch
+        self.rep = rep
+        self.date = date
+        self.customer = customer
+
+
+FILTER_PATHS = {
+    'masterdata.customer': FilterPaths(branch='branch_id', rep='assigned_to_id', date='created_at', customer=''),
+    'transactiondata.estimate': FilterPaths(
+        branch='customer__branch_id', rep='assigned_to_id', date='created_at', customer='customer__'
+    ),
+    'transactiondata.invoice': FilterPaths(
+        branch='customer__branch_id', rep='assigned_to_id', date='issue_date', customer='customer__'
+    ),
+    # A payment belongs to the rep and customer of its invoice
+    'transactiondata.paymentreceipt': FilterPaths(
+        branch='invoice__customer__branch_id', rep='invoice__assigned_to_id', date='payment_date',
+        customer='invoice__customer__'
+    ),
+    'transactiondata.expense': FilterPaths(
+        branch='customer__branch_id', rep='customer__assigned_to_id', date='expense_date', customer='customer__'
+    ),
+    'transactiondata.purchase': FilterPaths(rep='created_by_id', date='purchase_date'),
+    'sitevisits.sitevisit': FilterPaths(
+        branch='customer__branch_id', rep='customer__assigned_to_id', date='scheduled_at', customer='customer__'
+    ),
+}
+
+# Keys charts send for the clicked category; resolved to source or stage by their value
+GENERIC_KEYS = ('name', 'category', 'label', 'xAxisKey')
+# Values that are lead sources even though they are not in SOURCE_CHOICES
+EXTRA_SOURCES = ('google', 'moveit', 'referral', 'facebook')
+
+
+def _labels(choices):
+    return {label.lower(): key for key, label in choices}
+
+
+class CompiledFilters:
+    """
+    The f_* whitelist of one model: filter key -> lookup
+    """
+
+    def __init__(self, paths, lookups):
+        self.paths = paths
+        self.lookups = lookups
+
+
+class FilterRegistry:
+    """
+    FILTER_PATHS compiled per model, plus the label -> key maps for sources and stages
+    """
+
+    def __init__(self, paths, registry=apps):
+        from masterdata.models import SOURCE_CHOICES, STAGE_CHOICES
+
+        self.paths = paths
+        self.registry = registry
+        self.source_keys = _labels(SOURCE_CHOICES)
+        self.stage_keys = _labels(STAGE_CHOICES)
+        self._compiled = {label: self._compile(label) for label in paths}
+
+    def _compile(self, label):
+        paths = self.paths[label]
+        model = self.registry.get_model(label)
+
+        lookups = {}
+        if paths.customer is not None:
+            customer = self.registry.get_model('masterdata', 'Customer')
+            for field in customer._meta.concrete_fields:
+                lookups[field.name] = lookups[field.attname] = paths.customer + field.attname
+            lookups['customer_id'] = paths.customer + 'id'
+        for field in model._meta.concrete_fields:
+            lookups[field.name] = lookups[field.attname] = field.attname
+        if paths.branch:
+            lookups['branch_id'] = paths.branch
+        if paths.rep:
+            lookups['rep_id'] = paths.rep
+        return CompiledFilters(paths, lookups)
+
+    def get(self, model):
+        """
+        CompiledFilters for model, or None when the model is not registered
+        """
+        return self._compiled.get(model._meta.label_lower)
+
+    def branch_lookup(self, model):
+        compiled = self.get(model)
+        return compiled.paths.branch if compiled else None
+
+    def rep_lookup(self, model):
+        compiled = self.get(model)
+        return compiled.paths.rep if compiled else None
+
+    def date_lookup(self, model):
+        compiled = self.get(model)
+        return compiled.paths.date if compiled else None
+
+    def filter_lookup(self, model, field_name):
+        """
+        Lookup applying the f_<field_name> filter to model, or None when it is not whitelisted
+        """
+        compiled = self.get(model)
+        return compiled.lookups.get(field_name) if compiled else None
+
+    def normalize(self, field_name, value):
+        """
+        Map an interactive filter (f_ prefix removed) to a filter key and DB value. Charts
+        send display labels and generic keys such as 'name', so those are matched against
+        the source and stage choices.
+        """
+        label = str(value).lower()
+        if field_name in GENERIC_KEYS:
+            if label in self.source_keys:
+                return 'source', self.source_keys[label]
+            if label in self.stage_keys:
+                return 'stage', self.stage_keys[label]
+            if label in EXTRA_SOURCES:
+                return 'source', value
+
+        if field_name == 'source':
+            value = self.source_keys.get(label, value)
+        elif field_name == 'stage':
+            value = self.stage_keys.get(label, value)
+        return field_name, value
+
+    def resolve(self, model, branch_id=None, rep_id=None, filters=None):
+        """
+        One Q applying the branch, rep and f_* filters that exist for model
+        """
+        compiled = self.get(model)
+        if compiled is None:
+            return Q()
+
+        conditions = []
+        if branch_id and compiled.paths.branch:
+            conditions.append((compiled.paths.branch, branch_id))
+        if rep_id and compiled.paths.rep:
+            conditions.append((compiled.paths.rep, rep_id))
+
+        for key, value in (filters or {}).items():
+            if not key.startswith('f_'):
+                continue
+            field_name, value = self.normalize(key[2:], value)
+            lookup = compiled.lookups.get(field_name)
+            if lookup:
+                conditions.append((lookup, value))
+        return Q(*conditions)
+
+    def resolve_params(self, model, params):
+        """
+        resolve() for an AnalyticsParams
+        """
+        return self.resolve(model, params.branch_id, params.rep_id, params.filters)
+
+
+_registry = None
+
+
+def get_registry():
+    """
+    The registry for the installed models, compiled on first use (DashboardConfig.ready)
+    """
+    global _registry
+    if _registry is None:
+        _registry = FilterRegistry(FILTER_PATHS)
+    return _registry
@@ -0,0 +1,285 @@
+"""
+Live dashboard updates over server-sent events.
+
+dashboard.signals publishes (organization, model) after every committed write to a
+model the analytics read. Each open /dashboards/{id}/live/ stream subscribes to its
+organization, marks the widgets whose sources read that model as stale, and at most
+once per DASHBOARD_LIVE_INTERVAL seconds recomputes the stale widgets and sends the
+payloads that changed. A burst of writes therefore costs one recompute per widget,
+and concurrent streams share the work through the analytics cache.
+
+LocalBroker only reaches streams in the same process as the write. Deployments with
+several web processes, or writes made by the Django Q cluster, need a broker shared
+between processes: point DASHBOARD_LIVE_BROKER at a class with the same
+publish/subscribe/unsubscribe interface.
+
+Streams require an ASGI server (`uvicorn crm_back.asgi:application`). Under WSGI, Django
+consumes an async streaming response completely before sending any of it, so an endless
+stream would never deliver an event; the endpoint answers 501 there instead, including
+under `manage.py runserver`.
+
+EventSource cannot send headers. Clients that can send Authorization and
+X-Organization-Id use them as on any endpoint; browsers first POST
+/dashboards/{id}/live-token/ with their headers and open the stream with the returned
+?stream_token=, which is good for one connection within STREAM_TOKEN_SECONDS. Bearer
+tokens therefore never appear in URLs, access logs or proxy logs.
+"""
+import asyncio
+import json
+import logging
+import secrets
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+
+from . import cache as analytics_cache
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+RECONNECT_MILLISECONDS = 5000
+STREAM_TOKEN_KEY = 'dashboard:live:token:{token}'
+STREAM_TOKEN_SECONDS = 60
+
+
+class LocalBroker:
+    """
+    In-process pub/sub keyed by organization id. publish() may be called from any
+    thread; subscribers receive (organization_id, model_label) on their own event loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, organization_id):
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(organization_id, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, organization_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(organization_id, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(organization_id, None)
+
+    def publish(self, organization_id, model_label):
+        with self._lock:
+            if organization_id is None:
+                # Shared rows (no organization) can change every organization's numbers
+                targets = [entry for entries in self._subscribers.values() for entry in entries]
+            else:
+                targets = list(self._subscribers.get(organization_id, ()))
+        for loop, queue in targets:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (organization_id, model_label))
+            except RuntimeError:
+                # The subscriber's loop has closed; it unsubscribes on its way out
+                pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'DASHBOARD_LIVE_BROKER', 'dashboard.live.LocalBroker'))()
+    return _broker
+
+
+def publish_change(organization_id, model_label):
+    try:
+        get_broker().publish(organization_id, model_label)
+    except Exception as e:
+        logger.error(f"Failed to publish dashboard change for {model_label}: {e}")
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def issue_stream_token(user, organization, dashboard):
+    """
+    Single-use token opening one stream of dashboard for user within STREAM_TOKEN_SECONDS
+    """
+    token = secrets.token_urlsafe(32)
+    cache.set(
+        STREAM_TOKEN_KEY.format(token=token),
+        {'user_id': user.id, 'organization_id': organization.id, 'dashboard_id': dashboard.id},
+        timeout=STREAM_TOKEN_SECONDS
+    )
+    return token
+
+
+def consume_stream_token(token):
+    """
+    The token's grant, or None when it is unknown, expired or already used
+    """
+    key = STREAM_TOKEN_KEY.format(token=token)
+    grant = cache.get(key)
+    # Of two connections racing for the same token only one deletes it
+    if grant is None or not cache.delete(key):
+        return None
+    return grant
+
+
+def _authenticate(request, pk):
+    """
+    Run the API's token and organization checks on the headers, or accept a stream token
+    issued for this dashboard
+    """
+    from rest_framework.exceptions import PermissionDenied
+    from crm_back.custom_methods import isAuthenticatedCustom
+    from users.models import CustomUser, Organization
+
+    stream_token = request.GET.get('stream_token')
+    if 'HTTP_AUTHORIZATION' not in request.META and stream_token:
+        grant = consume_stream_token(stream_token)
+        if grant is None or grant['dashboard_id'] != pk:
+            return False
+        request.user = CustomUser.objects.filter(pk=grant['user_id']).first()
+        request.organization = Organization.objects.filter(pk=grant['organization_id']).first()
+        return request.user is not None
+
+    try:
+        return isAuthenticatedCustom().has_permission(request, None)
+    except PermissionDenied:
+        return False
+
+
+def load_dashboard(request, pk):
+    """
+    (dashboard, widgets) the user may watch, or (None, None)
+    """
+    from .models import Dashboard
+
+    user, org = request.user, getattr(request, 'organization', None)
+    if not org:
+        return None, None
+
+    dashboards = Dashboard.objects.filter(pk=pk, organization=org)
+    if not user.is_superuser:
+        role_ids = user.memberships.filter(organization=org).values_list('role_id', flat=True)
+        dashboards = dashboards.filter(is_active=True).annotate(
+            role_count=Count('shared_with_roles')
+        ).filter(Q(role_count=0) | Q(shared_with_roles__id__in=role_ids)).distinct()
+
+    dashboard = dashboards.first()
+    if dashboard is None:
+        return None, None
+    widgets = list(dashboard.widgets.filter(is_active=True).exclude(widget_type='control'))
+    return dashboard, widgets
+
+
+class DashboardStream:
+    """
+    One client's event stream for a dashboard
+    """
+
+    def __init__(self, organization, dashboard, widgets, query_params):
+        from .analytics import AnalyticsParams
+
+        self.organization = organization
+        self.dashboard = dashboard
+        self.widgets = {widget.id: widget for widget in widgets}
+        self.query_params = query_params
+        self.dependencies = {
+            widget.id: set(analytics_cache.get_dependencies(AnalyticsParams.for_widget(widget, query_params).source))
+            for widget in widgets
+        }
+        self.interval = getattr(settings, 'DASHBOARD_LIVE_INTERVAL', 2)
+        self.sent = {}
+
+    def compute(self, widget_ids):
+        from .analytics import compute_dashboard_data
+        widgets = [self.widgets[widget_id] for widget_id in widget_ids]
+        return compute_dashboard_data(self.organization, widgets, self.query_params)
+
+    def stale_widgets(self, model_label):
+        return {widget_id for widget_id, models in self.dependencies.items() if model_label in models}
+
+    def changed(self, payloads):
+        changed = {}
+        for widget_id, payload in payloads.items():
+            encoded = json.dumps(payload, cls=DjangoJSONEncoder, sort_keys=True)
+            if self.sent.get(widget_id) != encoded:
+                self.sent[widget_id] = encoded
+                changed[widget_id] = payload
+        return changed
+
+    async def events(self):
+        broker = get_broker()
+        # Subscribe before the snapshot so writes made while it is computed are not missed
+        queue = broker.subscribe(self.organization.id)
+        loop = asyncio.get_running_loop()
+        try:
+            yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+            snapshot = await sync_to_async(self.compute)(list(self.widgets))
+            yield format_event('snapshot', {"dashboard": self.dashboard.id, "widgets": self.changed(snapshot)})
+
+            last_recompute = loop.time()
+            while True:
+                try:
+                    _organization_id, model_label = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                stale = self.stale_widgets(model_label)
+                # Coalesce everything that arrives before the next recompute is due
+                deadline = last_recompute + self.interval
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        _organization_id, model_label = await asyncio.wait_for(queue.get(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    stale |= self.stale_widgets(model_label)
+
+                if not stale:
+                    continue
+                last_recompute = loop.time()
+                payloads = await sync_to_async(self.compute)(sorted(stale))
+                changed = self.changed(payloads)
+                if changed:
+                    yield format_event('delta', {"dashboard": self.dashboard.id, "widgets": changed})
+        finally:
+            broker.unsubscribe(self.organization.id, queue)
+
+
+async def dashboard_live(request, pk):
+    """
+    Server-sent events for a dashboard: a `snapshot` of every widget, then `delta`
+    events with the widgets whose payload changed. Takes the same ?date=, start_date,
+    end_date and f_* parameters as the dashboard data endpoint. Needs an ASGI server.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Live dashboards need the ASGI server (crm_back.asgi)"}, status=501)
+    if not await sync_to_async(_authenticate)(request, pk):
+        return JsonResponse({"error": "Authentication credentials were not provided or are invalid"}, status=403)
+
+    dashboard, widgets = await sync_to_async(load_dashboard)(request, pk)
+    if dashboard is None:
+        return JsonResponse({"error": "Dashboard not found"}, status=404)
+
+    stream = DashboardStream(request.organization, dashboard, widgets, request.GET)
+    response = StreamingHttpResponse(stream.events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
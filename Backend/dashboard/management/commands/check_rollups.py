@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from dashboard import rollups
+from dashboard import cache as analytics_cache
+
+
+class Command(BaseCommand):
+    help = 'Compares the daily dashboard rollups with the raw rows and optionally repairs them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'metrics', nargs='*',
+            help=f"Metrics to check ({', '.join(rollups.ROLLUPS)}). Defaults to all."
+        )
+        parser.add_argument('--organization', type=int, help='Only check this organization')
+        parser.add_argument('--fix', action='store_true', help='Re-aggregate the days that differ')
+
+    def handle(self, *args, **options):
+        metrics = options['metrics'] or list(rollups.ROLLUPS)
+        unknown = [metric for metric in metrics if metric not in rollups.ROLLUPS]
+        if unknown:
+            raise CommandError(f"Unknown rollup metric: {', '.join(unknown)}")
+
+        total = 0
+        for metric in metrics:
+            mismatches = rollups.find_mismatches(metric, organization_id=options['organization'])
+            total += len(mismatches)
+            if not mismatches:
+                self.stdout.write(self.style.SUCCESS(f'{metric}: consistent'))
+                continue
+
+            self.stdout.write(self.style.WARNING(f'{metric}: {len(mismatches)} day(s) differ'))
+            by_organization = {}
+            for organization_id, day in mismatches:
+                self.stdout.write(f'  organization {organization_id} on {day}')
+                by_organization.setdefault(organization_id, set()).add(day)
+
+            if options['fix']:
+                for organization_id, days in by_organization.items():
+                    rollups.refresh_days(metric, organization_id, days)
+                    analytics_cache.bump_generation(organization_id, rollups.ROLLUPS[metric]['model'].lower())
+                self.stdout.write(self.style.SUCCESS(f'{metric}: repaired'))
+
+        if total and not options['fix']:
+            raise CommandError(f'{total} rollup day(s) are out of date. Run with --fix to repair them.')
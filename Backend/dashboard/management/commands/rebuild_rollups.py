@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from dashboard import rollups
+from dashboard import cache as analytics_cache
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily dashboard rollups from the raw rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'metrics', nargs='*',
+            help=f"Metrics to rebuild ({', '.join(rollups.ROLLUPS)}). Defaults to all."
+        )
+        parser.add_argument('--organization', type=int, help='Only rebuild this organization')
+        parser.add_argument('--since', help='Only rebuild days on or after this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        metrics = options['metrics'] or list(rollups.ROLLUPS)
+        unknown = [metric for metric in metrics if metric not in rollups.ROLLUPS]
+        if unknown:
+            raise CommandError(f"Unknown rollup metric: {', '.join(unknown)}")
+
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('--since must be a date in YYYY-MM-DD format.')
+
+        for metric in metrics:
+            self.stdout.write(f'Rebuilding {metric} rollups...')
+            count = rollups.rebuild(metric, organization_id=options['organization'], since=since)
+            # Cached analytics results were computed from the old rollups
+            analytics_cache.bump_generation(options['organization'], rollups.ROLLUPS[metric]['model'].lower())
+            self.stdout.write(self.style.SUCCESS(f'Wrote {count} {metric} rollup rows.'))
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0008_alter_dashboardwidget_widget_category_and_more'),
+        ('users', '0005_organization_google_business_link'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('leads', 'Leads'), ('payments', 'Payments'), ('paid_invoices', 'Paid Invoices'), ('expenses', 'Expenses'), ('purchases', 'Purchases')], max_length=50)),
+                ('day', models.DateField()),
+                ('branch_id', models.IntegerField(blank=True, null=True)),
+                ('rep_id', models.IntegerField(blank=True, null=True)),
+                ('source', models.CharField(blank=True, default='', max_length=100)),
+                ('stage', models.CharField(blank=True, default='', max_length=100)),
+                ('category', models.CharField(blank=True, default='', max_length=100)),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='users.organization')),
+            ],
+            options={
+                'ordering': ('day',),
+                'indexes': [models.Index(fields=['organization', 'metric', 'day'], name='rollup_org_metric_day_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:42
+
+from django.db import migrations
+from django.db.models import Count, F, IntegerField, Sum, Value
+from django.db.models.functions import TruncDate
+
+# Frozen copy of dashboard.rollups.ROLLUPS and the branch/rep lookups of dashboard.filters
+# at the time of this migration: (metric, model, date field, datetime?, total field,
+# filters, {rollup column: lookup})
+ROLLUPS = (
+    ('leads', ('masterdata', 'Customer'), 'created_at', True, None, {}, {
+        'branch_id': 'branch_id', 'rep_id': 'assigned_to_id', 'source': 'source', 'stage': 'stage',
+    }),
+    ('payments', ('transactiondata', 'PaymentReceipt'), 'payment_date', False, 'amount', {}, {
+        'branch_id': 'invoice__customer__branch_id', 'rep_id': 'invoice__assigned_to_id',
+    }),
+    ('paid_invoices', ('transactiondata', 'Invoice'), 'issue_date', False, 'total_amount', {'status': 'paid'}, {
+        'branch_id': 'customer__branch_id', 'rep_id': 'assigned_to_id',
+    }),
+    ('expenses', ('transactiondata', 'Expense'), 'expense_date', False, 'amount', {}, {
+        'branch_id': 'customer__branch_id', 'rep_id': 'customer__assigned_to_id', 'category': 'category',
+    }),
+    ('purchases', ('transactiondata', 'Purchase'), 'purchase_date', False, 'total_amount', {}, {
+        'branch_id': None, 'rep_id': 'created_by_id', 'category': 'category',
+    }),
+)
+DIMENSION_FIELDS = ('source', 'stage', 'category')
+BATCH_SIZE = 1000
+
+
+def backfill_rollups(apps, schema_editor):
+    DailyRollup = apps.get_model('dashboard', 'DailyRollup')
+    for metric, model_label, date_field, is_datetime, total_field, filters, columns in ROLLUPS:
+        model = apps.get_model(*model_label)
+        group = {
+            'rollup_organization': F('organization_id'),
+            'rollup_day': TruncDate(date_field) if is_datetime else F(date_field),
+        }
+        for column in ('branch_id', 'rep_id', *DIMENSION_FIELDS):
+            lookup = columns.get(column)
+            group[f'rollup_{column}'] = F(lookup) if lookup else Value(None, output_field=IntegerField())
+        measures = {'rollup_count': Count('pk')}
+        if total_field:
+            measures['rollup_total'] = Sum(total_field)
+
+        rows = model._default_manager.filter(
+            organization__isnull=False, **{f'{date_field}__isnull': False}, **filters
+        ).annotate(**group).values(*group).annotate(**measures).order_by()
+
+        DailyRollup.objects.filter(metric=metric).delete()
+        DailyRollup.objects.bulk_create((
+            DailyRollup(
+                metric=metric,
+                organization_id=row['rollup_organization'],
+                day=row['rollup_day'],
+                branch_id=row['rollup_branch_id'],
+                rep_id=row['rollup_rep_id'],
+                count=row['rollup_count'],
+                total=row.get('rollup_total') or 0,
+                **{
+                    field: '' if row[f'rollup_{field}'] is None else str(row[f'rollup_{field}'])
+                    for field in DIMENSION_FIELDS
+                },
+            )
+            for row in rows
+        ), batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0009_dailyrollup'),
+        ('masterdata', '0022_customer_customer_org_stage_move_idx_and_more'),
+        ('transactiondata', '0029_customeractivity_activity_customer_created_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -114,3 +114,37 @@ class CustomMetric(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.organization.name})"
+
+
+class DailyRollup(models.Model):
+    """
+    Per-day count and total of one metric for an organization, split by branch, rep and
+    the source/stage/category dimensions. Maintained by dashboard.rollups from model signals.
+    """
+    METRIC_CHOICES = (
+        ('leads', 'Leads'),
+        ('payments', 'Payments'),
+        ('paid_invoices', 'Paid Invoices'),
+        ('expenses', 'Expenses'),
+        ('purchases', 'Purchases'),
+    )
+
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='daily_rollups')
+    metric = models.CharField(max_length=50, choices=METRIC_CHOICES)
+    day = models.DateField()
+    branch_id = models.IntegerField(null=True, blank=True)
+    rep_id = models.IntegerField(null=True, blank=True)
+    source = models.CharField(max_length=100, blank=True, default='')
+    stage = models.CharField(max_length=100, blank=True, default='')
+    category = models.CharField(max_length=100, blank=True, default='')
+    count = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ('day',)
+        indexes = [
+            models.Index(fields=['organization', 'metric', 'day'], name='rollup_org_metric_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} {self.day} ({self.count})"
@@ -0,0 +1,413 @@
+"""
+Daily rollups behind the time-range dashboard metrics.
+
+Each metric in ROLLUPS counts (and sums) the rows of one model per organization and
+day, split by the branch and rep lookups dashboard.filters declares for that model and by the
+source/stage/category dimensions. dashboard.signals keeps the DailyRollup rows current:
+a save or delete moves the row's contribution between buckets, and a customer or invoice
+change that re-attributes other rows to a different branch or rep re-aggregates the
+days those rows fall on. Writes that skip signals (bulk_create, queryset.update) are
+reported by `manage.py check_rollups` and repaired with --fix or `manage.py rebuild_rollups`.
+
+compute_source_data() reads the rollups for the time-range metrics whenever every
+requested filter maps onto a rollup column, so a range costs O(days) instead of O(rows).
+Set ANALYTICS_USE_ROLLUPS = False to always aggregate the raw rows.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum, F, Value, IntegerField, DateTimeField
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+
+ROLLUPS = {
+    'leads': {
+        'model': 'masterdata.Customer',
+        'date_field': 'created_at',
+        'total_field': None,
+        'filters': {},
+        'dimensions': ('source', 'stage'),
+    },
+    'payments': {
+        'model': 'transactiondata.PaymentReceipt',
+        'date_field': 'payment_date',
+        'total_field': 'amount',
+        'filters': {},
+        'dimensions': (),
+    },
+    'paid_invoices': {
+        'model': 'transactiondata.Invoice',
+        'date_field': 'issue_date',
+        'total_field': 'total_amount',
+        'filters': {'status': 'paid'},
+        'dimensions': (),
+    },
+    'expenses': {
+        'model': 'transactiondata.Expense',
+        'date_field': 'expense_date',
+        'total_field': 'amount',
+        'filters': {},
+        'dimensions': ('category',),
+    },
+    'purchases': {
+        'model': 'transactiondata.Purchase',
+        'date_field': 'purchase_date',
+        'total_field': 'total_amount',
+        'filters': {},
+        'dimensions': ('category',),
+    },
+}
+
+# Models whose changes move rows of other metrics to a different branch or rep,
+# with the relation from the dependent metric's model back to them
+DEPENDENTS = {
+    'masterdata.customer': (('payments', 'invoice__customer'), ('paid_invoices', 'customer'), ('expenses', 'customer')),
+    'transactiondata.invoice': (('payments', 'invoice'),),
+}
+
+BUCKET_FIELDS = ('organization_id', 'day', 'branch_id', 'rep_id', 'source', 'stage', 'category')
+DIMENSION_FIELDS = ('source', 'stage', 'category')
+REBUILD_BATCH_SIZE = 1000
+
+
+def get_model(metric, registry=apps):
+    return registry.get_model(ROLLUPS[metric]['model'])
+
+
+def metric_for_model(label):
+    for metric, spec in ROLLUPS.items():
+        if spec['model'].lower() == label:
+            return metric
+    return None
+
+
+def is_datetime(metric, model=None):
+    model = model or get_model(metric)
+    return isinstance(model._meta.get_field(ROLLUPS[metric]['date_field']), DateTimeField)
+
+
+def get_columns(metric, model=None):
+    """
+    Rollup column -> lookup on the metric's model. The branch and rep lookups are None
+    when the filters ignore that parameter for the model.
+    """
+    from .filters import get_registry
+
+    model = model or get_model(metric)
+    registry = get_registry()
+    columns = {'branch_id': registry.branch_lookup(model), 'rep_id': registry.rep_lookup(model)}
+    columns.update({dimension: dimension for dimension in ROLLUPS[metric]['dimensions']})
+    return columns
+
+
+def _day_expression(metric, model=None):
+    date_field = ROLLUPS[metric]['date_field']
+    return TruncDate(date_field) if is_datetime(metric, model) else F(date_field)
+
+
+def _day_bounds(metric, first_day, last_day=None, model=None):
+    """
+    Filter kwargs selecting the rows on first_day..last_day, or from first_day on
+    """
+    date_field = ROLLUPS[metric]['date_field']
+    if not is_datetime(metric, model):
+        if last_day is None:
+            return {f'{date_field}__gte': first_day}
+        return {f'{date_field}__range': [first_day, last_day]}
+
+    bounds = {f'{date_field}__gte': timezone.make_aware(datetime.combine(first_day, time.min))}
+    if last_day is not None:
+        bounds[f'{date_field}__lt'] = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+    return bounds
+
+
+def aggregate_rows(metric, queryset):
+    """
+    Group rows of the metric's model into buckets.
+    Yields (bucket, count, total) with bucket ordered as BUCKET_FIELDS.
+    """
+    spec = ROLLUPS[metric]
+    columns = get_columns(metric, queryset.model)
+    group = {'rollup_organization': F('organization_id'), 'rollup_day': _day_expression(metric, queryset.model)}
+    for column, lookup in columns.items():
+        group[f'rollup_{column}'] = F(lookup) if lookup else Value(None, output_field=IntegerField())
+    measures = {'rollup_count': Count('pk')}
+    if spec['total_field']:
+        measures['rollup_total'] = Sum(spec['total_field'])
+
+    rows = queryset.filter(
+        organization__isnull=False, **{f"{spec['date_field']}__isnull": False}, **spec['filters']
+    ).annotate(**group).values(*group).annotate(**measures).order_by()
+
+    for row in rows:
+        dimensions = {
+            field: '' if row.get(f'rollup_{field}') is None else str(row[f'rollup_{field}'])
+            for field in DIMENSION_FIELDS
+        }
+        bucket = (
+            row['rollup_organization'], row['rollup_day'], row['rollup_branch_id'], row['rollup_rep_id'],
+            dimensions['source'], dimensions['stage'], dimensions['category'],
+        )
+        yield bucket, row['rollup_count'], row.get('rollup_total') or 0
+
+
+def _build(metric, bucket, count, total, rollup_model=None):
+    from .models import DailyRollup
+    rollup_model = rollup_model or DailyRollup
+    return rollup_model(metric=metric, count=count, total=total, **dict(zip(BUCKET_FIELDS, bucket)))
+
+
+def refresh_days(metric, organization_id, days):
+    """
+    Re-aggregate the given days of one organization from the raw rows.
+    """
+    from .models import DailyRollup
+
+    days = sorted({day for day in days if day})
+    if not days:
+        return 0
+
+    queryset = get_model(metric)._default_manager.filter(
+        organization_id=organization_id, **_day_bounds(metric, days[0], days[-1])
+    )
+    wanted = set(days)
+    rollups = [
+        _build(metric, bucket, count, total)
+        for bucket, count, total in aggregate_rows(metric, queryset)
+        if bucket[1] in wanted
+    ]
+    with transaction.atomic():
+        DailyRollup.objects.filter(organization_id=organization_id, metric=metric, day__in=days).delete()
+        DailyRollup.objects.bulk_create(rollups, batch_size=REBUILD_BATCH_SIZE)
+    return len(rollups)
+
+
+def rebuild(metric, organization_id=None, since=None, registry=apps):
+    """
+    Replace the metric's rollups (optionally one organization's, optionally from since on).
+    `registry` may be the historical app registry inside migrations.
+    """
+    DailyRollup = registry.get_model('dashboard', 'DailyRollup')
+    model = get_model(metric, registry)
+
+    stored = DailyRollup.objects.filter(metric=metric)
+    queryset = model._default_manager.all()
+    if organization_id:
+        stored = stored.filter(organization_id=organization_id)
+        queryset = queryset.filter(organization_id=organization_id)
+    if since:
+        stored = stored.filter(day__gte=since)
+        queryset = queryset.filter(**_day_bounds(metric, since, model=model))
+
+    with transaction.atomic():
+        stored.delete()
+        rollups = DailyRollup.objects.bulk_create(
+            (_build(metric, *row, rollup_model=DailyRollup) for row in aggregate_rows(metric, queryset)),
+            batch_size=REBUILD_BATCH_SIZE
+        )
+    return len(rollups)
+
+
+def find_mismatches(metric, organization_id=None):
+    """
+    Compare stored rollups with a fresh aggregation of the raw rows.
+    Returns the sorted (organization_id, day) pairs whose buckets differ.
+    """
+    from .models import DailyRollup
+
+    queryset = get_model(metric)._default_manager.all()
+    stored_rows = DailyRollup.objects.filter(metric=metric)
+    if organization_id:
+        queryset = queryset.filter(organization_id=organization_id)
+        stored_rows = stored_rows.filter(organization_id=organization_id)
+
+    expected = defaultdict(dict)
+    for bucket, count, total in aggregate_rows(metric, queryset):
+        expected[bucket[:2]][bucket] = (count, total)
+
+    stored = defaultdict(dict)
+    # Concurrent first writes can leave two rows for one bucket, so merge them
+    for row in stored_rows.values(*BUCKET_FIELDS).annotate(rollup_count=Sum('count'), rollup_total=Sum('total')).order_by():
+        if not row['rollup_count'] and not row['rollup_total']:
+            continue
+        bucket = tuple(row[field] for field in BUCKET_FIELDS)
+        stored[bucket[:2]][bucket] = (row['rollup_count'], row['rollup_total'])
+
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+
+
+def contribution(metric, instance):
+    """
+    (bucket, count, total) the row of instance currently adds to the metric, or None
+    """
+    queryset = get_model(metric)._default_manager.filter(pk=instance.pk)
+    return next(aggregate_rows(metric, queryset), None)
+
+
+def apply_delta(metric, bucket, count, total):
+    from .models import DailyRollup
+
+    key = dict(zip(BUCKET_FIELDS, bucket))
+    updated = DailyRollup.objects.filter(metric=metric, **key).update(
+        count=F('count') + count, total=F('total') + total
+    )
+    if not updated:
+        DailyRollup.objects.create(metric=metric, count=count, total=total, **key)
+
+
+def _watched_fields(label):
+    """
+    Fields of model label that the dependent metrics attribute branch and rep through
+    """
+    fields = set()
+    for metric, relation in DEPENDENTS.get(label, ()):
+        prefix = f'{relation}__'
+        for lookup in get_columns(metric).values():
+            if lookup and lookup.startswith(prefix):
+                fields.add(lookup[len(prefix):])
+    return sorted(fields)
+
+
+def _dependent_days(instance):
+    days = {}
+    for metric, relation in DEPENDENTS.get(instance._meta.label_lower, ()):
+        queryset = get_model(metric)._default_manager.filter(**{relation: instance.pk})
+        days[metric] = set(
+            queryset.annotate(rollup_day=_day_expression(metric)).values_list('organization_id', 'rollup_day').distinct()
+        )
+    return days
+
+
+def capture(instance, deleting=False):
+    """
+    What the rollups know about instance before it is saved or deleted
+    """
+    label = instance._meta.label_lower
+    state = {}
+    metric = metric_for_model(label)
+    if metric:
+        state['contribution'] = contribution(metric, instance)
+    watched = _watched_fields(label)
+    if watched:
+        state['attribution'] = type(instance)._default_manager.filter(pk=instance.pk).values(*watched).first()
+    if deleting:
+        state['dependent_days'] = _dependent_days(instance)
+    return state
+
+
+def record_change(instance, previous, deleted=False):
+    """
+    Bring the rollups in line with instance after a save or delete. previous is capture()'s result.
+    """
+    label = instance._meta.label_lower
+    previous = previous or {}
+
+    metric = metric_for_model(label)
+    if metric:
+        before = previous.get('contribution')
+        after = None if deleted else contribution(metric, instance)
+        if before != after:
+            if before:
+                bucket, count, total = before
+                apply_delta(metric, bucket, -count, -total)
+            if after:
+                apply_delta(metric, *after)
+
+    if deleted:
+        dependent_days = previous.get('dependent_days', {})
+    elif previous.get('attribution') is not None:
+        watched = _watched_fields(label)
+        current = type(instance)._default_manager.filter(pk=instance.pk).values(*watched).first()
+        dependent_days = _dependent_days(instance) if current != previous['attribution'] else {}
+    else:
+        dependent_days = {}
+
+    for dependent_metric, pairs in dependent_days.items():
+        by_organization = defaultdict(set)
+        for organization_id, day in pairs:
+            if organization_id:
+                by_organization[organization_id].add(day)
+        for organization_id, days in by_organization.items():
+            refresh_days(dependent_metric, organization_id, days)
+
+
+def rollup_rows(org_id, metric, params):
+    """
+    DailyRollup rows of the metric narrowed by the branch, rep and f_* filters in params,
+    or None when a filter has no rollup column and the raw rows have to be used.
+    """
+    if not getattr(settings, 'ANALYTICS_USE_ROLLUPS', True):
+        return None
+
+    from .filters import get_registry
+    from .models import DailyRollup
+
+    registry = get_registry()
+    model = get_model(metric)
+    columns = get_columns(metric, model)
+    by_lookup = {lookup: column for column, lookup in columns.items() if lookup}
+    # Filters resolve foreign keys to their column (category -> category_id)
+    by_lookup.update({registry.filter_lookup(model, column): column for column in ROLLUPS[metric]['dimensions']})
+    rows = DailyRollup.objects.filter(organization_id=org_id, metric=metric)
+
+    if params.branch_id and columns['branch_id']:
+        rows = rows.filter(branch_id=params.branch_id)
+    if params.rep_id and columns['rep_id']:
+        rows = rows.filter(rep_id=params.rep_id)
+
+    for key, value in params.filters.items():
+        if not key.startswith('f_'):
+            continue
+        field_name, value = registry.normalize(key[2:], value)
+        lookup = registry.filter_lookup(model, field_name)
+        if lookup is None:
+            continue
+        if lookup not in by_lookup:
+            return None
+        rows = rows.filter(**{by_lookup[lookup]: value})
+    return rows
+
+
+def _window(metric, rows, start, end):
+    if start is None or end is None:
+        return rows
+    if is_datetime(metric):
+        # The raw filter is created_at__range=[start, end], which stops at midnight of end
+        return rows.filter(day__gte=start, day__lt=end)
+    return rows.filter(day__range=[start, end])
+
+
+def totals(metric, rows, start=None, end=None):
+    """
+    (count, total) over the window; the whole history when start is None
+    """
+    result = _window(metric, rows, start, end).aggregate(count=Sum('count'), total=Sum('total'))
+    return result['count'] or 0, result['total'] or 0
+
+
+def history(metric, rows, start=None, end=None, measure='count', period='day'):
+    """
+    [{'day': ..., 'value': ...}] per day or month, shaped like the TruncDay/TruncMonth
+    series the raw queries return.
+    """
+    rows = _window(metric, rows, start, end)
+    if period == 'month':
+        rows = rows.annotate(period=TruncMonth('day'))
+    else:
+        rows = rows.annotate(period=F('day'))
+    series = rows.values('period').annotate(value=Sum(measure), rows=Sum('count')).order_by('period')
+
+    as_datetime = is_datetime(metric) and period == 'day'
+    return [
+        {
+            'day': timezone.make_aware(datetime.combine(item['period'], time.min)) if as_datetime else item['period'],
+            'value': item['value'],
+        }
+        for item in series
+        # Buckets emptied by deletes are kept at zero
+        if item['rows']
+    ]
@@ -7,6 +7,27 @@ class CustomMetricSerializer(serializers.ModelSerializer):
         model = CustomMetric
         fields = '__all__'
         read_only_fields = ['created_by', 'organization']
+
+    def validate_formula(self, value):
+        from .analytics import FORMULA_VARIABLES
+        from .formulas import FormulaError, compile_formula
+
+        try:
+            formula = compile_formula(value)
+        except FormulaError as e:
+            raise serializers.ValidationError(str(e))
+
+        unknown = [name for name in formula.variables if name not in FORMULA_VARIABLES]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown metrics: {', '.join(unknown)}")
+        return value
+
+    def validate(self, attrs):
+        # Keep the stored variable list in step with the formula
+        if 'formula' in attrs:
+            from .formulas import compile_formula
+            attrs['variables'] = list(compile_formula(attrs['formula']).variables)
+        return attrs
 from users.models import OrganizationRole
 
 class OrganizationRoleSerializer(serializers.ModelSerializer):
@@ -0,0 +1,59 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from . import live, rollups
+from .cache import TRACKED_MODELS, bump_generation
+
+
+def invalidate_analytics(sender, instance, **kwargs):
+    """
+    Move the organization's analytics entries for this model to a new generation and
+    tell the organization's live dashboards once the write commits.
+
+    The generation is bumped now, so the writing transaction does not read results cached
+    before its write, and again on commit, so results another request computed from the
+    not-yet-committed state in between are never served.
+    """
+    org_id = getattr(instance, 'organization_id', None)
+    model = sender._meta.label_lower
+    bump_generation(org_id, model)
+
+    def committed():
+        bump_generation(org_id, model)
+        live.publish_change(org_id, model)
+
+    transaction.on_commit(committed)
+
+
+def capture_rollup_state(sender, instance, raw=False, **kwargs):
+    instance._rollup_state = rollups.capture(instance) if instance.pk and not raw else None
+
+
+def capture_rollup_state_for_delete(sender, instance, **kwargs):
+    instance._rollup_state = rollups.capture(instance, deleting=True)
+
+
+def update_rollups(sender, instance, raw=False, **kwargs):
+    """
+    Move the row's contribution to the daily rollups it now belongs to
+    """
+    if raw:
+        return
+    rollups.record_change(instance, getattr(instance, '_rollup_state', None))
+
+
+def update_rollups_for_delete(sender, instance, **kwargs):
+    rollups.record_change(instance, getattr(instance, '_rollup_state', None), deleted=True)
+
+
+for label in TRACKED_MODELS:
+    model = apps.get_model(label)
+    post_save.connect(invalidate_analytics, sender=model, dispatch_uid=f'analytics_cache_save_{label}')
+    post_delete.connect(invalidate_analytics, sender=model, dispatch_uid=f'analytics_cache_delete_{label}')
+
+for label in {spec['model'].lower() for spec in rollups.ROLLUPS.values()} | set(rollups.DEPENDENTS):
+    model = apps.get_model(label)
+    pre_save.connect(capture_rollup_state, sender=model, dispatch_uid=f'rollups_pre_save_{label}')
+    post_save.connect(update_rollups, sender=model, dispatch_uid=f'rollups_save_{label}')
+    pre_delete.connect(capture_rollup_state_for_delete, sender=model, dispatch_uid=f'rollups_pre_delete_{label}')
+    post_delete.connect(update_rollups_for_delete, sender=model, dispatch_uid=f'rollups_delete_{label}')
@@ -1,3 +1,482 @@
-from django.test import TestCase
+import json
+from datetime import date, timedelta
+from io import StringIO
+from asgiref.sync import async_to_sync
+from django.utils import timezone
+from crm_back.testing import OrganizationTestCase, QueryPlanTestCase
 
-# Create your tests here.
+
+ANALYTICS_SOURCES = (
+    'total_leads', 'total_revenue', 'payment_count', 'average_payment', 'win_rate', 'lead_volume',
+    'revenue_trends', 'branch_performance', 'deals_by_stage', 'lead_source_distribution', 'upcoming_jobs',
+    'active_jobs', 'average_deal_size', 'pipeline_value', 'due_invoices_amount', 'accounts_receivable',
+    'due_invoices', 'recent_activities', 'recent_invoices', 'recent_payments', 'service_funnel',
+    'site_visits', 'total_expenses', 'total_purchases', 'recent_expenses', 'recent_purchases',
+    'receivables_aging',
+)
+
+
+class AnalyticsQueryPlanTests(QueryPlanTestCase):
+    """
+    Every analytics source must be answered from an index, with and without widget filters
+    """
+
+    def test_analytics_sources(self):
+        params = {
+            'start_date': (date.today() - timedelta(days=30)).isoformat(),
+            'end_date': date.today().isoformat(),
+        }
+        for source in ANALYTICS_SOURCES:
+            for extra in ({}, {'time_range': 'last_12_months'}, {'rep_id': self.user.id}, {'f_stage': 'Booked'}):
+                with self.subTest(source=source, extra=extra):
+                    self.assertNoFullScans('/api/dashboard/analytics/data/', {'source': source, **params, **extra})
+
+
+class DashboardDataTests(OrganizationTestCase):
+    """
+    The batched dashboard endpoint computes shared widgets once and matches the per-widget endpoint
+    """
+
+    def setUp(self):
+        super().setUp()
+        from .models import Dashboard, DashboardWidget
+        self.dashboard = Dashboard.objects.create(name='Batch', organization=self.organization)
+        self.widgets = [
+            DashboardWidget.objects.create(dashboard=self.dashboard, title=title, widget_type='kpi', data_source=source)
+            for title, source in (('Leads', 'total_leads'), ('Leads again', 'total_leads'), ('Revenue', 'total_revenue'))
+        ]
+        DashboardWidget.objects.create(dashboard=self.dashboard, title='Stage', widget_type='control', data_source='deals_by_stage')
+
+    def test_dashboard_data(self):
+        url = f'/api/dashboard/dashboards/{self.dashboard.id}/data/'
+        response = self.assertNoFullScans(url, {'date': date.today().isoformat()})
+        widgets = response.json()['widgets']
+
+        self.assertEqual(set(widgets), {str(widget.id) for widget in self.widgets})
+        leads, leads_again, revenue = (widgets[str(widget.id)] for widget in self.widgets)
+        self.assertEqual(leads, leads_again)
+        self.assertEqual(revenue['data']['value'], 40)
+
+        single = self.client.get('/api/dashboard/analytics/data/', {
+            'source': 'total_leads',
+            'start_date': date.today().replace(day=1).isoformat(),
+            'end_date': date.today().isoformat(),
+        })
+        self.assertEqual(single.json()['data']['value'], leads['data']['value'])
+
+
+class AnalyticsCacheTests(OrganizationTestCase):
+    """
+    Analytics results are served from the cache until a write to a model the source reads commits
+    """
+
+    def fetch(self):
+        response = self.client.get('/api/dashboard/analytics/data/', {'source': 'total_leads', 'time_range': 'all_time'})
+        self.assertEqual(response.status_code, 200)
+        return response['X-Analytics-Cache'], response.json()['data']['value']
+
+    def add_customer(self, name):
+        from masterdata.models import Customer
+        return Customer.objects.create(full_name=name, email=f'{name.lower()}@example.com', organization=self.organization)
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.fetch(), ('miss', 1))
+        self.assertEqual(self.fetch(), ('hit', 1))
+
+        # Writes to models the source does not read keep the entry
+        from .models import Dashboard
+        Dashboard.objects.create(name='Unrelated', organization=self.organization)
+        self.assertEqual(self.fetch(), ('hit', 1))
+
+        stats = self.client.get('/api/dashboard/analytics/cache-stats/').json()
+        self.assertEqual(stats['sources']['total_leads'], {'hits': 2, 'misses': 1, 'hit_rate': 66.7})
+
+    def test_writes_invalidate(self):
+        self.fetch()
+        with self.captureOnCommitCallbacks(execute=True):
+            customer = self.add_customer('Second')
+        self.assertEqual(self.fetch(), ('miss', 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.delete()
+        self.assertEqual(self.fetch(), ('miss', 1))
+
+    def test_entries_cached_before_commit_are_dropped(self):
+        self.fetch()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.add_customer('Pending')
+            # Another request computes and caches while the write is still uncommitted
+            self.assertEqual(self.fetch(), ('miss', 2))
+            self.assertEqual(self.fetch(), ('hit', 2))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.fetch()[0], 'miss')
+
+
+class LiveDashboardTests(OrganizationTestCase):
+    """
+    A burst of writes reaches an open stream as one recompute of the widgets that read the changed model
+    """
+
+    def setUp(self):
+        super().setUp()
+        from .models import Dashboard, DashboardWidget
+        self.dashboard = Dashboard.objects.create(name='Live', organization=self.organization)
+        self.jobs = DashboardWidget.objects.create(dashboard=self.dashboard, title='Jobs', widget_type='kpi', data_source='active_jobs')
+        self.purchases = DashboardWidget.objects.create(dashboard=self.dashboard, title='Purchases', widget_type='kpi', data_source='total_purchases')
+
+    def book_customers(self):
+        from masterdata.models import Customer
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(3):
+                Customer.objects.create(
+                    full_name=f'Booking {number}', email=f'booking{number}@example.com',
+                    organization=self.organization, stage='booked'
+                )
+
+    def test_coalesced_delta(self):
+        from asgiref.sync import async_to_sync, sync_to_async
+        from .live import DashboardStream
+
+        stream = DashboardStream(self.organization, self.dashboard, [self.jobs, self.purchases], {})
+        stream.interval = 0.2
+        computed = []
+        compute = stream.compute
+        stream.compute = lambda widget_ids: computed.append(list(widget_ids)) or compute(widget_ids)
+
+        async def scenario():
+            events = stream.events()
+            try:
+                received = [await events.__anext__(), await events.__anext__()]
+                await sync_to_async(self.book_customers)()
+                received.append(await events.__anext__())
+                return received
+            finally:
+                await events.aclose()
+
+        retry, snapshot, delta = async_to_sync(scenario)()
+
+        self.assertTrue(retry.startswith('retry:'))
+        self.assertTrue(snapshot.startswith('event: snapshot'))
+        self.assertTrue(delta.startswith('event: delta'))
+        self.assertEqual(computed, [[self.jobs.id, self.purchases.id], [self.jobs.id]])
+        payload = json.loads(delta.split('data: ', 1)[1])
+        self.assertEqual(payload['widgets'][str(self.jobs.id)]['data']['value'], 4)
+
+    def test_requires_visible_dashboard(self):
+        from django.test import AsyncClient
+        from rest_framework.test import APIClient
+
+        url = f'/api/dashboard/dashboards/{self.dashboard.id}/live/'
+        headers = {'Authorization': f'Bearer {self.token}', 'X-Organization-Id': str(self.organization.id)}
+        client = AsyncClient()
+        self.assertEqual(async_to_sync(client.get)(url).status_code, 403)
+        self.assertEqual(async_to_sync(client.get)('/api/dashboard/dashboards/0/live/', headers=headers).status_code, 404)
+        # Bearer tokens are not taken from the URL
+        self.assertEqual(async_to_sync(client.get)(url, {'token': self.token}).status_code, 403)
+        # Under WSGI the stream could never send anything
+        self.assertEqual(APIClient().get(url, headers=headers).status_code, 501)
+
+    def test_stream_tokens(self):
+        from django.test import AsyncClient
+        from .models import Dashboard
+
+        url = f'/api/dashboard/dashboards/{self.dashboard.id}/live/'
+        other = Dashboard.objects.create(name='Other', organization=self.organization)
+        client = AsyncClient()
+
+        def issue(dashboard):
+            response = self.client.post(f'/api/dashboard/dashboards/{dashboard.id}/live-token/')
+            self.assertEqual(response.status_code, 200)
+            return response.json()['stream_token']
+
+        token = issue(self.dashboard)
+        response = async_to_sync(client.get)(url, {'stream_token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        # Single use
+        self.assertEqual(async_to_sync(client.get)(url, {'stream_token': token}).status_code, 403)
+        # Only for the dashboard it was issued for
+        self.assertEqual(async_to_sync(client.get)(url, {'stream_token': issue(other)}).status_code, 403)
+        self.assertEqual(self.client.post('/api/dashboard/dashboards/0/live-token/').status_code, 404)
+
+
+class DailyRollupTests(OrganizationTestCase):
+    """
+    Rollup-backed sources must return what the raw aggregation returns, however the rows got there
+    """
+
+    ROLLUP_SOURCES = (
+        'total_leads', 'lead_volume', 'total_revenue', 'payment_count', 'average_payment',
+        'revenue_trends', 'total_expenses', 'total_purchases',
+    )
+
+    def setUp(self):
+        super().setUp()
+        from masterdata.models import Branch, Customer
+        from transactiondata.models import Expense, Purchase, PaymentReceipt, TransactionCategory
+
+        today = date.today()
+        self.branch = Branch.objects.create(name='North', dispatch_location='Depot', organization=self.organization)
+        category = TransactionCategory.objects.create(name='Fuel', organization=self.organization)
+        self.older = Customer.objects.create(
+            full_name='Old Lead', organization=self.organization, source='google', stage='new_lead',
+            assigned_to=self.user
+        )
+        # created_at is only filled in on insert, so it can be moved afterwards
+        self.older.created_at = timezone.now() - timedelta(days=40)
+        self.older.save()
+
+        self.invoice.status = 'paid'
+        self.invoice.save()
+        self.customer.branch = self.branch
+        self.customer.assigned_to = self.user
+        self.customer.save()
+        PaymentReceipt.objects.create(
+            organization=self.organization, invoice=self.invoice, amount=25, payment_date=today - timedelta(days=3),
+            payment_method='cash', pdf_file='payments/plan-test-2.pdf'
+        )
+        Expense.objects.create(
+            organization=self.organization, title='Diesel', amount=30, expense_date=today,
+            category=category, customer=self.customer
+        )
+        Purchase.objects.create(
+            organization=self.organization, item_name='Dolly', unit_price=80, total_amount=80,
+            purchase_date=today - timedelta(days=50), created_by=self.user
+        )
+
+    def compute(self, source, **params):
+        from .analytics import AnalyticsParams, compute_source_data
+        return compute_source_data(self.organization, AnalyticsParams(source, **params))
+
+    def assertMatchesRaw(self):
+        today = date.today()
+        ranges = (
+            {},
+            {'start_date': (today - timedelta(days=30)).isoformat(), 'end_date': today.isoformat()},
+            {'start_date': today.replace(day=1).isoformat(), 'end_date': today.isoformat(), 'time_range': 'last_12_months'},
+            {'start_date': today.isoformat(), 'end_date': today.isoformat(), 'time_range': 'all_time'},
+        )
+        filters = (
+            {}, {'branch_id': str(self.branch.id)}, {'rep_id': str(self.user.id)},
+            {'filters': {'f_source': 'Google'}}, {'filters': {'f_name': 'Booked'}},
+        )
+        for source in self.ROLLUP_SOURCES:
+            for date_params in ranges:
+                for filter_params in filters:
+                    params = {**date_params, **filter_params}
+                    with self.subTest(source=source, params=params):
+                        with self.settings(ANALYTICS_USE_ROLLUPS=False):
+                            expected = self.compute(source, **params)
+                        self.assertEqual(self.compute(source, **params), expected)
+
+    def test_rollups_match_raw_rows(self):
+        self.assertMatchesRaw()
+        self.assertEqual(self.compute('total_revenue')['value'], 65.0)
+
+    def test_changes_are_rolled_up(self):
+        from masterdata.models import Customer
+        from transactiondata.models import PaymentReceipt
+
+        PaymentReceipt.objects.filter(amount=25).first().delete()
+        self.older.stage = 'booked'
+        self.older.save()
+        self.customer.branch = None
+        self.customer.save()
+        self.invoice.status = 'sent'
+        self.invoice.save()
+        Customer.objects.get(pk=self.older.pk).delete()
+        self.assertMatchesRaw()
+
+    def test_check_and_repair(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from masterdata.models import Customer
+
+        call_command('check_rollups', stdout=StringIO())
+
+        # Queryset updates skip the signals
+        Customer.objects.filter(pk=self.older.pk).update(source='referral')
+        with self.assertRaises(CommandError):
+            call_command('check_rollups', 'leads', stdout=StringIO())
+
+        call_command('check_rollups', 'leads', fix=True, stdout=StringIO())
+        call_command('check_rollups', stdout=StringIO())
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        call_command('check_rollups', stdout=StringIO())
+        self.assertMatchesRaw()
+
+
+class CustomMetricFormulaTests(OrganizationTestCase):
+    """
+    Formulas are plain arithmetic over base metrics, resolved for both periods in one pass per model
+    """
+
+    def test_formula_engine(self):
+        from .formulas import FormulaError, compile_formula
+
+        formula = compile_formula('({{total_revenue}} - {{total_expenses}}) / {{ payment_count }} * 100')
+        self.assertEqual(formula.variables, ('total_revenue', 'total_expenses', 'payment_count'))
+        self.assertEqual(formula.evaluate({'total_revenue': 50, 'total_expenses': 10, 'payment_count': 4}), 1000.0)
+        self.assertIsNone(formula.evaluate({'total_revenue': 50, 'total_expenses': 10, 'payment_count': 0}))
+        self.assertIs(compile_formula(formula.formula), formula)
+
+        for bad in ('', '__import__("os")', '{{a}} ** 2', '{{a}}; 1', 'abs({{a}})', '{{a}} if 1 else 2'):
+            with self.subTest(formula=bad):
+                with self.assertRaises(FormulaError):
+                    compile_formula(bad)
+
+    def test_custom_metric_source(self):
+        from django.test.utils import CaptureQueriesContext
+        from django.db import connection
+        from .models import CustomMetric
+
+        metric = CustomMetric.objects.create(
+            name='Average receipt', organization=self.organization,
+            formula='{{total_revenue}} / {{payment_count}} + {{active_jobs}} * 0'
+        )
+        params = {
+            'source': f'custom_{metric.id}',
+            'start_date': (date.today() - timedelta(days=30)).isoformat(),
+            'end_date': date.today().isoformat(),
+        }
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/dashboard/analytics/data/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(data['value'], 40.0)
+        # The previous period has no payments, so its average is undefined and there is no trend
+        self.assertEqual(data['trend'], 0)
+        aggregate_queries = [q for q in captured.captured_queries if 'transactiondata_paymentreceipt' in q['sql']]
+        self.assertEqual(len(aggregate_queries), 1)
+
+        # No payments in the previous period: 40 / 0 has no value, not a fake one
+        params['start_date'] = params['end_date'] = (date.today() - timedelta(days=400)).isoformat()
+        self.assertIsNone(self.client.get('/api/dashboard/analytics/data/', params).json()['data']['value'])
+
+    def test_formula_validation(self):
+        response = self.client.post('/api/dashboard/custom-metrics/', {
+            'name': 'Broken', 'formula': '{{total_revenue}} ** {{nope}}'
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/api/dashboard/custom-metrics/', {
+            'name': 'Margin', 'formula': '{{total_revenue}} - {{total_expenses}}', 'variables': []
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['variables'], ['total_revenue', 'total_expenses'])
+
+
+class MetricSpecTests(OrganizationTestCase):
+    """
+    Multi-count sources answer every bucket and both periods from one query
+    """
+
+    def test_multi_count_sources(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from masterdata.models import Customer
+
+        Customer.objects.create(full_name='Lead', organization=self.organization, stage='new_lead')
+        params = {
+            'start_date': (date.today() - timedelta(days=30)).isoformat(),
+            'end_date': (date.today() + timedelta(days=1)).isoformat(),
+        }
+        expected = {
+            'service_funnel': [
+                {'step': 'New Lead', 'value': 1}, {'step': 'Opportunity', 'value': 0},
+                {'step': 'Booked', 'value': 1}, {'step': 'Closed', 'value': 0},
+            ],
+            'win_rate': {'value': 50.0, 'trend': 50.0, 'subtext': 'Conversion for this period', 'suffix': '%'},
+        }
+        for source, data in expected.items():
+            with self.subTest(source=source):
+                with CaptureQueriesContext(connection) as captured:
+                    response = self.client.get('/api/dashboard/analytics/data/', {'source': source, **params})
+                self.assertEqual(response.json()['data'], data)
+                customer_queries = [q for q in captured.captured_queries if 'FROM "masterdata_customer"' in q['sql']]
+                self.assertEqual(len(customer_queries), 1)
+
+
+class TimeSeriesTests(OrganizationTestCase):
+    """
+    Histories are gap-filled over the window and can be resampled, smoothed and compared with the previous period
+    """
+
+    def test_series(self):
+        from .timeseries import Series
+
+        monday = date(2026, 3, 2)
+        rows = [
+            {'day': monday, 'value': 2},
+            {'day': monday + timedelta(days=2), 'value': 4},
+            {'day': monday + timedelta(days=8), 'value': 6},
+            {'day': monday + timedelta(days=20), 'value': 100},
+        ]
+        series = Series.from_rows(rows, monday, monday + timedelta(days=9))
+
+        self.assertEqual(series.values.tolist(), [2, 0, 4, 0, 0, 0, 0, 0, 6, 0])
+        self.assertEqual(series.resample('week').values.tolist(), [6, 6])
+        self.assertEqual(series.resample('month').points(), [{'date': date(2026, 3, 1), 'value': 12.0}])
+        self.assertEqual(series.cumsum().values[-1], 12)
+        self.assertEqual(series.rolling(3).values.tolist()[:4], [2, 1, 2, 4 / 3])
+
+        previous = Series.from_rows([{'day': monday - timedelta(days=10), 'value': 5}], monday - timedelta(days=10), monday - timedelta(days=1))
+        self.assertEqual(series.align(previous).values.tolist(), [5] + [0] * 9)
+
+    def test_history_payload(self):
+        start = date.today() - timedelta(days=6)
+        response = self.client.get('/api/dashboard/analytics/data/', {
+            'source': 'total_revenue', 'start_date': start.isoformat(), 'end_date': date.today().isoformat(),
+        })
+        data = response.json()['data']
+
+        self.assertEqual([point['date'] for point in data['history']], [(start + timedelta(days=n)).isoformat() for n in range(7)])
+        self.assertEqual([point['value'] for point in data['history']], [0] * 6 + [40])
+        self.assertEqual(len(data['previous_history']), 7)
+
+        monthly = self.client.get('/api/dashboard/analytics/data/', {
+            'source': 'total_revenue', 'start_date': start.isoformat(), 'end_date': date.today().isoformat(),
+            'history_period': 'month', 'cumulative': 'true',
+        }).json()['data']
+        self.assertEqual(monthly['history'][-1]['value'], 40)
+
+
+class FilterRegistryTests(OrganizationTestCase):
+    """
+    Widget filters resolve to one Q over the declared paths and ignore keys a model does not have
+    """
+
+    def test_resolve(self):
+        from django.db.models import Q
+        from masterdata.models import Customer
+        from transactiondata.models import PaymentReceipt, Purchase
+        from .filters import get_registry
+
+        registry = get_registry()
+        filters = {'f_name': 'Booked', 'f_source': 'Google', 'f_rep_id': '7', 'f_month': 'March', 'f_objects': 'x'}
+
+        self.assertEqual(
+            registry.resolve(Customer, branch_id='3', filters=filters),
+            Q(('branch_id', '3'), ('stage', 'booked'), ('source', 'google'), ('assigned_to_id', '7'))
+        )
+        self.assertEqual(
+            registry.resolve(PaymentReceipt, filters=filters),
+            Q(('invoice__customer__stage', 'booked'), ('invoice__customer__source', 'google'),
+              ('invoice__assigned_to_id', '7'))
+        )
+        self.assertEqual(registry.resolve(Purchase, branch_id='3', filters={'f_stage': 'Booked'}), Q())
+
+    def test_filtered_source(self):
+        response = self.client.get('/api/dashboard/analytics/data/', {
+            'source': 'total_revenue', 'start_date': (date.today() - timedelta(days=7)).isoformat(),
+            'end_date': date.today().isoformat(), 'f_customer_id': self.customer.id,
+        })
+        self.assertEqual(response.json()['data']['value'], 40)
+
+        response = self.client.get('/api/dashboard/analytics/data/', {
+            'source': 'total_revenue', 'start_date': (date.today() - timedelta(days=7)).isoformat(),
+            'end_date': date.today().isoformat(), 'f_customer_id': self.customer.id + 1,
+        })
+        self.assertEqual(response.json()['data']['value'], 0)
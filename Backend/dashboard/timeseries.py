@@ -0,0 +1,131 @@
+"""
+Post-processing for analytics histories.
+
+Sources fetch daily (date, value) rows from the database or the rollup tables; Series
+turns them into a gap-filled NumPy array over the requested window, so days without
+rows are reported as zero. The array can then be resampled to weeks (starting Monday)
+or months, accumulated, smoothed with a trailing rolling window, and lined up against
+the previous period bucket by bucket, without a query or a Python loop per point.
+"""
+from datetime import datetime, time
+
+import numpy as np
+from django.utils import timezone
+
+
+PERIODS = ('day', 'week', 'month')
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def bucket(days, period):
+    """
+    First day of the day/week/month bucket of each datetime64[D] in days
+    """
+    if period == 'week':
+        # 1970-01-01 was a Thursday; shift so weeks start on Monday
+        return days - ((days.astype('int64') + 3) % 7).astype('timedelta64[D]')
+    if period == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    return days
+
+
+def bucket_index(start, stop, period):
+    """
+    Every bucket start from the bucket of start through the bucket of stop
+    """
+    first, last = bucket(np.array([start, stop], dtype='datetime64[D]'), period)
+    if period == 'month':
+        return np.arange(first.astype('datetime64[M]'), last.astype('datetime64[M]') + 1).astype('datetime64[D]')
+    step = 7 if period == 'week' else 1
+    return np.arange(first, last + np.timedelta64(1, 'D'), np.timedelta64(step, 'D'))
+
+
+class Series:
+    """
+    Values per bucket over a contiguous index of bucket start days
+    """
+
+    def __init__(self, index, values, period='day'):
+        self.index = index
+        self.values = values
+        self.period = period
+
+    @classmethod
+    def from_rows(cls, rows, start=None, stop=None, period='day', date_key='day', value_key='value'):
+        """
+        Sum rows into the period's buckets between start and stop (inclusive dates).
+        Without a window the series spans the first to the last row.
+        """
+        rows = list(rows)
+        days = np.array([_day(row[date_key]) for row in rows], dtype='datetime64[D]')
+        values = np.array([float(row[value_key] or 0) for row in rows], dtype='float64')
+
+        if start is None or stop is None:
+            if not rows:
+                return cls(np.array([], dtype='datetime64[D]'), np.array([], dtype='float64'), period)
+            start, stop = days.min(), days.max()
+        if stop < start:
+            stop = start
+
+        index = bucket_index(start, stop, period)
+        buckets = bucket(days, period)
+        inside = (days >= np.datetime64(start, 'D')) & (days <= np.datetime64(stop, 'D'))
+        positions = np.searchsorted(index, buckets[inside])
+        totals = np.bincount(positions, weights=values[inside], minlength=len(index))
+        return cls(index, totals, period)
+
+    def resample(self, period):
+        """
+        Sum into coarser buckets; the index keeps covering the same days
+        """
+        if period == self.period or not len(self.index):
+            return Series(self.index, self.values, period)
+        buckets = bucket(self.index, period)
+        index, positions = np.unique(buckets, return_inverse=True)
+        return Series(index, np.bincount(positions, weights=self.values, minlength=len(index)), period)
+
+    def cumsum(self):
+        return Series(self.index, np.cumsum(self.values), self.period)
+
+    def rolling(self, window):
+        """
+        Trailing mean over `window` buckets; the first buckets average what is available
+        """
+        window = max(int(window), 1)
+        sums = np.cumsum(self.values)
+        sums[window:] = sums[window:] - sums[:-window]
+        counts = np.minimum(np.arange(1, len(self.values) + 1), window)
+        return Series(self.index, sums / np.maximum(counts, 1), self.period)
+
+    def align(self, previous):
+        """
+        previous's values placed on this series' index bucket by bucket: the first
+        bucket of the previous period lines up with the first bucket of this one.
+        """
+        values = np.zeros(len(self.values), dtype='float64')
+        length = min(len(values), len(previous.values))
+        values[:length] = previous.values[:length]
+        return Series(self.index, values, self.period)
+
+    def transform(self, period=None, cumulative=False, rolling=None):
+        series = self.resample(period) if period else self
+        if rolling:
+            series = series.rolling(rolling)
+        if cumulative:
+            series = series.cumsum()
+        return series
+
+    def points(self, as_datetime=False, integer=False):
+        """
+        [{"date": ..., "value": ...}] as the history payloads send them
+        """
+        days = self.index.tolist()
+        values = self.values.round(2).tolist() if not integer else self.values.astype('int64').tolist()
+        if as_datetime:
+            days = [timezone.make_aware(datetime.combine(day, time.min)) for day in days]
+        return [{"date": day, "value": value} for day, value in zip(days, values)]
@@ -1,12 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import DashboardViewSet, AnalyticsDataView, CustomMetricViewSet
+from .live import dashboard_live
+from .views import DashboardViewSet, AnalyticsDataView, AnalyticsExportView, AnalyticsCacheStatsView, CustomMetricViewSet
 
 router = DefaultRouter()
 router.register(r'dashboards', DashboardViewSet)
 router.register(r'custom-metrics', CustomMetricViewSet)
 
 urlpatterns = [
+    path('dashboards/<int:pk>/live/', dashboard_live, name='dashboard-live'),
     path('', include(router.urls)),
     path('analytics/data/', AnalyticsDataView.as_view(), name='analytics-data'),
+    path('analytics/export/', AnalyticsExportView.as_view(), name='analytics-export'),
+    path('analytics/cache-stats/', AnalyticsCacheStatsView.as_view(), name='analytics-cache-stats'),
 ]
@@ -0,0 +1,245 @@
+"""
+Execution history of the Django Q automations.
+
+Every finished task is recorded as a TaskExecution row by a post_execute hook
+(masterdata.signals), with its schedule, organization, task type, target record and a
+short result summary. django_q's Task only keeps pickled args and kwargs, so finding an
+organization's tasks or a schedule's last run would otherwise mean unpickling them;
+the schedules list and the logs endpoint read this table instead.
+
+For the log rows themselves, task payloads are decoded once per task id (finished tasks
+never change) and their target records are loaded with one in_bulk per model.
+"""
+import ast
+import json
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.apps import apps
+from django.db.models import TextField
+from django.db.models.functions import Cast
+from django_q.utils import get_func_repr
+
+from crm_back.queues import default_queue
+
+# Task function -> (task type, model label of the record passed as the first argument)
+TASK_FUNCTIONS = {
+    'send_pending_invoices': ('invoices', None),
+    'send_pending_receipts': ('receipts', None),
+    'send_pending_estimates': ('estimates', None),
+    'process_raw_endpoint_leads': ('leads', None),
+    'send_new_lead_welcome_email': ('new_lead', 'masterdata.customer'),
+    'send_booked_async': ('booked', 'masterdata.customer'),
+    'send_closed_async': ('closed', 'masterdata.customer'),
+    'send_invoice_async': ('invoices', 'transactiondata.invoice'),
+    'send_receipt_async': ('receipts', 'transactiondata.paymentreceipt'),
+    'send_estimate_async': ('estimates', 'transactiondata.estimate'),
+    'process_document_signing': ('estimates', 'transactiondata.estimate'),
+}
+# Keyword arguments that carry the target record instead of the first argument
+TARGET_KWARGS = ('customer_id', 'invoice_id', 'receipt_id', 'estimate_id')
+SUMMARY_LENGTH = 255
+# Targets shown in the task log, with the relations their labels use
+LABELLED_TARGETS = {
+    'masterdata.customer': (),
+    'transactiondata.invoice': ('customer',),
+    'transactiondata.paymentreceipt': ('invoice__customer',),
+}
+PAYLOAD_FIELDS = ('result', 'args', 'kwargs')
+DECODED_CACHE_SIZE = 2000
+
+_decoded = OrderedDict()
+_decoded_lock = threading.Lock()
+
+
+def task_type_for(func, kwargs=None):
+    """
+    Task type of a task function, falling back to the task_type kwarg of event-driven schedules
+    """
+    entry = TASK_FUNCTIONS.get((func or '').rsplit('.', 1)[-1])
+    if entry:
+        return entry[0]
+    if isinstance(kwargs, dict) and kwargs.get('task_type'):
+        return kwargs['task_type']
+    return 'other'
+
+
+def target_for(func, args, kwargs):
+    """
+    (model label, id) of the record a task works on, or (None, None)
+    """
+    entry = TASK_FUNCTIONS.get((func or '').rsplit('.', 1)[-1])
+    if not entry or not entry[1]:
+        return None, None
+    target_id = args[0] if args else next((kwargs[key] for key in TARGET_KWARGS if kwargs.get(key)), None)
+    try:
+        return entry[1], int(target_id)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def summarize(result, success):
+    """
+    A one-line description of a task result
+    """
+    if isinstance(result, dict):
+        for key in ('error', 'status', 'message'):
+            if result.get(key):
+                summary = str(result[key])
+                break
+        else:
+            summary = f"Processed {result['total']} items" if 'total' in result else ''
+    elif result is None or isinstance(result, bool):
+        summary = ''
+    else:
+        summary = str(result)
+    if not summary:
+        summary = 'Completed' if success else 'Failed'
+    return summary[:SUMMARY_LENGTH]
+
+
+def schedule_kwargs(schedule):
+    """
+    A Schedule's kwargs as a dict; django_q stores them as the repr of a dict
+    """
+    kwargs = schedule.kwargs if schedule is not None else None
+    if isinstance(kwargs, str):
+        try:
+            kwargs = ast.literal_eval(kwargs)
+        except (ValueError, SyntaxError):
+            try:
+                kwargs = json.loads(kwargs.replace("'", '"'))
+            except ValueError:
+                return {}
+    return kwargs if isinstance(kwargs, dict) else {}
+
+
+def find_schedule(group, name, registry=apps):
+    """
+    The Schedule that started a task: the scheduler groups its tasks by schedule name
+    (or id), and event-driven tasks are named after their schedule
+    """
+    Schedule = registry.get_model('django_q', 'Schedule')
+    for key in (group, name):
+        if not key:
+            continue
+        schedule = Schedule.objects.filter(name=key).order_by('pk').first()
+        if schedule is None and str(key).isdigit():
+            schedule = Schedule.objects.filter(pk=key).first()
+        if schedule is not None:
+            return schedule
+    return None
+
+
+def find_organization(target_model, target_id, kwargs, schedule, registry=apps):
+    """
+    Organization id from the task kwargs, its target record or its schedule's kwargs
+    """
+    if kwargs.get('organization_id'):
+        return kwargs['organization_id']
+    if target_model and target_id:
+        organization_id = registry.get_model(target_model).objects.filter(pk=target_id).values_list(
+            'organization_id', flat=True
+        ).first()
+        if organization_id:
+            return organization_id
+    return schedule_kwargs(schedule).get('organization_id')
+
+
+def record_execution(task, registry=apps):
+    """
+    Write the TaskExecution row for a finished task package
+    """
+    TaskExecution = registry.get_model('masterdata', 'TaskExecution')
+
+    func = get_func_repr(task.get('func')) if task.get('func') else ''
+    args = task.get('args') or ()
+    kwargs = task.get('kwargs') or {}
+    schedule = find_schedule(task.get('group'), task.get('name'), registry)
+    target_model, target_id = target_for(func, args, kwargs)
+    started, stopped = task.get('started'), task.get('stopped')
+    task_type = task_type_for(func, kwargs)
+    if task_type == 'other' and schedule is not None:
+        task_type = task_type_for(schedule.func, schedule_kwargs(schedule))
+
+    # The row exists already when the task was queued through crm_back.queues.enqueue
+    execution = TaskExecution.objects.filter(task_id=task['id']).first() or TaskExecution(task_id=task['id'])
+    execution.schedule = schedule
+    execution.organization_id = find_organization(target_model, target_id, kwargs, schedule, registry)
+    execution.name = (task.get('name') or '')[:100]
+    execution.func = func[:256]
+    execution.task_type = task_type
+    execution.queue = task.get('cluster') or execution.queue or default_queue()
+    execution.target_model = target_model or ''
+    execution.target_id = target_id
+    execution.started = started
+    execution.stopped = stopped
+    execution.wait = (started - execution.enqueued_at).total_seconds() if started and execution.enqueued_at else None
+    execution.duration = (stopped - started).total_seconds() if started and stopped else None
+    execution.success = bool(task.get('success'))
+    execution.summary = summarize(task.get('result'), task.get('success'))
+    execution.save()
+
+def backfill(registry=apps):
+    """
+    Record the tasks django_q still keeps
+    """
+    Task = registry.get_model('django_q', 'Task')
+    fields = ('id', 'name', 'func', 'args', 'kwargs', 'group', 'started', 'stopped', 'success', 'result')
+    for task in Task.objects.order_by('stopped').iterator():
+        record_execution({field: getattr(task, field) for field in fields}, registry)
+
+
+def with_raw_payloads(tasks):
+    """
+    Task queryset that loads result, args and kwargs still encoded, as raw_<field>, so
+    decode_task can skip the ones it has already decoded
+    """
+    return tasks.defer(*PAYLOAD_FIELDS).annotate(
+        **{f'raw_{field}': Cast(field, TextField()) for field in PAYLOAD_FIELDS}
+    )
+
+
+def decode_task(task):
+    """
+    (result, args, kwargs) of a Task, decoded once per task id
+    """
+    with _decoded_lock:
+        if task.pk in _decoded:
+            _decoded.move_to_end(task.pk)
+            return _decoded[task.pk]
+
+    payload = []
+    for field in PAYLOAD_FIELDS:
+        if hasattr(task, f'raw_{field}'):
+            value = task._meta.get_field(field).to_python(getattr(task, f'raw_{field}'))
+        else:
+            value = getattr(task, field)
+        payload.append(value)
+    payload = tuple(payload)
+
+    if task.stopped:
+        with _decoded_lock:
+            _decoded[task.pk] = payload
+            while len(_decoded) > DECODED_CACHE_SIZE:
+                _decoded.popitem(last=False)
+    return payload
+
+
+def task_targets(tasks):
+    """
+    {(model label, id): record} for the labelled targets of tasks, one in_bulk per model
+    """
+    ids = defaultdict(set)
+    for task in tasks:
+        _result, args, kwargs = decode_task(task)
+        target_model, target_id = target_for(task.func, args or (), kwargs or {})
+        if target_model in LABELLED_TARGETS:
+            ids[target_model].add(target_id)
+
+    targets = {}
+    for target_model, target_ids in ids.items():
+        queryset = apps.get_model(target_model).objects.select_related(*LABELLED_TARGETS[target_model])
+        for pk, record in queryset.in_bulk(target_ids).items():
+            targets[(target_model, pk)] = record
+    return targets
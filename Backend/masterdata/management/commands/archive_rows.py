@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from crm_back import retention
+
+
+class Command(BaseCommand):
+    help = 'Moves log rows older than RETENTION_DAYS to compressed archive files under RETENTION_ARCHIVE_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='labels', help='Only this table (app_label.model), repeatable')
+        parser.add_argument('--chunk-size', type=int, help='Rows per archive file and delete transaction')
+
+    def handle(self, *args, **options):
+        labels = options['labels'] or list(retention.POLICIES)
+        unknown = set(labels) - set(retention.POLICIES)
+        if unknown:
+            raise CommandError(f"No retention policy for {', '.join(sorted(unknown))}; choose from {', '.join(retention.POLICIES)}")
+
+        # By hand there is no time limit
+        for label in labels:
+            policy = retention.POLICIES[label]
+            if not policy.days:
+                self.stdout.write(f'{label}: retention disabled')
+                continue
+            moved = retention.archive(policy, chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f'{label}: archived {moved} row(s) older than {policy.days} days'))
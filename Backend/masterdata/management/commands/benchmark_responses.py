@@ -0,0 +1,98 @@
+import random
+import time
+from datetime import date, datetime, time as day_start, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from crm_back.compression import brotli, compress
+from crm_back.renderers import ORJSONRenderer
+
+
+def customer_list(rows):
+    now = timezone.now()
+    return {
+        'count': rows,
+        'next': '/api/masterdata/customers?page=2',
+        'previous': None,
+        'results': [{
+            'id': i, 'job_number': f'J{i:06d}', 'full_name': f'Customer {i}', 'email': f'customer{i}@example.com',
+            'phone': f'+1 555 {i:07d}', 'company': None, 'organization': 1, 'address': f'{i} Main Street',
+            'city': 'Springfield', 'state': 'IL', 'country': 'US', 'postal_code': f'{62700 + i % 99}',
+            'source': 'website', 'stage': random.choice(['new_lead', 'estimate_sent', 'booked', 'closed']),
+            'is_archived': False, 'assigned_to': 3, 'assigned_to_name': 'Sam Mover', 'service_type': 1,
+            'service_type_name': 'Local move', 'move_date': (date.today() + timedelta(days=i % 60)).isoformat(),
+            'move_size': 2, 'move_size_name': '2 bedroom', 'branch': 1, 'branch_name': 'Downtown',
+            'origin_address': f'{i} Main Street, Springfield', 'destination_address': f'{i} Oak Avenue, Shelbyville',
+            'notes': 'Piano on the second floor, narrow stairs.', 'created_at': (now - timedelta(hours=i)).isoformat(),
+            'updated_at': now.isoformat(), 'created_by': 3, 'created_by_name': 'Sam Mover', 'upcoming_visit_id': None,
+        } for i in range(rows)],
+    }
+
+
+def estimate(rows):
+    return {
+        'id': 1, 'customer': 1, 'customer_name': 'Customer 1', 'status': 'draft',
+        'subtotal': f'{rows * 125.5:.2f}', 'total_amount': f'{rows * 130.52:.2f}',
+        'items': [{
+            'id': i, 'estimate': 1, 'charge': i % 20, 'charge_name': f'Charge {i % 20}', 'charge_type': 'hourly',
+            'category_name': 'Labour', 'rate': f'{95 + i % 7}.50', 'percentage': None, 'quantity': f'{1 + i % 5}.00',
+            'amount': f'{(95 + i % 7) * (1 + i % 5)}.50', 'is_user_modified': bool(i % 3), 'display_order': i,
+        } for i in range(rows)],
+    }
+
+
+def task_logs(rows):
+    now = timezone.now()
+    return [{
+        'id': f'{i:032x}', 'name': f'task-{i}', 'func': 'transactiondata.tasks.send_invoice_async',
+        'args': 'gAWVCQAAAAAAAABLAYWULg==', 'kwargs': 'gAV9lC4=', 'started': (now - timedelta(minutes=i)).isoformat(),
+        'stopped': (now - timedelta(minutes=i, seconds=-2)).isoformat(), 'success': True,
+        'result': 'gAWVHgAAAAAAAACMGlN1Y2Nlc3NmdWxseSBzZW50IGludm9pY2WULg==', 'task_name': 'Invoice',
+        'formatted_result': f'Successfully sent to Invoice: INV-{i:05d} (Customer {i})',
+    } for i in range(rows)]
+
+
+def dashboard_history(rows):
+    # Histories are built from pandas series, so they carry datetimes and floats, not strings
+    start = datetime.combine(date.today() - timedelta(days=rows), day_start.min)
+    points = [
+        {'date': timezone.make_aware(start + timedelta(days=i)), 'value': round(random.uniform(0, 5000), 2)}
+        for i in range(rows)
+    ]
+    return {'value': 152340.25, 'previous_value': 140112.5, 'history': points, 'previous_history': points}
+
+
+PAYLOADS = {
+    'customer list': customer_list,
+    'estimate line items': estimate,
+    'task logs': task_logs,
+    'dashboard history': dashboard_history,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compares encode time and response size of the JSON renderers, raw and compressed, on API-shaped payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Rows per payload (list rows, line items, log entries, days)')
+        parser.add_argument('--repeat', type=int, default=20, help='Encodes timed per renderer; the best run is reported')
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        renderers = {'drf': JSONRenderer(), 'orjson': ORJSONRenderer()}
+        for name, build in PAYLOADS.items():
+            data = build(options['rows'])
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, renderer in renderers.items():
+                best = float('inf')
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    body = renderer.render(data)
+                    best = min(best, time.perf_counter() - started)
+                # Compressed as CompressionMiddleware would send it
+                sizes = f'{len(body)} B raw, {len(compress(body, "gzip"))} B gzip'
+                if brotli is not None:
+                    sizes += f', {len(compress(body, "br"))} B br'
+                self.stdout.write(f'  {label:<7} {best * 1000:8.3f} ms  {sizes}')
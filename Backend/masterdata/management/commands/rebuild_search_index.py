@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from crm_back import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search tables for customers, estimates and documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'indexes', nargs='*',
+            help=f"Indexes to rebuild ({', '.join(search.SEARCH_INDEXES)}). Defaults to all."
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError('Full-text search is not available on this database backend.')
+
+        names = options['indexes'] or list(search.SEARCH_INDEXES)
+        unknown = [name for name in names if name not in search.SEARCH_INDEXES]
+        if unknown:
+            raise CommandError(f"Unknown search index: {', '.join(unknown)}")
+
+        for name in names:
+            self.stdout.write(f'Rebuilding {name} index...')
+            with transaction.atomic():
+                search.create_index(name)
+                count = search.rebuild_index(name)
+            self.stdout.write(self.style.SUCCESS(f'Indexed {count} {name}.'))
@@ -0,0 +1,23 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from crm_back import retention
+
+
+class Command(BaseCommand):
+    help = 'Loads archived rows of a table back from RETENTION_ARCHIVE_ROOT, removing the restored files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('label', help='Table to restore (app_label.model)')
+        parser.add_argument('--since', type=date.fromisoformat, help='Only files with rows on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Only files with rows on or before this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        label = options['label']
+        if label not in retention.POLICIES:
+            raise CommandError(f"No retention policy for {label}; choose from {', '.join(retention.POLICIES)}")
+
+        files, restored, skipped = retention.restore(label, options['since'], options['until'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{label}: restored {restored} row(s) from {files} file(s), skipped {skipped} already present or orphaned'
+        ))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from crm_back import queues
+
+
+class Command(BaseCommand):
+    help = 'Reports depth, wait and run times per Django Q lane and the dropped duplicates, and optionally re-routes the schedules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=60, help='Window of finished runs to report')
+        parser.add_argument('--route', action='store_true', help='Apply the lane routing to every schedule')
+
+    def handle(self, *args, **options):
+        if options['route']:
+            changed = queues.route_schedules()
+            self.stdout.write(self.style.SUCCESS(f'Re-routed {changed} schedule(s)'))
+
+        def seconds(value):
+            return '-' if value is None else f'{value:.1f}s'
+
+        self.stdout.write(f"{'queue':<12} {'workers':>7} {'depth':>6} {'oldest':>8} {'runs':>6} {'failed':>6} {'avg wait':>9} {'max wait':>9} {'avg run':>9} {'max run':>9}")
+        for row in queues.queue_stats(timedelta(minutes=options['minutes'])):
+            self.stdout.write(
+                f"{row['queue']:<12} {row['workers']:>7} {row['depth']:>6} {seconds(row['oldest_queued_seconds']):>8} "
+                f"{row['runs']:>6} {row['failures']:>6} {seconds(row['avg_wait']):>9} {seconds(row['max_wait']):>9} "
+                f"{seconds(row['avg_duration']):>9} {seconds(row['max_duration']):>9}"
+            )
+
+        dedupe = queues.dedupe_stats()
+        if dedupe:
+            self.stdout.write(f"\n{'task':<52} {'enqueued':>9} {'dropped':>8}")
+            for func, counts in dedupe.items():
+                self.stdout.write(f"{func:<52} {counts['enqueued']:>9} {counts['duplicates']:>8}")
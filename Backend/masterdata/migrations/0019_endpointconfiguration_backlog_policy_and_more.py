@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0018_documentlibrary_attachments_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='endpointconfiguration',
+            name='backlog_policy',
+            field=models.CharField(choices=[('reject', 'Reject new leads'), ('defer', 'Ask sender to retry while backlog drains')], default='reject', help_text='What to do with new leads once the backlog is full', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='endpointconfiguration',
+            name='burst_limit',
+            field=models.PositiveIntegerField(default=20, help_text='Number of leads that can arrive back to back before the rate limit applies'),
+        ),
+        migrations.AddField(
+            model_name='endpointconfiguration',
+            name='max_backlog',
+            field=models.PositiveIntegerField(default=1000, help_text='Maximum number of unprocessed raw leads kept for this endpoint (0 means unlimited)'),
+        ),
+        migrations.AddField(
+            model_name='endpointconfiguration',
+            name='rate_limit_per_minute',
+            field=models.PositiveIntegerField(default=60, help_text='Sustained number of leads accepted per minute (0 disables rate limiting)'),
+        ),
+    ]
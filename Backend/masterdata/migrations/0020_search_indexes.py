@@ -0,0 +1,88 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:40
+
+import sqlite3
+
+from django.db import migrations
+
+# Frozen copy of the index definitions in crm_back.search at the time of this
+# migration; later changes to that module must not change what this migration does.
+INDEXES = (
+    ('Customer', 'search_customer_fts', (('full_name', 'A'), ('email', 'A'), ('phone', 'B'), ('company', 'B'))),
+    ('DocumentLibrary', 'search_document_fts', (('title', 'A'), ('subject', 'B'), ('document_type', 'B'), ('description', 'C'))),
+)
+CHUNK_SIZE = 1000
+
+
+def supported(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(content)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def write_rows(cursor, vendor, table, columns, rows):
+    if vendor == 'postgresql':
+        document = ' || '.join(f"setweight(to_tsvector('simple', %s), '{weight}')" for _name, weight in columns)
+        cursor.executemany(
+            f"INSERT INTO {table} (object_id, document) VALUES (%s, {document}) "
+            f"ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document",
+            rows
+        )
+    else:
+        names = ', '.join(name for name, _weight in columns)
+        cursor.executemany(
+            f"INSERT INTO {table} (rowid, {names}) VALUES (%s, {', '.join(['%s'] * len(columns))})", rows
+        )
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if not supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for model_name, table, columns in INDEXES:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} (object_id bigint PRIMARY KEY, document tsvector NOT NULL)")
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_document ON {table} USING GIN (document)")
+            else:
+                names = ', '.join(name for name, _weight in columns)
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+                    f"USING fts5({names}, tokenize='unicode61 remove_diacritics 2')"
+                )
+            cursor.execute(f"DELETE FROM {table}")
+
+            model = apps.get_model('masterdata', model_name)
+            fields = [name for name, _weight in columns]
+            rows = []
+            for values in model._default_manager.values_list('pk', *fields).iterator(chunk_size=CHUNK_SIZE):
+                rows.append([values[0]] + ['' if value is None else str(value) for value in values[1:]])
+                if len(rows) >= CHUNK_SIZE:
+                    write_rows(cursor, connection.vendor, table, columns, rows)
+                    rows = []
+            if rows:
+                write_rows(cursor, connection.vendor, table, columns, rows)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if not supported(schema_editor.connection):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for _model_name, table, _columns in INDEXES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0019_endpointconfiguration_backlog_policy_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
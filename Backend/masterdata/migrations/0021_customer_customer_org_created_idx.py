@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0020_search_indexes'),
+        ('users', '0005_organization_google_business_link'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['organization', '-created_at', '-id'], name='customer_org_created_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0021_customer_customer_org_created_idx'),
+        ('users', '0005_organization_google_business_link'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['organization', 'stage', 'move_date'], name='customer_org_stage_move_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['organization', '-updated_at'], name='customer_org_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_q', '0019_alter_task_options_alter_ormq_key_alter_ormq_lock_and_more'),
+        ('masterdata', '0022_customer_customer_org_stage_move_idx_and_more'),
+        ('users', '0005_organization_google_business_link'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskExecution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(max_length=32, unique=True)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('func', models.CharField(max_length=256)),
+                ('task_type', models.CharField(default='other', max_length=50)),
+                ('target_model', models.CharField(blank=True, max_length=100)),
+                ('target_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('stopped', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, help_text='Seconds between start and stop', null=True)),
+                ('success', models.BooleanField(default=False)),
+                ('summary', models.CharField(blank=True, max_length=255)),
+                ('organization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='task_executions', to='users.organization')),
+                ('schedule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='executions', to='django_q.schedule')),
+            ],
+            options={
+                'ordering': ('-stopped',),
+                'indexes': [models.Index(fields=['organization', '-stopped'], name='taskexec_org_stopped_idx'), models.Index(fields=['schedule', '-stopped'], name='taskexec_schedule_stopped_idx')],
+            },
+        ),
+    ]
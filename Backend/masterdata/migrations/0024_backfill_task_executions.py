@@ -0,0 +1,177 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:08
+
+import ast
+import json
+
+from django.db import migrations
+from django_q.utils import get_func_repr
+
+# Frozen copy of masterdata.automation at the time of this migration, writing only the
+# TaskExecution fields of 0023; later changes to that module must not change what this
+# migration does.
+# Task function -> (task type, model label of the record passed as the first argument)
+TASK_FUNCTIONS = {
+    'send_pending_invoices': ('invoices', None),
+    'send_pending_receipts': ('receipts', None),
+    'send_pending_estimates': ('estimates', None),
+    'process_raw_endpoint_leads': ('leads', None),
+    'send_new_lead_welcome_email': ('new_lead', 'masterdata.customer'),
+    'send_booked_async': ('booked', 'masterdata.customer'),
+    'send_closed_async': ('closed', 'masterdata.customer'),
+    'send_invoice_async': ('invoices', 'transactiondata.invoice'),
+    'send_receipt_async': ('receipts', 'transactiondata.paymentreceipt'),
+    'send_estimate_async': ('estimates', 'transactiondata.estimate'),
+    'process_document_signing': ('estimates', 'transactiondata.estimate'),
+}
+# Keyword arguments that carry the target record instead of the first argument
+TARGET_KWARGS = ('customer_id', 'invoice_id', 'receipt_id', 'estimate_id')
+SUMMARY_LENGTH = 255
+
+
+def task_type_for(func, kwargs=None):
+    """
+    Task type of a task function, falling back to the task_type kwarg of event-driven schedules
+    """
+    entry = TASK_FUNCTIONS.get((func or '').rsplit('.', 1)[-1])
+    if entry:
+        return entry[0]
+    if isinstance(kwargs, dict) and kwargs.get('task_type'):
+        return kwargs['task_type']
+    return 'other'
+
+
+def target_for(func, args, kwargs):
+    """
+    (model label, id) of the record a task works on, or (None, None)
+    """
+    entry = TASK_FUNCTIONS.get((func or '').rsplit('.', 1)[-1])
+    if not entry or not entry[1]:
+        return None, None
+    target_id = args[0] if args else next((kwargs[key] for key in TARGET_KWARGS if kwargs.get(key)), None)
+    try:
+        return entry[1], int(target_id)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def summarize(result, success):
+    """
+    A one-line description of a task result
+    """
+    if isinstance(result, dict):
+        for key in ('error', 'status', 'message'):
+            if result.get(key):
+                summary = str(result[key])
+                break
+        else:
+            summary = f"Processed {result['total']} items" if 'total' in result else ''
+    elif result is None or isinstance(result, bool):
+        summary = ''
+    else:
+        summary = str(result)
+    if not summary:
+        summary = 'Completed' if success else 'Failed'
+    return summary[:SUMMARY_LENGTH]
+
+
+def schedule_kwargs(schedule):
+    """
+    A Schedule's kwargs as a dict; django_q stores them as the repr of a dict
+    """
+    kwargs = schedule.kwargs if schedule is not None else None
+    if isinstance(kwargs, str):
+        try:
+            kwargs = ast.literal_eval(kwargs)
+        except (ValueError, SyntaxError):
+            try:
+                kwargs = json.loads(kwargs.replace("'", '"'))
+            except ValueError:
+                return {}
+    return kwargs if isinstance(kwargs, dict) else {}
+
+
+def find_schedule(group, name, registry):
+    """
+    The Schedule that started a task: the scheduler groups its tasks by schedule name
+    (or id), and event-driven tasks are named after their schedule
+    """
+    Schedule = registry.get_model('django_q', 'Schedule')
+    for key in (group, name):
+        if not key:
+            continue
+        schedule = Schedule.objects.filter(name=key).order_by('pk').first()
+        if schedule is None and str(key).isdigit():
+            schedule = Schedule.objects.filter(pk=key).first()
+        if schedule is not None:
+            return schedule
+    return None
+
+
+def find_organization(target_model, target_id, kwargs, schedule, registry):
+    """
+    Organization id from the task kwargs, its target record or its schedule's kwargs
+    """
+    if kwargs.get('organization_id'):
+        return kwargs['organization_id']
+    if target_model and target_id:
+        organization_id = registry.get_model(target_model).objects.filter(pk=target_id).values_list(
+            'organization_id', flat=True
+        ).first()
+        if organization_id:
+            return organization_id
+    return schedule_kwargs(schedule).get('organization_id')
+
+
+def record_execution(task, registry):
+    """
+    Write the TaskExecution row for a finished task package
+    """
+    TaskExecution = registry.get_model('masterdata', 'TaskExecution')
+
+    func = get_func_repr(task.get('func')) if task.get('func') else ''
+    args = task.get('args') or ()
+    kwargs = task.get('kwargs') or {}
+    schedule = find_schedule(task.get('group'), task.get('name'), registry)
+    target_model, target_id = target_for(func, args, kwargs)
+    started, stopped = task.get('started'), task.get('stopped')
+    task_type = task_type_for(func, kwargs)
+    if task_type == 'other' and schedule is not None:
+        task_type = task_type_for(schedule.func, schedule_kwargs(schedule))
+
+    TaskExecution.objects.update_or_create(
+        task_id=task['id'],
+        defaults={
+            'schedule': schedule,
+            'organization_id': find_organization(target_model, target_id, kwargs, schedule, registry),
+            'name': (task.get('name') or '')[:100],
+            'func': func[:256],
+            'task_type': task_type,
+            'target_model': target_model or '',
+            'target_id': target_id,
+            'started': started,
+            'stopped': stopped,
+            'duration': (stopped - started).total_seconds() if started and stopped else None,
+            'success': bool(task.get('success')),
+            'summary': summarize(task.get('result'), task.get('success')),
+        },
+    )
+
+
+def backfill_task_executions(apps, schema_editor):
+    Task = apps.get_model('django_q', 'Task')
+    fields = ('id', 'name', 'func', 'args', 'kwargs', 'group', 'started', 'stopped', 'success', 'result')
+    for task in Task.objects.order_by('stopped').iterator():
+        record_execution({field: getattr(task, field) for field in fields}, apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0023_taskexecution'),
+        # Task targets are looked up on invoices, receipts and estimates
+        ('transactiondata', '0031_backfill_receivables'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_task_executions, migrations.RunPython.noop),
+    ]
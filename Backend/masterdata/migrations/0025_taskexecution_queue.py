@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_q', '0019_alter_task_options_alter_ormq_key_alter_ormq_lock_and_more'),
+        ('masterdata', '0024_backfill_task_executions'),
+        ('users', '0005_organization_google_business_link'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskexecution',
+            name='enqueued_at',
+            field=models.DateTimeField(blank=True, help_text='Set for tasks queued through crm_back.queues.enqueue', null=True),
+        ),
+        migrations.AddField(
+            model_name='taskexecution',
+            name='queue',
+            field=models.CharField(blank=True, help_text='Django Q cluster the task ran on', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='taskexecution',
+            name='wait',
+            field=models.FloatField(blank=True, help_text='Seconds between enqueue and start', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='taskexecution',
+            index=models.Index(fields=['queue', '-stopped'], name='taskexec_queue_stopped_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-19 05:40
+
+from datetime import datetime, time, timedelta
+
+from django.db import migrations
+from django.utils import timezone
+from crm_back import queues
+
+
+RETENTION_SCHEDULE = 'Archive old rows'
+RETENTION_FUNC = 'crm_back.retention.run'
+
+
+def schedule_retention(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    Schedule.objects.update_or_create(
+        name=RETENTION_SCHEDULE,
+        defaults={
+            'func': RETENTION_FUNC,
+            'schedule_type': 'D',
+            'repeats': -1,
+            # Historical models skip the pre_save routing in masterdata.signals
+            'cluster': queues.queue_for(RETENTION_FUNC),
+            # Off-peak, after the receivables re-aging
+            'next_run': timezone.make_aware(datetime.combine(tomorrow, time(3, 0))),
+        },
+    )
+
+
+def unschedule_retention(apps, schema_editor):
+    apps.get_model('django_q', 'Schedule').objects.filter(name=RETENTION_SCHEDULE).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0025_taskexecution_queue'),
+        ('django_q', '0019_alter_task_options_alter_ormq_key_alter_ormq_lock_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(schedule_retention, unschedule_retention),
+    ]
@@ -256,6 +256,11 @@ class Customer(models.Model):
         ordering = ('-created_at',)
         verbose_name = 'Customer'
         verbose_name_plural = 'Customers'
+        indexes = [
+            models.Index(fields=['organization', '-created_at', '-id'], name='customer_org_created_idx'),
+            models.Index(fields=['organization', 'stage', 'move_date'], name='customer_org_stage_move_idx'),
+            models.Index(fields=['organization', '-updated_at'], name='customer_org_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.full_name} - {self.stage}"
@@ -335,10 +340,19 @@ class EndpointConfiguration(models.Model):
     """
     Configuration for external API endpoints per organization
     """
+    BACKLOG_POLICY_CHOICES = (
+        ('reject', 'Reject new leads'),
+        ('defer', 'Ask sender to retry while backlog drains'),
+    )
+
     name = models.CharField(max_length=255)
     organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='endpoint_configs')
     secret_key = models.CharField(max_length=255, unique=True, blank=True, help_text="Secret key to be used in endpoint headers for authentication")
     mapping_config = models.JSONField(default=dict, blank=True, help_text="Mapping from incoming JSON keys to internal Customer fields")
+    rate_limit_per_minute = models.PositiveIntegerField(default=60, help_text="Sustained number of leads accepted per minute (0 disables rate limiting)")
+    burst_limit = models.PositiveIntegerField(default=20, help_text="Number of leads that can arrive back to back before the rate limit applies")
+    max_backlog = models.PositiveIntegerField(default=1000, help_text="Maximum number of unprocessed raw leads kept for this endpoint (0 means unlimited)")
+    backlog_policy = models.CharField(max_length=10, choices=BACKLOG_POLICY_CHOICES, default='reject', help_text="What to do with new leads once the backlog is full")
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -369,3 +383,36 @@ class RawEndpointLead(models.Model):
 
     def __str__(self):
         return f"Raw Lead {self.id} - {self.organization.name} at {self.created_at}"
+
+
+class TaskExecution(models.Model):
+    """
+    One finished Django Q task, written by the post_execute hook (masterdata.automation)
+    """
+    task_id = models.CharField(max_length=32, unique=True)
+    schedule = models.ForeignKey('django_q.Schedule', on_delete=models.SET_NULL, null=True, blank=True, related_name='executions')
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, null=True, blank=True, related_name='task_executions')
+    name = models.CharField(max_length=100, blank=True)
+    func = models.CharField(max_length=256)
+    task_type = models.CharField(max_length=50, default='other')
+    queue = models.CharField(max_length=50, blank=True, help_text="Django Q cluster the task ran on")
+    target_model = models.CharField(max_length=100, blank=True)
+    target_id = models.PositiveIntegerField(null=True, blank=True)
+    enqueued_at = models.DateTimeField(null=True, blank=True, help_text="Set for tasks queued through crm_back.queues.enqueue")
+    started = models.DateTimeField(null=True, blank=True)
+    stopped = models.DateTimeField(null=True, blank=True)
+    wait = models.FloatField(null=True, blank=True, help_text="Seconds between enqueue and start")
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds between start and stop")
+    success = models.BooleanField(default=False)
+    summary = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ('-stopped',)
+        indexes = [
+            models.Index(fields=['organization', '-stopped'], name='taskexec_org_stopped_idx'),
+            models.Index(fields=['schedule', '-stopped'], name='taskexec_schedule_stopped_idx'),
+            models.Index(fields=['queue', '-stopped'], name='taskexec_queue_stopped_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.func} ({'success' if self.success else 'failed'}) at {self.stopped}"
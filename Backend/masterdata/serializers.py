@@ -6,9 +6,11 @@ from .models import (
 )
 from django_q.models import Schedule, Task
 from users.models import CustomUser
+from crm_back.annotations import computed
+from crm_back.mixins import QueryNeedsMixin, SparseFieldsMixin
 
 
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     assigned_to_name = serializers.SerializerMethodField()
     created_by_name = serializers.SerializerMethodField()
     service_type_name = serializers.SerializerMethodField()
@@ -29,18 +31,27 @@ class CustomerSerializer(serializers.ModelSerializer):
             'upcoming_visit_id'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'job_number']
-    
+
+    select_related = ('assigned_to', 'created_by', 'service_type', 'move_size', 'branch')
+    annotations = ('upcoming_visit_id',)
+    field_sources = {
+        'job_number': ('id',),
+        'assigned_to_name': ('assigned_to__fullname',),
+        'created_by_name': ('created_by__fullname',),
+        'service_type_name': ('service_type__service_type',),
+        'move_size_name': ('move_size__name',),
+        'branch_name': ('branch__name',),
+    }
+
     def get_assigned_to_name(self, obj):
         if obj.assigned_to:
             return obj.assigned_to.fullname
         return None
     
     def get_upcoming_visit_id(self, obj):
-        # Find the next scheduled or in-progress visit
-        visit = obj.site_visits.filter(
+        return computed(obj, 'upcoming_visit_id', lambda: obj.site_visits.filter(
             status__in=['SCHEDULED', 'IN_PROGRESS']
-        ).order_by('scheduled_at').first()
-        return visit.id if visit else None
+        ).order_by('scheduled_at').values_list('id', flat=True).first())
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -72,7 +83,7 @@ class CustomerStatsSerializer(serializers.Serializer):
     by_source = serializers.DictField()
 
 
-class BranchSerializer(serializers.ModelSerializer):
+class BranchSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -82,6 +93,11 @@ class BranchSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'created_by', 'created_by_name'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by',)
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+    }
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -89,7 +105,7 @@ class BranchSerializer(serializers.ModelSerializer):
         return None
 
 
-class ServiceTypeSerializer(serializers.ModelSerializer):
+class ServiceTypeSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
 
     class Meta:
@@ -99,6 +115,11 @@ class ServiceTypeSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'created_by', 'created_by_name'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by',)
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+    }
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -116,7 +137,7 @@ class DocumentLibraryBasicSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'category', 'document_purpose', 'subject', 'document_type', 'is_active']
 
 
-class DocumentLibrarySerializer(serializers.ModelSerializer):
+class DocumentLibrarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     service_types = serializers.SerializerMethodField()
     branches = serializers.SerializerMethodField()
@@ -163,7 +184,7 @@ class DocumentLibrarySerializer(serializers.ModelSerializer):
         return [mapping.branch.name for mapping in mappings]
 
 
-class DocumentMappingSerializer(serializers.ModelSerializer):
+class DocumentMappingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     document_title = serializers.SerializerMethodField()
     service_type_name = serializers.SerializerMethodField()
     branch_name = serializers.SerializerMethodField()
@@ -192,7 +213,7 @@ class DocumentMappingSerializer(serializers.ModelSerializer):
         return None
 
 
-class MoveTypeSerializer(serializers.ModelSerializer):
+class MoveTypeSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -202,6 +223,11 @@ class MoveTypeSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'created_by', 'created_by_name'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by',)
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+    }
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -209,7 +235,7 @@ class MoveTypeSerializer(serializers.ModelSerializer):
         return None
 
 
-class RoomSizeSerializer(serializers.ModelSerializer):
+class RoomSizeSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -219,6 +245,11 @@ class RoomSizeSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'created_by', 'created_by_name'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by',)
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+    }
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -226,15 +257,25 @@ class RoomSizeSerializer(serializers.ModelSerializer):
         return None
 
 
-class EndpointConfigurationSerializer(serializers.ModelSerializer):
+class EndpointConfigurationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     secret_key = serializers.CharField(required=False, allow_blank=True)
+    ingestion_stats = serializers.SerializerMethodField()
 
     class Meta:
         model = EndpointConfiguration
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'organization']
 
-class RawEndpointLeadSerializer(serializers.ModelSerializer):
+    def get_ingestion_stats(self, obj):
+        from .throttling import get_counters
+        stats = get_counters(obj.id)
+        backlog = getattr(obj, 'backlog_count', None)
+        if backlog is None:
+            backlog = obj.rawendpointlead_set.filter(processed=False).count()
+        stats['backlog'] = backlog
+        return stats
+
+class RawEndpointLeadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     endpoint_name = serializers.ReadOnlyField(source='endpoint_config.name')
 
     class Meta:
@@ -242,7 +283,7 @@ class RawEndpointLeadSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['created_at']
 
-class ScheduleSerializer(serializers.ModelSerializer):
+class ScheduleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     task_type = serializers.SerializerMethodField()
     is_active = serializers.SerializerMethodField()
     
@@ -260,58 +301,39 @@ class ScheduleSerializer(serializers.ModelSerializer):
     
     def get_task_type(self, obj):
         """Extract task type from func name for easier frontend filtering"""
-        if 'send_pending_invoices' in obj.func:
-            return 'invoices'
-        elif 'send_pending_receipts' in obj.func:
-            return 'receipts'
-        elif 'send_pending_estimates' in obj.func:
-            return 'estimates'
-        elif 'process_raw_endpoint_leads' in obj.func:
-            return 'leads'
-        
-        # Check kwargs for event-driven types (New Lead, Booked, Closed)
-        if obj.kwargs:
-            import json
-            kwargs = obj.kwargs
-            if isinstance(kwargs, str):
-                try:
-                    kwargs = json.loads(kwargs.replace("'", '"')) # Simple correction for single quotes
-                except:
-                    pass
-            if isinstance(kwargs, dict):
-                if kwargs.get('task_type'):
-                    return kwargs.get('task_type')
-                    
-        return 'other'
+        from .automation import task_type_for, schedule_kwargs
+        return task_type_for(obj.func, schedule_kwargs(obj))
     
     def get_is_active(self, obj):
         """Determine if schedule is active based on repeats value"""
         return obj.repeats > 0 or obj.repeats == -1
 
+    def latest_execution(self, obj):
+        """Latest TaskExecution of the schedule, for schedules not annotated by ScheduleViewSet"""
+        if not hasattr(obj, '_latest_execution'):
+            obj._latest_execution = obj.executions.filter(stopped__isnull=False).order_by('-stopped').values('stopped', 'success').first() or {}
+        return obj._latest_execution
+
     def get_last_run(self, obj):
         """Get the stopped time of the latest task for this schedule"""
-        from django_q.models import Task
-        # Look for tasks by name (if set) or by exact func
-        task = Task.objects.filter(name=obj.name).order_by('-stopped').first()
-        if not task:
-            task = Task.objects.filter(func=obj.func).order_by('-stopped').first()
-        
-        return task.stopped if task else None
+        if hasattr(obj, 'last_run_at'):
+            return obj.last_run_at
+        return self.latest_execution(obj).get('stopped')
 
     def get_success(self, obj):
         """Get the success status of the latest task for this schedule"""
-        from django_q.models import Task
-        task = Task.objects.filter(name=obj.name).order_by('-stopped').first()
-        if not task:
-            task = Task.objects.filter(func=obj.func).order_by('-stopped').first()
-            
-        return task.success if task else None
+        if hasattr(obj, 'last_success'):
+            return obj.last_success
+        return self.latest_execution(obj).get('success')
 
 
 class TaskSerializer(serializers.ModelSerializer):
     """Serializer for django_q.models.Task to show execution history"""
     task_name = serializers.SerializerMethodField()
     formatted_result = serializers.SerializerMethodField()
+    args = serializers.SerializerMethodField()
+    kwargs = serializers.SerializerMethodField()
+    result = serializers.SerializerMethodField()
     
     class Meta:
         model = Task
@@ -320,6 +342,34 @@ class TaskSerializer(serializers.ModelSerializer):
             'stopped', 'success', 'result', 'task_name', 'formatted_result'
         ]
 
+    def payload(self, obj, field):
+        """
+        The decoded payload when it is JSON-serializable, otherwise its stored encoding
+        """
+        import json
+        from django.core.serializers.json import DjangoJSONEncoder
+        from .automation import PAYLOAD_FIELDS, decode_task
+
+        value = decode_task(obj)[PAYLOAD_FIELDS.index(field)]
+        try:
+            json.dumps(value, cls=DjangoJSONEncoder)
+            return value
+        except (TypeError, ValueError):
+            pass
+        # Payloads loaded by automation.with_raw_payloads are still encoded
+        if hasattr(obj, f'raw_{field}'):
+            return getattr(obj, f'raw_{field}')
+        return obj._meta.get_field(field).value_to_string(obj)
+
+    def get_args(self, obj):
+        return self.payload(obj, 'args')
+
+    def get_kwargs(self, obj):
+        return self.payload(obj, 'kwargs')
+
+    def get_result(self, obj):
+        return self.payload(obj, 'result')
+
     def get_task_name(self, obj):
         # Extract function name and make it pretty
         if not obj.func:
@@ -333,66 +383,34 @@ class TaskSerializer(serializers.ModelSerializer):
         return name
 
     def get_formatted_result(self, obj):
-        # Helper to safely decode data
-        def safe_decode(data):
-            if not data:
-                return data
-            if isinstance(data, (dict, list, tuple)):
-                return data
-            try:
-                import base64
-                import pickle
-                decoded = base64.b64decode(data)
-                return pickle.loads(decoded)
-            except:
-                return data
+        from .automation import decode_task, target_for, task_targets
 
-        result_data = safe_decode(obj.result)
-        args_data = safe_decode(obj.args) or []
-        kwargs_data = safe_decode(obj.kwargs) or {}
+        result_data, args_data, kwargs_data = decode_task(obj)
+        args_data = args_data or []
+        kwargs_data = kwargs_data or {}
 
         # Identify the target customer from args or kwargs
         target = "System Task"
         
-        # Try to find a customer/invoice/receipt ID to make it more specific
-        from masterdata.models import Customer
-        from transactiondata.models import Invoice, PaymentReceipt
-        
         func_name = obj.func or ""
-        
-        # Extract ID from args or common kwarg names
-        item_id = args_data[0] if args_data else (
-            kwargs_data.get('customer_id') or 
-            kwargs_data.get('invoice_id') or 
-            kwargs_data.get('receipt_id') or 
-            kwargs_data.get('estimate_id')
-        )
+
+        # Target records of the whole page are loaded by the view (automation.task_targets)
+        targets = self.context.get('targets')
+        if targets is None:
+            targets = task_targets([obj])
+        target_model, item_id = target_for(func_name, args_data, kwargs_data)
+        record = targets.get((target_model, item_id))
         
         if 'send_new_lead_welcome_email' in func_name and item_id:
-            try:
-                c = Customer.objects.get(id=item_id)
-                target = f"Lead: {c.full_name}"
-            except: target = "New Lead"
+            target = f"Lead: {record.full_name}" if record else "New Lead"
         elif 'invoice_async' in func_name and item_id:
-            try:
-                inv = Invoice.objects.get(id=item_id)
-                target = f"Invoice: {inv.invoice_number} ({inv.customer.full_name})"
-            except: target = "Invoice"
+            target = f"Invoice: {record.invoice_number} ({record.customer.full_name})" if record else "Invoice"
         elif 'receipt_async' in func_name and item_id:
-            try:
-                rcpt = PaymentReceipt.objects.get(id=item_id)
-                target = f"Receipt: {rcpt.invoice.invoice_number} ({rcpt.invoice.customer.full_name})"
-            except: target = "Receipt"
+            target = f"Receipt: {record.invoice.invoice_number} ({record.invoice.customer.full_name})" if record else "Receipt"
         elif 'booked_async' in func_name and item_id:
-            try:
-                c = Customer.objects.get(id=item_id)
-                target = f"Booking: {c.full_name}"
-            except: target = "Booking"
+            target = f"Booking: {record.full_name}" if record else "Booking"
         elif 'closed_async' in func_name and item_id:
-            try:
-                c = Customer.objects.get(id=item_id)
-                target = f"Closed: {c.full_name}"
-            except: target = "Closed Sale"
+            target = f"Closed: {record.full_name}" if record else "Closed Sale"
         elif 'send_pending' in func_name:
             if isinstance(result_data, dict):
                 sent_names = result_data.get('sent_customers', [])
@@ -0,0 +1,57 @@
+import logging
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django_q.models import Schedule
+from django_q.signals import post_execute
+from crm_back import queues, search
+from . import automation
+from .models import Customer, DocumentLibrary
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Customer)
+def customer_search_index(sender, instance, **kwargs):
+    """
+    Keep the customer full-text index in sync
+    """
+    search.index_instance('customers', instance)
+
+
+@receiver(post_delete, sender=Customer)
+def customer_search_remove(sender, instance, **kwargs):
+    search.remove_instance('customers', instance.pk)
+
+
+@receiver(post_save, sender=DocumentLibrary)
+def document_search_index(sender, instance, **kwargs):
+    """
+    Keep the document full-text index in sync
+    """
+    search.index_instance('documents', instance)
+
+
+@receiver(post_delete, sender=DocumentLibrary)
+def document_search_remove(sender, instance, **kwargs):
+    search.remove_instance('documents', instance.pk)
+
+
+@receiver(post_execute)
+def task_execution_record(sender, task, **kwargs):
+    """
+    Release the task's idempotency key and record it for the automation history
+    """
+    queues.release(task)
+    try:
+        automation.record_execution(task)
+    except Exception:
+        # The monitor process must keep saving results
+        logger.exception(f"Failed to record execution of task {task.get('id')}")
+
+
+@receiver(pre_save, sender=Schedule)
+def schedule_route(sender, instance, **kwargs):
+    """
+    Run schedules on their function's lane
+    """
+    instance.cluster = queues.schedule_cluster(instance)
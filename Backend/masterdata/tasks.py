@@ -1,5 +1,6 @@
 import logging
 from .models import RawEndpointLead, Customer, EndpointConfiguration
+from django.conf import settings
 from django.utils import timezone
 from datetime import datetime
 
@@ -101,7 +102,7 @@ def process_raw_endpoint_leads(endpoint_config_id=None, **kwargs):
             # TRIGGER WELCOME EMAIL FOR NEW CUSTOMERS
             if created and customer.email:
                 try:
-                    from django_q.tasks import async_task
+                    from crm_back.queues import enqueue
                     from transactiondata.tasks import send_new_lead_welcome_email, get_active_schedule
                     
                     # Link task to schedule for UI tracking
@@ -111,7 +112,10 @@ def process_raw_endpoint_leads(endpoint_config_id=None, **kwargs):
                         if schedule:
                             task_name = schedule.name
                             
-                    async_task(send_new_lead_welcome_email, customer.id, q_options={'name': task_name} if task_name else None)
+                    enqueue(
+                        send_new_lead_welcome_email, customer.id, q_options={'name': task_name} if task_name else None,
+                        idempotency_key=(customer.id, 'new_lead'), debounce=settings.TASK_DEBOUNCE_SECONDS
+                    )
                 except Exception as e:
                     logger.error(f"Failed to trigger welcome email for lead {lead.id}: {e}")
 
@@ -1,3 +1,602 @@
-from django.test import TestCase
+import csv
+import io
+from unittest import skipUnless
 
-# Create your tests here.
+from django.test import TransactionTestCase
+
+from crm_back.testing import OrganizationTestCase, QueryPlanTestCase
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class CustomerQueryPlanTests(QueryPlanTestCase):
+    """
+    Hot customer list queries must stay on an index
+    """
+
+    def test_customer_list(self):
+        self.assertNoFullScans('/api/masterdata/customers')
+
+    def test_customer_list_filtered(self):
+        for params in ({'stage': 'booked'}, {'source': 'other'}, {'assigned_to': 'unassigned'}, {'search': 'jan'}):
+            with self.subTest(params=params):
+                self.assertNoFullScans('/api/masterdata/customers', params)
+
+    def test_customer_list_cursor(self):
+        self.assertNoFullScans('/api/masterdata/customers', {'cursor': ''})
+
+    def test_customer_statistics(self):
+        self.assertNoFullScans('/api/masterdata/customer-statistics')
+
+
+class CustomerStatisticsTests(OrganizationTestCase):
+    """
+    Customer statistics cost one conditional aggregate plus one GROUP BY per breakdown
+    """
+
+    def test_statistics_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .models import Customer
+
+        Customer.objects.create(full_name='New Lead', organization=self.organization, source='google')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/masterdata/customer-statistics')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(response.json(), {
+            'total_customers': 2,
+            'total_leads': 1,
+            'unassigned_leads': 1,
+            'by_stage': {'booked': 1, 'new_lead': 1},
+            'by_source': {'other': 1, 'google': 1},
+        })
+        customer_queries = [q for q in captured.captured_queries if 'FROM "masterdata_customer"' in q['sql']]
+        self.assertEqual(len(customer_queries), 3)
+
+    def test_sources_outside_choices(self):
+        from .models import Customer
+
+        # Lead ingestion names the source after the endpoint
+        Customer.objects.create(full_name='Zillow Lead', email='zillow@example.com', organization=self.organization, source='zillow')
+        stats = self.client.get('/api/masterdata/customer-statistics').json()
+        self.assertEqual(stats['by_source'], {'other': 1, 'zillow': 1})
+        self.assertEqual(sum(stats['by_source'].values()), stats['total_customers'])
+        self.assertEqual(sum(stats['by_stage'].values()), stats['total_customers'])
+
+
+class CustomerListQueryTests(OrganizationTestCase):
+    """
+    The customer list loads its related names and upcoming visits in the page query
+    """
+
+    def test_constant_queries(self):
+        from django.utils import timezone
+        from masterdata.models import Branch, Customer
+        from sitevisits.models import SiteVisit
+
+        branch = Branch.objects.create(name='North', organization=self.organization, created_by=self.user)
+        for number in range(10):
+            customer = Customer.objects.create(
+                full_name=f'Customer {number}', email=f'customer{number}@example.com', organization=self.organization, branch=branch,
+                service_type=self.customer.service_type, assigned_to=self.user, created_by=self.user
+            )
+            SiteVisit.objects.create(
+                customer=customer, organization=self.organization, surveyor=self.user,
+                scheduled_at=timezone.now() + timezone.timedelta(days=number + 1)
+            )
+
+        response = self.assertConstantQueries('/api/masterdata/customers')
+        first = response.data['results'][0]
+        self.assertEqual((first['branch_name'], first['assigned_to_name']), ('North', 'Plan Tester'))
+        visit = SiteVisit.objects.get(customer_id=first['id'])
+        self.assertEqual(first['upcoming_visit_id'], visit.id)
+
+        # The page is one query on the customers, their related names and next visits
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get('/api/masterdata/customers', {'cursor': '', 'page_size': 10})
+        reads = [query['sql'] for query in captured.captured_queries if 'sitevisits_sitevisit' in query['sql']]
+        # The page query, and the ETag aggregate over the customers and their visits
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(all('masterdata_customer' in sql for sql in reads))
+
+    def test_tampered_cursor(self):
+        import base64
+        import json
+
+        for payload in ({'v': 'notadate', 'id': '1'}, {'v': '2024-01-01T00:00:00Z', 'id': 'abc'}, {'id': '1'}, [1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            with self.subTest(payload=payload):
+                response = self.client.get('/api/masterdata/customers', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+        self.assertEqual(self.client.get('/api/masterdata/customers', {'cursor': 'not base64!'}).status_code, 404)
+
+
+class CustomerExportTests(OrganizationTestCase):
+    """
+    Customer exports stream the filtered list without building model instances
+    """
+
+    def export(self, params=None):
+        response = self.client.get('/api/masterdata/customers/export', params or {})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def rows(self, params=None):
+        response = self.export(params)
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_csv(self):
+        from .models import Customer
+        Customer.objects.create(full_name='Sam Archer', organization=self.organization, source='google', is_archived=True)
+
+        rows = self.rows()
+        self.assertEqual(rows[0][:3], ['id', 'full_name', 'email'])
+        # Archived customers are left out, as in the list
+        self.assertEqual([row[1] for row in rows[1:]], ['Jane Walker'])
+
+    def test_filters(self):
+        from datetime import date, timedelta
+        from .models import Customer
+        Customer.objects.create(full_name='Sam Archer', organization=self.organization, source='google')
+
+        self.assertEqual([row[1] for row in self.rows({'f_source': 'Google'})[1:]], ['Sam Archer'])
+        self.assertEqual(len(self.rows({'rep_id': self.user.id})), 1)
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.rows({'start_date': tomorrow})), 1)
+        self.assertEqual(len(self.rows({'end_date': tomorrow})), 3)
+
+    def test_invalid_output(self):
+        response = self.client.get('/api/masterdata/customers/export', {'output': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(pyarrow, 'Arrow and Parquet exports need pyarrow')
+    def test_parquet_and_arrow(self):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(io.BytesIO(b''.join(self.export({'output': 'parquet'}).streaming_content)))
+        self.assertEqual(table.column('full_name').to_pylist(), ['Jane Walker'])
+
+        stream = b''.join(self.export({'output': 'arrow'}).streaming_content)
+        table = pyarrow.ipc.open_stream(stream).read_all()
+        self.assertEqual(table.column('id').to_pylist(), [self.customer.id])
+
+
+class AutomationHistoryTests(OrganizationTestCase):
+    """
+    Finished tasks are recorded per organization and the automation endpoints read the record
+    """
+
+    def run_task(self, task_id, func, *args, group=None, name=None, success=True, result=None, **kwargs):
+        from datetime import timedelta
+        from django.utils import timezone
+        from django_q.models import Task
+        from django_q.signals import post_execute
+
+        started = timezone.now()
+        task = {
+            'id': task_id, 'name': name or task_id, 'func': func, 'args': args, 'kwargs': kwargs, 'group': group,
+            'started': started, 'stopped': started + timedelta(seconds=2), 'success': success, 'result': result,
+        }
+        Task.objects.create(**task)
+        post_execute.send(sender='django_q', task=task)
+
+    def test_record_and_read(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django_q.models import Schedule
+        from users.models import Organization
+        from .models import TaskExecution
+
+        schedule = Schedule.objects.create(
+            name='Invoices Automation', func='transactiondata.tasks.send_pending_invoices', schedule_type='H',
+            minutes=60, repeats=-1, kwargs=str({'task_type': 'invoices', 'organization_id': self.organization.id})
+        )
+        other = Organization.objects.create(name='Other Movers')
+        self.run_task('a' * 32, 'transactiondata.tasks.send_pending_invoices', group=schedule.name, result={'total': 3})
+        self.run_task('b' * 32, 'transactiondata.tasks.send_invoice_async', self.invoice.id, success=False, result={'error': 'SMTP down'})
+        self.run_task('c' * 32, 'transactiondata.tasks.send_pending_receipts', organization_id=other.id)
+
+        execution = TaskExecution.objects.get(task_id='b' * 32)
+        self.assertEqual((execution.organization_id, execution.task_type), (self.organization.id, 'invoices'))
+        self.assertEqual((execution.target_model, execution.target_id), ('transactiondata.invoice', self.invoice.id))
+        self.assertEqual((execution.duration, execution.summary), (2.0, 'SMTP down'))
+        self.assertEqual(TaskExecution.objects.get(task_id='a' * 32).schedule, schedule)
+
+        logs = self.assertNoFullScans('/api/masterdata/schedules/logs').json()
+        self.assertEqual({log['id'] for log in logs}, {'a' * 32, 'b' * 32})
+
+        with CaptureQueriesContext(connection) as captured:
+            schedules = self.client.get('/api/masterdata/schedules').json()
+        self.assertEqual([(s['task_type'], s['success']) for s in schedules], [('invoices', True)])
+        self.assertFalse([q for q in captured.captured_queries if 'django_q_task' in q['sql']])
+
+    def test_logs_batch_targets(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from transactiondata.models import PaymentReceipt
+        from . import automation
+
+        receipt = PaymentReceipt.objects.get(invoice=self.invoice)
+        for i in range(5):
+            self.run_task(f'{i:032d}', 'transactiondata.tasks.send_invoice_async', self.invoice.id)
+            self.run_task(f'{i + 10:032d}', 'transactiondata.tasks.send_receipt_async', receipt.id)
+            self.run_task(f'{i + 20:032d}', 'transactiondata.tasks.send_booked_async', self.customer.id)
+
+        with CaptureQueriesContext(connection) as captured:
+            logs = self.client.get('/api/masterdata/schedules/logs').json()
+        self.assertEqual(len(logs), 15)
+        self.assertIn('Successfully sent to Invoice: INV-PLAN-1 (Jane Walker)', {log['formatted_result'] for log in logs})
+        self.assertIn('Successfully sent to Booking: Jane Walker', {log['formatted_result'] for log in logs})
+        for table in ('masterdata_customer', 'transactiondata_invoice', 'transactiondata_paymentreceipt'):
+            with self.subTest(table=table):
+                self.assertEqual(len([q for q in captured.captured_queries if f'FROM "{table}"' in q['sql']]), 1)
+
+        # Finished tasks are decoded once
+        self.assertIn('0' * 32, automation._decoded)
+
+    def test_logs_payloads(self):
+        self.run_task('d' * 32, 'transactiondata.tasks.send_invoice_async', self.invoice.id, result=3)
+        self.run_task('e' * 32, 'transactiondata.tasks.send_pending_invoices', result={'total': 3, 'sent': [1, 2]}, organization_id=self.organization.id)
+        self.run_task('f' * 32, 'transactiondata.tasks.send_booked_async', self.customer.id, result={1, 2})
+
+        logs = {log['id']: log for log in self.client.get('/api/masterdata/schedules/logs').json()}
+        self.assertEqual((logs['d' * 32]['result'], logs['d' * 32]['args']), (3, [self.invoice.id]))
+        self.assertEqual(logs['e' * 32]['result'], {'total': 3, 'sent': [1, 2]})
+        self.assertEqual(logs['e' * 32]['kwargs'], {'organization_id': self.organization.id})
+        # Values JSON cannot carry keep their stored encoding
+        self.assertIsInstance(logs['f' * 32]['result'], str)
+
+
+class TaskQueueTests(OrganizationTestCase):
+    """
+    Tasks and schedules are routed to their lane, and each lane's depth and wait are reported
+    """
+
+    def test_routing(self):
+        from django.test import override_settings
+        from django_q.models import OrmQ, Schedule
+        from crm_back import queues
+
+        self.assertIsNone(queues.queue_for('transactiondata.tasks.send_booked_async'))
+        with override_settings(TASK_QUEUES_ENABLED=True):
+            from transactiondata.tasks import send_booked_async
+            self.assertEqual(queues.queue_for(send_booked_async), 'interactive')
+            self.assertEqual(queues.queue_for('transactiondata.tasks.send_invoice_async'), 'pdf')
+            self.assertIsNone(queues.queue_for('masterdata.tasks.noop_automation'))
+
+            schedule = Schedule.objects.create(name='Sweep', func='transactiondata.tasks.send_pending_invoices', schedule_type='H')
+            self.assertEqual(schedule.cluster, 'bulk')
+            manual = Schedule.objects.create(name='Manual', func='transactiondata.tasks.send_pending_receipts', cluster='night')
+            self.assertEqual(manual.cluster, 'night')
+
+            OrmQ.objects.all().delete()
+            task_id = queues.enqueue(send_booked_async, self.customer.id)
+            self.assertEqual(list(OrmQ.objects.values_list('key', flat=True)), ['interactive'])
+
+        # Without lanes the schedules go back to the default cluster
+        self.assertEqual(queues.route_schedules(), 1)
+        schedule.refresh_from_db()
+        self.assertIsNone(schedule.cluster)
+
+        stats = {row['queue']: row for row in self.client.get('/api/masterdata/schedules/queues').json()['queues']}
+        self.assertEqual(set(stats), {'DjangORM', 'interactive', 'pdf', 'bulk', 'ingestion'})
+        self.assertEqual((stats['interactive']['depth'], stats['interactive']['runs']), (1, 0))
+
+        from datetime import timedelta
+        from django_q.signals import post_execute
+        from .models import TaskExecution
+
+        execution = TaskExecution.objects.get(task_id=task_id)
+        started = execution.enqueued_at + timedelta(seconds=3)
+        post_execute.send(sender='django_q', task={
+            'id': task_id, 'name': 'booked', 'func': 'transactiondata.tasks.send_booked_async', 'args': (self.customer.id,),
+            'kwargs': {}, 'cluster': 'interactive', 'started': started, 'stopped': started + timedelta(seconds=1), 'success': True,
+        })
+        execution.refresh_from_db()
+        self.assertEqual((execution.queue, execution.wait, execution.duration), ('interactive', 3.0, 1.0))
+
+    def test_idempotency_keys(self):
+        from django.utils import timezone
+        from django_q.models import OrmQ
+        from django_q.signals import post_execute
+        from crm_back import queues
+
+        func = 'transactiondata.tasks.send_invoice_async'
+        OrmQ.objects.all().delete()
+        task_id = queues.enqueue(func, self.invoice.id, idempotency_key=self.invoice.id)
+        self.assertIsNotNone(task_id)
+        self.assertIsNone(queues.enqueue(func, self.invoice.id, idempotency_key=self.invoice.id))
+        with queues.claimed(func, self.invoice.id) as acquired:
+            self.assertFalse(acquired)
+        self.assertEqual(OrmQ.objects.count(), 1)
+
+        def finish(task_id, success=True):
+            now = timezone.now()
+            post_execute.send(sender='django_q', task={
+                'id': task_id, 'name': task_id, 'func': func, 'args': (self.invoice.id,), 'kwargs': {},
+                'started': now, 'stopped': now, 'success': success,
+            })
+
+        # A failed run is retried by the broker, so its key stays held
+        finish(task_id, success=False)
+        self.assertIsNone(queues.enqueue(func, self.invoice.id, idempotency_key=self.invoice.id))
+        finish(task_id)
+        task_id = queues.enqueue(func, self.invoice.id, idempotency_key=self.invoice.id, debounce=60)
+        self.assertIsNotNone(task_id)
+
+        # Within the debounce window after the run, the same call is still dropped
+        finish(task_id)
+        self.assertIsNone(queues.enqueue(func, self.invoice.id, idempotency_key=self.invoice.id, debounce=60))
+        self.assertIsNotNone(queues.enqueue(func, self.invoice.id, idempotency_key=(self.invoice.id, 2)))
+
+        dedupe = self.client.get('/api/masterdata/schedules/queues').json()['dedupe']
+        self.assertEqual(dedupe[func], {'enqueued': 3, 'duplicates': 4})
+
+    def test_finished_before_enqueue_returns(self):
+        from datetime import timedelta
+        from unittest import mock
+        from django.utils import timezone
+        from django_q.signals import post_execute
+        from crm_back import queues
+        from .models import TaskExecution
+
+        def run_now(func, *args, **kwargs):
+            # Sync mode, or a worker that finishes before async_task returns
+            started = timezone.now()
+            post_execute.send(sender='django_q', task={
+                'id': 'g' * 32, 'name': 'booked', 'func': func, 'args': args, 'kwargs': {},
+                'started': started, 'stopped': started + timedelta(seconds=1), 'success': True,
+            })
+            return 'g' * 32
+
+        before = timezone.now()
+        with mock.patch('django_q.tasks.async_task', side_effect=run_now):
+            task_id = queues.enqueue('transactiondata.tasks.send_booked_async', self.customer.id)
+        execution = TaskExecution.objects.get(task_id=task_id)
+        self.assertTrue(before <= execution.enqueued_at <= execution.started)
+        self.assertEqual((execution.success, execution.duration), (True, 1.0))
+        self.assertIsNotNone(execution.wait)
+        self.assertGreaterEqual(execution.wait, 0)
+
+
+class TaskExecutionMigrationTests(TransactionTestCase):
+    """
+    The task execution backfill runs on a database that already has Django Q tasks
+    """
+
+    migrate_from = [('masterdata', '0023_taskexecution')]
+    migrate_to = [('masterdata', '0024_backfill_task_executions')]
+
+    def tearDown(self):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfill_with_tasks(self):
+        from datetime import timedelta
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+        from django.utils import timezone
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        organization = apps.get_model('users', 'Organization').objects.create(name='Migrated Movers')
+        started = timezone.now()
+        apps.get_model('django_q', 'Task').objects.create(
+            id='h' * 32, name='receipts', func='transactiondata.tasks.send_pending_receipts', args=(),
+            kwargs={'organization_id': organization.id}, started=started, stopped=started + timedelta(seconds=2),
+            success=True, result={'total': 4},
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        apps = executor.loader.project_state(self.migrate_to).apps
+        execution = apps.get_model('masterdata', 'TaskExecution').objects.get(task_id='h' * 32)
+        self.assertEqual((execution.organization_id, execution.task_type), (organization.id, 'receipts'))
+        self.assertEqual((execution.duration, execution.summary), (2.0, 'Processed 4 items'))
+
+
+class ResponseEncodingTests(OrganizationTestCase):
+    """
+    The orjson renderer and parser agree with DRF's, and large JSON responses are compressed
+    """
+
+    def test_renderer_matches_drf(self):
+        import decimal
+        import json
+        from datetime import date, datetime, timedelta, timezone as tz
+        from rest_framework.renderers import JSONRenderer
+        from crm_back.renderers import ORJSONParser, ORJSONRenderer
+
+        data = {
+            'amount': decimal.Decimal('12.50'),
+            'at': datetime(2024, 5, 1, 9, 30, 15, 123456, tzinfo=tz.utc),
+            'local': datetime(2024, 5, 1, 9, 30, tzinfo=tz(timedelta(hours=2))),
+            'day': date(2024, 5, 1),
+            'by_id': {1: 'one'},
+            'name': 'Zoë',
+        }
+        body = ORJSONRenderer().render(data)
+        self.assertEqual(json.loads(body), json.loads(JSONRenderer().render(data)))
+        self.assertIn(JSONRenderer().render({'at': data['at']})[1:-1], body)
+        self.assertIn('"Zoë"'.encode(), body)
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+        parsed = ORJSONParser().parse(io.BytesIO(body))
+        self.assertEqual(parsed['by_id'], {'1': 'one'})
+        from rest_framework.exceptions import ParseError
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"broken": '))
+
+    def test_renderer_matches_drf_for_models(self):
+        from datetime import datetime, time, timezone as tz
+        from rest_framework.renderers import JSONRenderer
+        from crm_back.renderers import ORJSONRenderer
+        from transactiondata.models import TimeWindow
+        from transactiondata.serializers import TimeWindowSerializer
+        from .models import Customer
+
+        Customer.objects.filter(pk=self.customer.pk).update(updated_at=datetime(2024, 5, 1, 9, 30, 15, 123456, tzinfo=tz.utc))
+        window = TimeWindow.objects.create(name='Morning', start_time=time(8, 0, 0, 250000), end_time=time(12))
+        for data in (
+            Customer.objects.filter(pk=self.customer.pk).values('id', 'updated_at', 'move_date').get(),
+            TimeWindowSerializer(window).data,
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_json_requests(self):
+        response = self.client.patch(
+            f'/api/masterdata/customers/{self.customer.id}', {'notes': 'Fragile – glass'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['notes'], 'Fragile – glass')
+        response = self.client.post('/api/masterdata/customers', b'{"full_name": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_compression(self):
+        import gzip
+        import json
+        from django.test import override_settings
+        from masterdata.models import Customer
+
+        for number in range(20):
+            Customer.objects.create(
+                full_name=f'Customer {number}', email=f'customer{number}@example.com', organization=self.organization,
+                service_type=self.customer.service_type, created_by=self.user
+            )
+
+        plain = self.client.get('/api/masterdata/customers')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        compressed = self.client.get('/api/masterdata/customers', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertLess(int(compressed['Content-Length']), len(plain.content))
+        self.assertEqual(json.loads(gzip.decompress(compressed.content)), plain.json())
+        self.assertTrue(compressed['ETag'].startswith('W/'))
+
+        refused = self.client.get('/api/masterdata/customers', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(refused.has_header('Content-Encoding'))
+
+        with override_settings(COMPRESSION_MIN_BYTES=len(plain.content) + 1):
+            small = self.client.get('/api/masterdata/customers', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    def test_benchmark_command(self):
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command('benchmark_responses', rows=5, repeat=1, stdout=out)
+        for name in ('customer list', 'estimate line items', 'task logs', 'dashboard history'):
+            self.assertIn(name, out.getvalue())
+        self.assertIn('orjson', out.getvalue())
+
+
+class LeadIngestionThrottlingTests(OrganizationTestCase):
+    """
+    The ingestion endpoint enforces its per-endpoint rate limit and backlog bound
+    """
+
+    def setUp(self):
+        super().setUp()
+        from .models import EndpointConfiguration
+        self.config = EndpointConfiguration.objects.create(
+            name='Website', organization=self.organization, rate_limit_per_minute=60, burst_limit=2, max_backlog=0
+        )
+        self.url = f'/api/masterdata/lead-ingestion/{self.config.id}'
+
+    def stats(self):
+        response = self.client.get(f'/api/masterdata/endpoint-configs/{self.config.id}')
+        return response.json()['ingestion_stats']
+
+    def test_rate_limit(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.url, {'name': 'Lead'}, format='json').status_code, 201)
+        response = self.client.post(self.url, {'name': 'Lead'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.json()['retry_after'], 1)
+
+        stats = self.stats()
+        self.assertEqual((stats['accepted'], stats['rejected_rate_limit'], stats['backlog']), (2, 1, 2))
+
+    def test_concurrent_requests_share_the_burst(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from .throttling import consume_token
+
+        self.config.burst_limit = 5
+        now = 1_000_000.0
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda _: consume_token(self.config, now=now), range(20)))
+        self.assertEqual(sum(allowed for allowed, _ in results), 5)
+
+    def test_backlog_full(self):
+        from django_q.models import OrmQ
+
+        self.config.rate_limit_per_minute = 0
+        self.config.max_backlog = 1
+        self.config.save()
+        self.assertEqual(self.client.post(self.url, {'name': 'Lead'}, format='json').status_code, 201)
+
+        response = self.client.post(self.url, {'name': 'Lead'}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.has_header('Retry-After'))
+
+        # Deferring asks the sender to come back and queues one drain run
+        self.config.backlog_policy = 'defer'
+        self.config.save()
+        OrmQ.objects.all().delete()
+        for _ in range(2):
+            response = self.client.post(self.url, {'name': 'Lead'}, format='json')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(OrmQ.objects.count(), 1)
+
+        stats = self.stats()
+        self.assertEqual(
+            (stats['accepted'], stats['rejected_backlog'], stats['deferred'], stats['backlog']), (1, 1, 2, 1)
+        )
+
+
+class CustomerSearchTests(OrganizationTestCase):
+    """
+    ?search= matches word prefixes through the index and short or numeric terms anywhere
+    """
+
+    def setUp(self):
+        super().setUp()
+        from .models import Customer
+        self.bob = Customer.objects.create(
+            full_name='Bob Stone', email='bob@example.com', phone='5551234567', company='Walker Freight',
+            organization=self.organization, service_type=self.customer.service_type
+        )
+
+    def search(self, term, **params):
+        response = self.client.get('/api/masterdata/customers', {'search': term, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['full_name'] for row in response.data]
+
+    def test_prefixes(self):
+        self.assertEqual(self.search('jan wal'), ['Jane Walker'])
+        self.assertEqual(self.search('alker'), [])
+
+    def test_short_and_numeric_terms(self):
+        self.assertEqual(self.search('ob'), ['Bob Stone'])
+        self.assertEqual(self.search('1234'), ['Bob Stone'])
+
+    def test_ranking_and_explicit_ordering(self):
+        # The name match outranks the company match
+        self.assertEqual(self.search('walker'), ['Jane Walker', 'Bob Stone'])
+        # An explicit ordering keeps the list's own order, newest first
+        self.assertEqual(self.search('walker', ordering='-created_at'), ['Bob Stone', 'Jane Walker'])
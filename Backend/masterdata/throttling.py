@@ -0,0 +1,129 @@
+import math
+import time
+
+from django.core.cache import cache
+
+
+BUCKET_KEY = 'ingestion:bucket:{config_id}'
+BUCKET_LOCK_KEY = 'ingestion:bucket-lock:{config_id}'
+COUNTER_KEY = 'ingestion:counter:{config_id}:{name}'
+BACKLOG_KEY = 'ingestion:backlog:{config_id}'
+DRAIN_LOCK_KEY = 'ingestion:drain:{config_id}'
+
+COUNTER_NAMES = ('accepted', 'deferred', 'rejected_rate_limit', 'rejected_backlog')
+
+# How long a cached backlog count is trusted before it is re-read from the database
+BACKLOG_CACHE_SECONDS = 5
+# Minimum gap between two drain tasks queued for the same endpoint
+DRAIN_INTERVAL_SECONDS = 30
+# How long a request waits for another worker to finish with the same bucket
+BUCKET_LOCK_WAIT_SECONDS = 0.5
+
+
+def consume_token(endpoint_config, now=None):
+    """
+    Take one token from the endpoint's bucket.
+    Returns (allowed, retry_after_seconds).
+
+    The read-modify-write of the bucket holds a per-bucket lock (cache.add), so
+    concurrent workers cannot spend the same token; a request that cannot get the
+    lock within BUCKET_LOCK_WAIT_SECONDS is refused with a one second retry.
+    """
+    rate = endpoint_config.rate_limit_per_minute
+    burst = endpoint_config.burst_limit
+    if not rate or not burst:
+        # 0 disables rate limiting for this endpoint
+        return True, 0
+
+    lock = BUCKET_LOCK_KEY.format(config_id=endpoint_config.id)
+    deadline = time.monotonic() + BUCKET_LOCK_WAIT_SECONDS
+    while not cache.add(lock, True, timeout=5):
+        if time.monotonic() >= deadline:
+            return False, 1
+        time.sleep(0.005)
+    try:
+        return _take_token(endpoint_config.id, rate, burst, now)
+    finally:
+        cache.delete(lock)
+
+
+def _take_token(config_id, rate, burst, now):
+    now = now if now is not None else time.time()
+    refill_per_second = rate / 60.0
+    key = BUCKET_KEY.format(config_id=config_id)
+
+    tokens, updated_at = cache.get(key, (float(burst), now))
+    tokens = min(float(burst), tokens + (now - updated_at) * refill_per_second)
+
+    if tokens < 1:
+        cache.set(key, (tokens, now), timeout=_bucket_timeout(burst, refill_per_second))
+        retry_after = math.ceil((1 - tokens) / refill_per_second)
+        return False, max(retry_after, 1)
+
+    cache.set(key, (tokens - 1, now), timeout=_bucket_timeout(burst, refill_per_second))
+    return True, 0
+
+
+def _bucket_timeout(burst, refill_per_second):
+    # A bucket left alone this long is full again, so the key can expire
+    return math.ceil(burst / refill_per_second) + 1
+
+
+def increment_counter(endpoint_config, name):
+    key = COUNTER_KEY.format(config_id=endpoint_config.id, name=name)
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_counters(endpoint_config_id):
+    keys = {
+        COUNTER_KEY.format(config_id=endpoint_config_id, name=name): name
+        for name in COUNTER_NAMES
+    }
+    values = cache.get_many(list(keys))
+    return {name: values.get(key, 0) for key, name in keys.items()}
+
+
+def get_backlog(endpoint_config):
+    """
+    Number of unprocessed raw leads for the endpoint, cached for a few seconds so
+    a flood of requests does not turn into a flood of COUNT queries.
+    """
+    from .models import RawEndpointLead
+
+    key = BACKLOG_KEY.format(config_id=endpoint_config.id)
+    backlog = cache.get(key)
+    if backlog is None:
+        backlog = RawEndpointLead.objects.filter(
+            endpoint_config=endpoint_config, processed=False
+        ).count()
+        cache.set(key, backlog, timeout=BACKLOG_CACHE_SECONDS)
+    return backlog
+
+
+def note_lead_stored(endpoint_config):
+    key = BACKLOG_KEY.format(config_id=endpoint_config.id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def schedule_drain(endpoint_config):
+    """
+    Queue a processing run for the endpoint's backlog, at most once per DRAIN_INTERVAL_SECONDS.
+    """
+    key = DRAIN_LOCK_KEY.format(config_id=endpoint_config.id)
+    if not cache.add(key, True, timeout=DRAIN_INTERVAL_SECONDS):
+        return False
+
+    from crm_back.queues import enqueue
+    enqueue(
+        'masterdata.tasks.process_raw_endpoint_leads',
+        endpoint_config_id=endpoint_config.id,
+        q_options={'name': f"Drain backlog: {endpoint_config.name}"}
+    )
+    return True
@@ -6,7 +6,11 @@ from django.utils import timezone
 from datetime import timedelta
 from django.db.models import Count, Q
 from crm_back.custom_methods import isAuthenticatedCustom, isAdminUser, HasSystemPermission
-from crm_back.mixins import OrganizationContextMixin
+from crm_back.exports import ExportMixin
+from crm_back.metrics import Measure, MetricSpec, breakdown
+from crm_back.mixins import ConditionalGetMixin, OrganizationContextMixin, SerializerQuerysetMixin
+from crm_back.search import search_queryset
+from crm_back.utils import KeysetPagination
 from .models import (
     Customer, Branch, ServiceType, DocumentLibrary, 
     DocumentServiceTypeBranchMapping, MoveType, RoomSize,
@@ -22,6 +26,7 @@ from .serializers import (
 )
 from rest_framework.views import APIView
 from users.models import Organization
+from . import throttling
 
 class LeadIngestionView(APIView):
     """
@@ -48,13 +53,39 @@ class LeadIngestionView(APIView):
                 return Response({'error': 'Invalid or inactive secret key'}, status=status.HTTP_401_UNAUTHORIZED)
         else:
             return Response({'error': 'Endpoint ID in URL or X-Endpoint-Secret header is required'}, status=status.HTTP_401_UNAUTHORIZED)
-        
+
+        # Rate limit per endpoint configuration
+        allowed, retry_after = throttling.consume_token(endpoint_config)
+        if not allowed:
+            throttling.increment_counter(endpoint_config, 'rejected_rate_limit')
+            return Response(
+                {'error': 'Rate limit exceeded for this endpoint', 'retry_after': retry_after},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(retry_after)}
+            )
+
+        # Keep the unprocessed backlog bounded
+        if endpoint_config.max_backlog and throttling.get_backlog(endpoint_config) >= endpoint_config.max_backlog:
+            if endpoint_config.backlog_policy == 'defer':
+                throttling.schedule_drain(endpoint_config)
+                throttling.increment_counter(endpoint_config, 'deferred')
+                retry_after = throttling.DRAIN_INTERVAL_SECONDS
+                return Response(
+                    {'error': 'Endpoint backlog is full, retry later', 'retry_after': retry_after},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(retry_after)}
+                )
+            throttling.increment_counter(endpoint_config, 'rejected_backlog')
+            return Response({'error': 'Endpoint backlog is full'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
         # Save raw lead
         raw_lead = RawEndpointLead.objects.create(
             organization=endpoint_config.organization,
             endpoint_config=endpoint_config,
             raw_data=data
         )
+        throttling.note_lead_stored(endpoint_config)
+        throttling.increment_counter(endpoint_config, 'accepted')
 
         return Response({
             'message': 'Data received and stored successfully', 
@@ -62,7 +93,7 @@ class LeadIngestionView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class EndpointConfigurationViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class EndpointConfigurationViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing organization endpoint configurations
     """
@@ -70,6 +101,13 @@ class EndpointConfigurationViewSet(OrganizationContextMixin, viewsets.ModelViewS
     serializer_class = EndpointConfigurationSerializer
     permission_classes = (isAuthenticatedCustom,)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Unprocessed backlog per endpoint in the same query
+        return queryset.annotate(
+            backlog_count=Count('rawendpointlead', filter=Q(rawendpointlead__processed=False))
+        )
+
     def perform_create(self, serializer):
         kwargs = {}
         if hasattr(self.request, 'organization') and self.request.organization:
@@ -77,7 +115,7 @@ class EndpointConfigurationViewSet(OrganizationContextMixin, viewsets.ModelViewS
         serializer.save(**kwargs)
 
 
-class RawEndpointLeadViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class RawEndpointLeadViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing raw leads
     """
@@ -88,13 +126,16 @@ class RawEndpointLeadViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
 
 
 
-class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class CustomerViewSet(ConditionalGetMixin, SerializerQuerysetMixin, ExportMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing customers
     """
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = (isAuthenticatedCustom, HasSystemPermission)
+    pagination_class = KeysetPagination
+    # The upcoming visit comes from the customer's site visits
+    etag_related = {'site_visits': 'updated_at'}
     
     required_permissions = {
         'list': ['view_customers'],
@@ -104,8 +145,28 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         'partial_update': ['edit_customers'],
         'destroy': ['delete_customers'],
         'archive': ['edit_customers'],
-        'unarchive': ['edit_customers']
+        'unarchive': ['edit_customers'],
+        'export': ['view_customers'],
     }
+
+    export_name = 'customers'
+    export_columns = (
+        ('id', 'id'),
+        ('full_name', 'full_name'),
+        ('email', 'email'),
+        ('phone', 'phone'),
+        ('company', 'company'),
+        ('source', 'source'),
+        ('stage', 'stage'),
+        ('branch', 'branch__name'),
+        ('assigned_to', 'assigned_to__fullname'),
+        ('service_type', 'service_type__service_type'),
+        ('move_date', 'move_date'),
+        ('city', 'city'),
+        ('state', 'state'),
+        ('is_archived', 'is_archived'),
+        ('created_at', 'created_at'),
+    )
     
     def get_queryset(self):
         """
@@ -115,7 +176,7 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         # Handle archiving: restrict to archived/active ONLY for list action
         # This allows retrieve/archive/unarchive to find the object by ID regardless of status
-        if self.action == 'list':
+        if self.action in ('list', 'export'):
             show_archived = self.request.query_params.get('show_archived', 'false').lower() == 'true'
             queryset = queryset.filter(is_archived=show_archived)
         
@@ -140,12 +201,7 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         # Search functionality
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                Q(full_name__icontains=search) |
-                Q(email__icontains=search) |
-                Q(phone__icontains=search) |
-                Q(company__icontains=search)
-            )
+            queryset = search_queryset(queryset, 'customers', search, rank=not self.request.query_params.get('ordering'))
         
         return queryset
 
@@ -160,8 +216,8 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         # Log activity
         try:
-            from transactiondata.models import CustomerActivity
-            CustomerActivity.objects.create(
+            from transactiondata.activity import log_activity
+            log_activity(
                 customer=customer,
                 activity_type='status_changed',
                 title='Customer Archived',
@@ -185,8 +241,8 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         # Log activity
         try:
-            from transactiondata.models import CustomerActivity
-            CustomerActivity.objects.create(
+            from transactiondata.activity import log_activity
+            log_activity(
                 customer=customer,
                 activity_type='status_changed',
                 title='Customer Unarchived',
@@ -208,8 +264,8 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         # Create activity for new customer
         try:
-            from transactiondata.models import CustomerActivity
-            CustomerActivity.objects.create(
+            from transactiondata.activity import log_activity
+            log_activity(
                 customer=customer,
                 activity_type='other',
                 title=f'Customer Created',
@@ -219,7 +275,7 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             
             # Send welcome email if customer has email
             if customer.email:
-                from django_q.tasks import async_task
+                from crm_back.queues import enqueue
                 from transactiondata.tasks import send_new_lead_welcome_email, get_active_schedule
                 
                 # Link task to schedule for UI tracking
@@ -229,7 +285,10 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
                     if schedule:
                         task_name = schedule.name
                 
-                async_task(send_new_lead_welcome_email, customer.id, q_options={'name': task_name} if task_name else None)
+                enqueue(
+                    send_new_lead_welcome_email, customer.id, q_options={'name': task_name} if task_name else None,
+                    idempotency_key=(customer.id, 'new_lead'), debounce=settings.TASK_DEBOUNCE_SECONDS
+                )
                 
         except Exception as e:
             # Don't fail the request if activity logging or email fails
@@ -247,8 +306,8 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         # Check if stage changed
         if old_stage != updated_customer.stage:
             try:
-                from transactiondata.models import CustomerActivity
-                CustomerActivity.objects.create(
+                from transactiondata.activity import log_activity
+                log_activity(
                     customer=updated_customer,
                     activity_type='status_changed',
                     title=f'Stage Changed: {old_stage.title()} → {updated_customer.stage.title()}',
@@ -265,7 +324,7 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
     
     def _trigger_stage_automations(self, customer, frontend_url=None):
         """Helper to trigger automations when stage changes"""
-        from django_q.tasks import async_task
+        from crm_back.queues import enqueue
         from django.conf import settings
         
         # Use provided frontend_url or fall back to settings
@@ -284,7 +343,10 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
                 if schedule:
                     task_name = schedule.name
             
-            async_task(send_new_lead_welcome_email, customer.id, q_options={'name': task_name} if task_name else None)
+            enqueue(
+                send_new_lead_welcome_email, customer.id, q_options={'name': task_name} if task_name else None,
+                idempotency_key=(customer.id, customer.stage), debounce=settings.TASK_DEBOUNCE_SECONDS
+            )
         elif customer.stage == 'booked' and customer.email:
             print(f"Triggering booked automation for customer {customer.id}")
             from transactiondata.tasks import send_booked_async, get_active_schedule
@@ -295,7 +357,10 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
                 if schedule:
                     task_name = schedule.name
             
-            async_task(send_booked_async, customer.id, q_options={'name': task_name} if task_name else None)
+            enqueue(
+                send_booked_async, customer.id, q_options={'name': task_name} if task_name else None,
+                idempotency_key=(customer.id, customer.stage), debounce=settings.TASK_DEBOUNCE_SECONDS
+            )
         elif customer.stage == 'closed' and customer.email:
             print(f"Triggering closed automation for customer {customer.id}")
             from transactiondata.tasks import send_closed_async, get_active_schedule
@@ -306,7 +371,10 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
                 if schedule:
                     task_name = schedule.name
             
-            async_task(send_closed_async, customer.id, frontend_url, q_options={'name': task_name} if task_name else None)
+            enqueue(
+                send_closed_async, customer.id, frontend_url, q_options={'name': task_name} if task_name else None,
+                idempotency_key=(customer.id, customer.stage), debounce=settings.TASK_DEBOUNCE_SECONDS
+            )
         else:
             print(f"No automation triggered for stage {customer.stage} (email present: {bool(customer.email)})")
 
@@ -378,8 +446,8 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         # Create activity record for stage change
         try:
-            from transactiondata.models import CustomerActivity
-            CustomerActivity.objects.create(
+            from transactiondata.activity import log_activity
+            log_activity(
                 customer=customer,
                 activity_type='status_changed',
                 title=f'Stage Changed: {old_stage.title()} → {new_stage.title()}',
@@ -399,6 +467,13 @@ class CustomerViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+CUSTOMER_STATS_SPEC = MetricSpec(
+    total=Measure(),
+    leads=Measure(where=Q(stage='new_lead')),
+    unassigned_leads=Measure(where=Q(stage='new_lead', assigned_to__isnull=True)),
+)
+
+
 class CustomerStatisticsViewSet(viewsets.ViewSet):
     """
     ViewSet for customer statistics
@@ -415,38 +490,22 @@ class CustomerStatisticsViewSet(viewsets.ViewSet):
         if hasattr(request, 'organization') and request.organization:
             customers = customers.filter(organization=request.organization)
             
-        total_customers = customers.count()
-        total_leads = customers.filter(stage='lead').count()
-        unassigned_leads = customers.filter(
-            stage='lead',
-            assigned_to__isnull=True
-        ).count()
-        
-        # Statistics by stage
-        by_stage = {}
-        stage_stats = customers.values('stage').annotate(count=Count('id'))
-        for stat in stage_stats:
-            by_stage[stat['stage']] = stat['count']
-        
-        # Statistics by source
-        by_source = {}
-        source_stats = customers.values('source').annotate(count=Count('id'))
-        for stat in source_stats:
-            by_source[stat['source']] = stat['count']
-        
+        counts = CUSTOMER_STATS_SPEC.evaluate(customers)
+
         data = {
-            'total_customers': total_customers,
-            'total_leads': total_leads,
-            'unassigned_leads': unassigned_leads,
-            'by_stage': by_stage,
-            'by_source': by_source
+            'total_customers': counts['total'],
+            'total_leads': counts['leads'],
+            'unassigned_leads': counts['unassigned_leads'],
+            # Grouped rather than bucketed, so sources outside SOURCE_CHOICES are counted too
+            'by_stage': breakdown(customers, 'stage'),
+            'by_source': breakdown(customers, 'source'),
         }
         
         serializer = CustomerStatsSerializer(data)
         return Response(serializer.data)
 
 
-class BranchViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class BranchViewSet(ConditionalGetMixin, SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing branches
     """
@@ -480,7 +539,7 @@ class BranchViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         serializer.save(**kwargs)
 
 
-class ServiceTypeViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class ServiceTypeViewSet(ConditionalGetMixin, SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing service types
     """
@@ -516,7 +575,7 @@ from django.utils.decorators import method_decorator
 import mimetypes
 import os
 
-class DocumentLibraryViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class DocumentLibraryViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing documents
     """
@@ -553,12 +612,7 @@ class DocumentLibraryViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         # Search functionality
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                Q(title__icontains=search) |
-                Q(description__icontains=search) |
-                Q(document_type__icontains=search) |
-                Q(subject__icontains=search)
-            )
+            queryset = search_queryset(queryset, 'documents', search, rank=not self.request.query_params.get('ordering'))
         
         # Filter by category
         category = self.request.query_params.get('category', None)
@@ -626,7 +680,7 @@ class DocumentLibraryViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-class DocumentMappingViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class DocumentMappingViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing document mappings
     """
@@ -661,7 +715,7 @@ class DocumentMappingViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         serializer.save(**kwargs)
 
 
-class MoveTypeViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class MoveTypeViewSet(ConditionalGetMixin, SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing move types
     """
@@ -694,7 +748,7 @@ class MoveTypeViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         serializer.save(**kwargs)
 
 
-class RoomSizeViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class RoomSizeViewSet(ConditionalGetMixin, SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing room sizes
     """
@@ -734,6 +788,19 @@ class ScheduleViewSet(viewsets.ModelViewSet):
     serializer_class = ScheduleSerializer
     permission_classes = (isAdminUser,) # Only admins should manage schedules
 
+    def with_last_run(self, queryset):
+        """
+        Annotate the last run and its outcome from the execution history, in the same query
+        """
+        from django.db.models import OuterRef, Subquery
+        from .models import TaskExecution
+
+        latest = TaskExecution.objects.filter(schedule=OuterRef('pk'), stopped__isnull=False).order_by('-stopped')
+        return queryset.annotate(
+            last_run_at=Subquery(latest.values('stopped')[:1]),
+            last_success=Subquery(latest.values('success')[:1]),
+        )
+
     def get_queryset(self):
         """
         Filter schedules by organization context.
@@ -743,7 +810,7 @@ class ScheduleViewSet(viewsets.ModelViewSet):
 
         # Superusers see all schedules
         if user.is_superuser:
-            return queryset
+            return self.with_last_run(queryset)
 
         # Standard admins see schedules explicitly tagged with their organization_id in kwargs
         if hasattr(self.request, 'organization') and self.request.organization:
@@ -775,7 +842,7 @@ class ScheduleViewSet(viewsets.ModelViewSet):
                 if isinstance(kwargs, dict) and kwargs.get('organization_id') == org_id:
                     valid_ids.append(s.id)
             
-            return queryset.filter(id__in=valid_ids)
+            return self.with_last_run(queryset.filter(id__in=valid_ids))
             
         return queryset.none()
     
@@ -785,45 +852,50 @@ class ScheduleViewSet(viewsets.ModelViewSet):
         Return the history of executed tasks.
         """
         from django_q.models import Task
+        from . import automation
+        from .models import TaskExecution
         from .serializers import TaskSerializer
         from rest_framework.response import Response
-        import json
-        import ast
         
         user = request.user
-        tasks_qs = Task.objects.all().order_by('-stopped')
+        tasks = automation.with_raw_payloads(Task.objects.all().order_by('-stopped'))
         
         if not user.is_superuser and hasattr(request, 'organization') and request.organization:
-            org_id = request.organization.id
-            valid_task_ids = []
-            
-            # Filter first 200 tasks to find matching ones (performance guard)
-            recent_tasks = tasks_qs[:200]
-            
-            for t in recent_tasks:
-                if not t.kwargs:
-                    continue
-                
-                kwargs = t.kwargs
-                if isinstance(kwargs, str):
-                    try:
-                        try:
-                            kwargs = ast.literal_eval(kwargs)
-                        except:
-                            kwargs = json.loads(kwargs.replace("'", '"'))
-                    except:
-                        continue
-                
-                if isinstance(kwargs, dict) and kwargs.get('organization_id') == org_id:
-                    valid_task_ids.append(t.id)
-            
-            tasks = Task.objects.filter(id__in=valid_task_ids).order_by('-stopped')[:50]
-        else:
-            tasks = tasks_qs[:50]
+            # The organization of each task is recorded in the execution history
+            executions = TaskExecution.objects.filter(organization=request.organization)
+            tasks = tasks.filter(id__in=executions.values('task_id'))
 
-        serializer = TaskSerializer(tasks, many=True)
+        # Cursor pagination when ?cursor= is given, otherwise the latest 50
+        paginator = KeysetPagination()
+        paginator.ordering_field = 'stopped'
+        page = paginator.paginate_queryset(tasks, request, view=self)
+        paginated = page is not None
+        if not paginated:
+            page = list(tasks[:50])
+        # Decode the page once and load its target records with one query per model
+        serializer = TaskSerializer(page, many=True, context={'targets': automation.task_targets(page)})
+        if paginated:
+            return paginator.get_paginated_response(serializer.data)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def queues(self, request):
+        """
+        Depth, wait and run times per Django Q lane over the last ?minutes= (default 60),
+        and the calls dropped as duplicates per task function.
+        """
+        from crm_back import queues
+        from rest_framework.response import Response
+
+        try:
+            minutes = int(request.query_params.get('minutes', 60))
+        except ValueError:
+            minutes = 60
+        return Response({
+            'queues': queues.queue_stats(timedelta(minutes=minutes)),
+            'dedupe': queues.dedupe_stats(),
+        })
+    
     @action(detail=False, methods=['post'])
     def create_automation(self, request):
         """
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0022_customer_customer_org_stage_move_idx_and_more'),
+        ('sitevisits', '0001_initial'),
+        ('users', '0005_organization_google_business_link'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sitevisit',
+            index=models.Index(fields=['organization', 'scheduled_at'], name='sitevisit_org_scheduled_idx'),
+        ),
+    ]
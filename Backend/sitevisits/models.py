@@ -29,6 +29,11 @@ class SiteVisit(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='+')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['organization', 'scheduled_at'], name='sitevisit_org_scheduled_idx'),
+        ]
+
     def __str__(self):
         return f"Site Visit for {self.customer.full_name} on {self.scheduled_at}"
 
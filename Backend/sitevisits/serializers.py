@@ -2,14 +2,15 @@ from rest_framework import serializers
 from .models import SiteVisit, SiteVisitObservation, SiteVisitPhoto
 from users.models import CustomUser
 from masterdata.models import Customer
+from crm_back.mixins import QueryNeedsMixin, SparseFieldsMixin
 
-class SiteVisitObservationSerializer(serializers.ModelSerializer):
+class SiteVisitObservationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = SiteVisitObservation
         fields = ['id', 'visit', 'key', 'value', 'display_order', 'created_at']
         read_only_fields = ['created_at']
 
-class SiteVisitPhotoSerializer(serializers.ModelSerializer):
+class SiteVisitPhotoSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     uploaded_by_name = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
 
@@ -18,6 +19,8 @@ class SiteVisitPhotoSerializer(serializers.ModelSerializer):
         fields = ['id', 'visit', 'image', 'image_url', 'caption', 'uploaded_at', 'uploaded_by', 'uploaded_by_name']
         read_only_fields = ['uploaded_at']
 
+    select_related = ('uploaded_by',)
+
     def get_uploaded_by_name(self, obj):
         return obj.uploaded_by.fullname if obj.uploaded_by else None
 
@@ -27,7 +30,7 @@ class SiteVisitPhotoSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.image.url)
         return obj.image.url if obj.image else None
 
-class SiteVisitSerializer(serializers.ModelSerializer):
+class SiteVisitSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     customer_name = serializers.SerializerMethodField()
     surveyor_name = serializers.SerializerMethodField()
     created_by_name = serializers.SerializerMethodField()
@@ -45,6 +48,13 @@ class SiteVisitSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'organization']
 
+    select_related = ('customer', 'surveyor', 'created_by')
+    field_sources = {
+        'customer_name': ('customer__full_name',),
+        'surveyor_name': ('surveyor__fullname',),
+        'created_by_name': ('created_by__fullname',),
+    }
+
     def get_customer_name(self, obj):
         return obj.customer.full_name if obj.customer else None
 
@@ -2,11 +2,11 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from crm_back.custom_methods import isAuthenticatedCustom
-from crm_back.mixins import OrganizationContextMixin
+from crm_back.mixins import OrganizationContextMixin, SerializerQuerysetMixin
 from .models import SiteVisit, SiteVisitObservation, SiteVisitPhoto
 from .serializers import SiteVisitSerializer, SiteVisitObservationSerializer, SiteVisitPhotoSerializer
 
-class SiteVisitViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class SiteVisitViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     queryset = SiteVisit.objects.all()
     serializer_class = SiteVisitSerializer
     permission_classes = (isAuthenticatedCustom,)
@@ -35,8 +35,8 @@ class SiteVisitViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         # Log activity
         try:
-            from transactiondata.models import CustomerActivity
-            CustomerActivity.objects.create(
+            from transactiondata.activity import log_activity
+            log_activity(
                 customer=visit.customer,
                 activity_type='other',
                 title='Site Visit Scheduled',
@@ -56,8 +56,8 @@ class SiteVisitViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         # Log activity
         try:
-            from transactiondata.models import CustomerActivity
-            CustomerActivity.objects.create(
+            from transactiondata.activity import log_activity
+            log_activity(
                 customer=visit.customer,
                 activity_type='other',
                 title='Site Visit Started',
@@ -79,8 +79,8 @@ class SiteVisitViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
 
         # Log activity
         try:
-            from transactiondata.models import CustomerActivity
-            CustomerActivity.objects.create(
+            from transactiondata.activity import log_activity
+            log_activity(
                 customer=visit.customer,
                 activity_type='other',
                 title='Site Visit Completed',
@@ -0,0 +1,128 @@
+"""
+Buffered CustomerActivity logging.
+
+log_activity() queues an activity instead of inserting it on the spot. Inside an
+activity_batch() scope (every request through ActivityBatchMiddleware, and the email
+tasks) the queued activities are written with one bulk_create when the scope ends.
+An activity logged inside a transaction only joins the batch once that transaction
+commits, so rolled back work leaves no audit rows behind. Outside any scope the
+activity is written on commit.
+
+Activities logged with write_behind=True are handed to a django-q task instead of
+being inserted on the request path. Set ACTIVITY_LOG_WRITE_BEHIND = False to write
+them inline as well.
+"""
+import logging
+import threading
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+WRITE_BEHIND_FIELDS = (
+    'customer_id', 'organization_id', 'estimate_id', 'created_by_id',
+    'activity_type', 'title', 'description',
+)
+
+
+def log_activity(customer, activity_type, title, description='', estimate=None,
+                 created_by=None, organization=None, write_behind=False):
+    """
+    Queue a CustomerActivity for the current batch.
+    """
+    from .models import CustomerActivity
+
+    activity = CustomerActivity(
+        customer=customer,
+        organization=organization,
+        estimate=estimate,
+        activity_type=activity_type,
+        title=title,
+        description=description,
+        created_by=created_by
+    )
+    write_behind = write_behind and getattr(settings, 'ACTIVITY_LOG_WRITE_BEHIND', True)
+
+    def enqueue():
+        batch = getattr(_local, 'batch', None)
+        if batch is None:
+            flush([(activity, write_behind)])
+        else:
+            batch.append((activity, write_behind))
+
+    # Only activities whose transaction commits are written; runs right away outside a transaction
+    transaction.on_commit(enqueue)
+
+
+def flush(events):
+    inline = [activity for activity, write_behind in events if not write_behind]
+    deferred = [activity for activity, write_behind in events if write_behind]
+
+    if inline:
+        try:
+            write_activities(inline)
+        except Exception as e:
+            logger.error(f"Failed to write {len(inline)} activity records: {e}")
+
+    if deferred:
+        rows = [
+            {field: getattr(activity, field) for field in WRITE_BEHIND_FIELDS}
+            for activity in deferred
+        ]
+        try:
+            from crm_back.queues import enqueue
+            enqueue('transactiondata.activity.write_activity_rows', rows)
+        except Exception as e:
+            logger.error(f"Failed to queue {len(rows)} activity records: {e}")
+
+
+def write_activities(activities):
+    from .models import CustomerActivity
+    return CustomerActivity.objects.bulk_create(activities)
+
+
+def write_activity_rows(rows):
+    """
+    django-q task for write-behind activities
+    """
+    from .models import CustomerActivity
+    created = write_activities([CustomerActivity(**row) for row in rows])
+    return {'written': len(created)}
+
+
+class activity_batch(ContextDecorator):
+    """
+    Collect activities logged inside the block and write them together when it ends.
+    Nested scopes join the outermost one.
+    """
+
+    def __enter__(self):
+        self.owner = getattr(_local, 'batch', None) is None
+        if self.owner:
+            _local.batch = []
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.owner:
+            events = _local.batch
+            _local.batch = None
+            if events:
+                flush(events)
+        return False
+
+
+class ActivityBatchMiddleware:
+    """
+    Write every activity logged while handling a request in a single INSERT.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with activity_batch():
+            return self.get_response(request)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from transactiondata import receivables
+
+
+class Command(BaseCommand):
+    help = 'Compares the accounts-receivable aging snapshot with the invoices and optionally repairs it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', type=int, help='Only check this organization')
+        parser.add_argument('--fix', action='store_true', help='Recompute the customers that differ')
+
+    def handle(self, *args, **options):
+        mismatches = receivables.find_mismatches(organization_id=options['organization'])
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Receivables snapshot is consistent'))
+            return
+
+        self.stdout.write(self.style.WARNING(f'{len(mismatches)} customer(s) differ'))
+        for organization_id, customer_id in mismatches:
+            self.stdout.write(f'  organization {organization_id} customer {customer_id}')
+
+        if not options['fix']:
+            raise CommandError('The receivables snapshot is out of date. Run with --fix to repair it.')
+
+        receivables.refresh_customers(customer_id for _organization_id, customer_id in mismatches)
+        self.stdout.write(self.style.SUCCESS('Receivables snapshot repaired'))
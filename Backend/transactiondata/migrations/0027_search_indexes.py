@@ -0,0 +1,85 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:40
+
+import sqlite3
+
+from django.db import migrations
+
+# Frozen copy of the estimates index in crm_back.search at the time of this
+# migration; later changes to that module must not change what this migration does.
+TABLE = 'search_estimate_fts'
+COLUMNS = (('customer__full_name', 'A'), ('customer__email', 'A'), ('notes', 'C'))
+CHUNK_SIZE = 1000
+
+
+def supported(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(content)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def write_rows(cursor, vendor, rows):
+    if vendor == 'postgresql':
+        document = ' || '.join(f"setweight(to_tsvector('simple', %s), '{weight}')" for _path, weight in COLUMNS)
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (object_id, document) VALUES (%s, {document}) "
+            f"ON CONFLICT (object_id) DO UPDATE SET document = EXCLUDED.document",
+            rows
+        )
+    else:
+        names = ', '.join(path.replace('__', '_') for path, _weight in COLUMNS)
+        cursor.executemany(
+            f"INSERT INTO {TABLE} (rowid, {names}) VALUES (%s, {', '.join(['%s'] * len(COLUMNS))})", rows
+        )
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if not supported(connection):
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} (object_id bigint PRIMARY KEY, document tsvector NOT NULL)")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING GIN (document)")
+        else:
+            names = ', '.join(path.replace('__', '_') for path, _weight in COLUMNS)
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} "
+                f"USING fts5({names}, tokenize='unicode61 remove_diacritics 2')"
+            )
+        cursor.execute(f"DELETE FROM {TABLE}")
+
+        Estimate = apps.get_model('transactiondata', 'Estimate')
+        paths = [path for path, _weight in COLUMNS]
+        rows = []
+        for values in Estimate._default_manager.values_list('pk', *paths).iterator(chunk_size=CHUNK_SIZE):
+            rows.append([values[0]] + ['' if value is None else str(value) for value in values[1:]])
+            if len(rows) >= CHUNK_SIZE:
+                write_rows(cursor, connection.vendor, rows)
+                rows = []
+        if rows:
+            write_rows(cursor, connection.vendor, rows)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if not supported(schema_editor.connection):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0020_search_indexes'),
+        ('transactiondata', '0026_alter_customeractivity_activity_type_emaillog'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
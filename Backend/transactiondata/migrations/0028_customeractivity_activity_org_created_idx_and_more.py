@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0021_customer_customer_org_created_idx'),
+        ('transactiondata', '0027_search_indexes'),
+        ('users', '0005_organization_google_business_link'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customeractivity',
+            index=models.Index(fields=['organization', '-created_at', '-id'], name='activity_org_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimate',
+            index=models.Index(fields=['organization', '-created_at', '-id'], name='estimate_org_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['organization', '-created_at', '-id'], name='invoice_org_created_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0022_customer_customer_org_stage_move_idx_and_more'),
+        ('transactiondata', '0028_customeractivity_activity_org_created_idx_and_more'),
+        ('users', '0005_organization_google_business_link'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customeractivity',
+            index=models.Index(fields=['customer', '-created_at'], name='activity_customer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimate',
+            index=models.Index(fields=['organization', 'status', 'created_at'], name='estimate_org_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['organization', 'expense_date'], name='expense_org_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['organization', 'issue_date', 'status'], name='invoice_org_issue_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentreceipt',
+            index=models.Index(fields=['organization', 'payment_date'], name='payment_org_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['organization', 'purchase_date'], name='purchase_org_date_idx'),
+        ),
+    ]
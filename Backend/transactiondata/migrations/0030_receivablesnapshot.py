@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('masterdata', '0022_customer_customer_org_stage_move_idx_and_more'),
+        ('transactiondata', '0029_customeractivity_activity_customer_created_idx_and_more'),
+        ('users', '0005_organization_google_business_link'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivableSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_1_30', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_31_60', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_61_90', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_over_90', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('open_balance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_balance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('invoice_count', models.IntegerField(default=0)),
+                ('open_invoice_count', models.IntegerField(default=0)),
+                ('oldest_due_date', models.DateField(blank=True, null=True)),
+                ('aged_on', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='receivable_snapshots', to='masterdata.customer')),
+                ('organization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='receivable_snapshots', to='users.organization')),
+            ],
+            options={
+                'ordering': ('-open_balance',),
+                'indexes': [models.Index(fields=['organization', '-open_balance'], name='receivable_org_open_idx'), models.Index(fields=['organization', '-total_balance'], name='receivable_org_total_idx')],
+                'constraints': [models.UniqueConstraint(fields=('organization', 'customer'), name='receivable_org_customer_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.6 on 2026-10-19 04:57
+
+from datetime import datetime, time, timedelta
+
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Count, Min, Q, Sum
+from django.utils import timezone
+
+# Frozen copy of the aging in transactiondata.receivables at the time of this
+# migration; later changes to that module must not change what this migration does.
+BUCKETS = (
+    ('current', None, 0),
+    ('days_1_30', 1, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('days_over_90', 91, None),
+)
+NON_RECEIVABLE_STATUSES = ('draft', 'void')
+ZERO = Decimal('0.00')
+REAGE_SCHEDULE = 'Re-age receivables'
+
+
+def backfill_receivables(apps, schema_editor):
+    Invoice = apps.get_model('transactiondata', 'Invoice')
+    ReceivableSnapshot = apps.get_model('transactiondata', 'ReceivableSnapshot')
+    today = timezone.localdate()
+
+    is_open = Q(balance_due__gt=0)
+    buckets = {}
+    for name, first, last in BUCKETS:
+        condition = Q()
+        if first is not None:
+            condition &= Q(due_date__lte=today - timedelta(days=first))
+        if last is not None:
+            condition &= Q(due_date__gte=today - timedelta(days=last))
+        buckets[name] = Sum('balance_due', filter=is_open & condition)
+    rows = Invoice.objects.exclude(status__in=NON_RECEIVABLE_STATUSES).values('organization_id', 'customer_id').annotate(
+        total_balance=Sum('balance_due'),
+        invoice_count=Count('id'),
+        open_invoice_count=Count('id', filter=is_open),
+        oldest_due_date=Min('due_date', filter=is_open),
+        **buckets
+    ).order_by()
+
+    snapshots = []
+    for row in rows:
+        values = {name: row[name] or ZERO for name in buckets}
+        values['open_balance'] = sum(values.values(), ZERO)
+        values['total_balance'] = row['total_balance'] or ZERO
+        if not values['open_balance'] and not values['total_balance']:
+            continue
+        snapshots.append(ReceivableSnapshot(
+            organization_id=row['organization_id'],
+            customer_id=row['customer_id'],
+            aged_on=today,
+            invoice_count=row['invoice_count'],
+            open_invoice_count=row['open_invoice_count'],
+            oldest_due_date=row['oldest_due_date'],
+            **values
+        ))
+    ReceivableSnapshot.objects.all().delete()
+    ReceivableSnapshot.objects.bulk_create(snapshots)
+
+
+def schedule_reage(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    Schedule.objects.update_or_create(
+        name=REAGE_SCHEDULE,
+        defaults={
+            'func': 'transactiondata.receivables.reage',
+            'schedule_type': 'D',
+            'repeats': -1,
+            # Shortly after midnight, when balances move into the next bucket
+            'next_run': timezone.make_aware(datetime.combine(tomorrow, time(0, 15))),
+        },
+    )
+
+
+def unschedule_reage(apps, schema_editor):
+    apps.get_model('django_q', 'Schedule').objects.filter(name=REAGE_SCHEDULE).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactiondata', '0030_receivablesnapshot'),
+        ('django_q', '0019_alter_task_options_alter_ormq_key_alter_ormq_lock_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_receivables, migrations.RunPython.noop),
+        migrations.RunPython(schedule_reage, unschedule_reage),
+    ]
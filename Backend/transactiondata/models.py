@@ -282,6 +282,10 @@ class Estimate(models.Model):
         ordering = ('-created_at',)
         verbose_name = 'Estimate'
         verbose_name_plural = 'Estimates'
+        indexes = [
+            models.Index(fields=['organization', '-created_at', '-id'], name='estimate_org_created_idx'),
+            models.Index(fields=['organization', 'status', 'created_at'], name='estimate_org_status_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if not self.assigned_to and self.customer and self.customer.assigned_to:
@@ -355,6 +359,10 @@ class CustomerActivity(models.Model):
         ordering = ('-created_at',)
         verbose_name = 'Customer Activity'
         verbose_name_plural = 'Customer Activities'
+        indexes = [
+            models.Index(fields=['organization', '-created_at', '-id'], name='activity_org_created_idx'),
+            models.Index(fields=['customer', '-created_at'], name='activity_customer_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.customer.full_name} - {self.title}"
@@ -460,6 +468,10 @@ class Invoice(models.Model):
 
     class Meta:
         ordering = ('-issue_date', '-created_at')
+        indexes = [
+            models.Index(fields=['organization', '-created_at', '-id'], name='invoice_org_created_idx'),
+            models.Index(fields=['organization', 'issue_date', 'status'], name='invoice_org_issue_status_idx'),
+        ]
 
     def calculate_balance(self):
         """Recalculate balance_due and update status based on payments"""
@@ -511,11 +523,52 @@ class PaymentReceipt(models.Model):
 
     class Meta:
         ordering = ('-payment_date',)
+        indexes = [
+            models.Index(fields=['organization', 'payment_date'], name='payment_org_date_idx'),
+        ]
 
     def __str__(self):
         return f"Payment {self.amount} for {self.invoice.invoice_number}"
 
 
+class ReceivableSnapshot(models.Model):
+    """
+    Accounts-receivable aging of one customer: open balances by days past due, as of
+    aged_on. Maintained by transactiondata.receivables; customers without a balance
+    have no row.
+    """
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='receivable_snapshots', null=True, blank=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='receivable_snapshots')
+
+    current = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_1_30 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_31_60 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_61_90 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_over_90 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Sum of the buckets: what the customer owes
+    open_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Net balance_due of every receivable invoice, credits included
+    total_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    invoice_count = models.IntegerField(default=0)
+    open_invoice_count = models.IntegerField(default=0)
+    oldest_due_date = models.DateField(null=True, blank=True)
+    aged_on = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ('-open_balance',)
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'customer'], name='receivable_org_customer_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['organization', '-open_balance'], name='receivable_org_open_idx'),
+            models.Index(fields=['organization', '-total_balance'], name='receivable_org_total_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_id} owes {self.open_balance} ({self.aged_on})"
+
+
 class Feedback(models.Model):
     """
     Customer Feedback and Reviews
@@ -709,6 +762,9 @@ class Expense(models.Model):
 
     class Meta:
         ordering = ('-expense_date', '-created_at')
+        indexes = [
+            models.Index(fields=['organization', 'expense_date'], name='expense_org_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} - ${self.amount}"
@@ -737,6 +793,9 @@ class Purchase(models.Model):
 
     class Meta:
         ordering = ('-purchase_date', '-created_at')
+        indexes = [
+            models.Index(fields=['organization', 'purchase_date'], name='purchase_org_date_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         # Auto-calculate total if not set
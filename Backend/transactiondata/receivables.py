@@ -0,0 +1,175 @@
+"""
+Accounts-receivable aging snapshot.
+
+ReceivableSnapshot holds one row per customer with a balance on a receivable invoice
+(any status but draft or void): the open balance split into current / 1-30 / 31-60 /
+61-90 / over 90 days past due, the net balance and the invoice counts. Saving or
+deleting an Invoice or PaymentReceipt refreshes that customer's row in the same
+transaction (transactiondata.signals); `reage` re-buckets every row nightly as invoices
+move past their due dates. The accounting endpoints and the receivables analytics read
+the snapshot, so they cost O(customers) instead of a scan of every open invoice.
+
+`manage.py reconcile_receivables` compares the snapshot with the invoices and repairs
+it with --fix.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, Min, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# (bucket, first day past due, last day past due); None leaves that side open
+BUCKETS = (
+    ('current', None, 0),
+    ('days_1_30', 1, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('days_over_90', 91, None),
+)
+BUCKET_NAMES = tuple(name for name, _first, _last in BUCKETS)
+BUCKET_LABELS = {
+    'current': 'Current',
+    'days_1_30': '1-30 days',
+    'days_31_60': '31-60 days',
+    'days_61_90': '61-90 days',
+    'days_over_90': '90+ days',
+}
+NON_RECEIVABLE_STATUSES = ('draft', 'void')
+SNAPSHOT_FIELDS = BUCKET_NAMES + (
+    'open_balance', 'total_balance', 'invoice_count', 'open_invoice_count', 'oldest_due_date',
+)
+ZERO = Decimal('0.00')
+
+
+def receivable_invoices(registry=apps):
+    return registry.get_model('transactiondata', 'Invoice').objects.exclude(status__in=NON_RECEIVABLE_STATUSES)
+
+
+def bucket_conditions(today):
+    """
+    {bucket: Q on due_date} for the aging buckets as of today
+    """
+    conditions = {}
+    for name, first, last in BUCKETS:
+        condition = Q()
+        if first is not None:
+            condition &= Q(due_date__lte=today - timedelta(days=first))
+        if last is not None:
+            condition &= Q(due_date__gte=today - timedelta(days=last))
+        conditions[name] = condition
+    return conditions
+
+
+def compute(invoices, today):
+    """
+    {(organization_id, customer_id): snapshot values} aggregated from invoices, leaving
+    out customers whose balances are all zero
+    """
+    is_open = Q(balance_due__gt=0)
+    buckets = {name: Sum('balance_due', filter=is_open & condition) for name, condition in bucket_conditions(today).items()}
+    rows = invoices.values('organization_id', 'customer_id').annotate(
+        total_balance=Sum('balance_due'),
+        invoice_count=Count('id'),
+        open_invoice_count=Count('id', filter=is_open),
+        oldest_due_date=Min('due_date', filter=is_open),
+        **buckets
+    ).order_by()
+
+    snapshots = {}
+    for row in rows:
+        values = {name: row[name] or ZERO for name in BUCKET_NAMES}
+        values['open_balance'] = sum(values.values(), ZERO)
+        values['total_balance'] = row['total_balance'] or ZERO
+        if not values['open_balance'] and not values['total_balance']:
+            continue
+        values.update(
+            invoice_count=row['invoice_count'],
+            open_invoice_count=row['open_invoice_count'],
+            oldest_due_date=row['oldest_due_date'],
+        )
+        snapshots[(row['organization_id'], row['customer_id'])] = values
+    return snapshots
+
+
+def _replace(snapshot_rows, computed, today, registry=apps):
+    ReceivableSnapshot = registry.get_model('transactiondata', 'ReceivableSnapshot')
+    with transaction.atomic():
+        snapshot_rows.delete()
+        ReceivableSnapshot.objects.bulk_create([
+            ReceivableSnapshot(organization_id=organization_id, customer_id=customer_id, aged_on=today, **values)
+            for (organization_id, customer_id), values in computed.items()
+        ])
+
+
+def refresh_customers(customer_ids, today=None):
+    """
+    Recompute the snapshot rows of these customers
+    """
+    from .models import ReceivableSnapshot
+
+    customer_ids = {customer_id for customer_id in customer_ids if customer_id}
+    if not customer_ids:
+        return
+    today = today or timezone.localdate()
+    computed = compute(receivable_invoices().filter(customer_id__in=customer_ids), today)
+    _replace(ReceivableSnapshot.objects.filter(customer_id__in=customer_ids), computed, today)
+
+
+def rebuild(organization_id=None, today=None, registry=apps):
+    """
+    Recompute the whole snapshot, or one organization's, as of today
+    """
+    ReceivableSnapshot = registry.get_model('transactiondata', 'ReceivableSnapshot')
+    today = today or timezone.localdate()
+    invoices = receivable_invoices(registry)
+    snapshot_rows = ReceivableSnapshot.objects.all()
+    if organization_id is not None:
+        invoices = invoices.filter(organization_id=organization_id)
+        snapshot_rows = snapshot_rows.filter(organization_id=organization_id)
+    computed = compute(invoices, today)
+    _replace(snapshot_rows, computed, today, registry)
+    return len(computed)
+
+
+def find_mismatches(organization_id=None, today=None):
+    """
+    [(organization_id, customer_id)] whose snapshot row differs from the invoices as of today
+    """
+    from .models import ReceivableSnapshot
+
+    today = today or timezone.localdate()
+    invoices = receivable_invoices()
+    snapshot_rows = ReceivableSnapshot.objects.all()
+    if organization_id is not None:
+        invoices = invoices.filter(organization_id=organization_id)
+        snapshot_rows = snapshot_rows.filter(organization_id=organization_id)
+
+    expected = compute(invoices, today)
+    stored = {
+        (row['organization_id'], row['customer_id']): {field: row[field] for field in SNAPSHOT_FIELDS}
+        for row in snapshot_rows.values('organization_id', 'customer_id', *SNAPSHOT_FIELDS)
+    }
+    return sorted(
+        (key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key)),
+        key=lambda key: (key[0] or 0, key[1])
+    )
+
+
+def reage():
+    """
+    Nightly Django Q job: re-bucket every customer's balance for today
+    """
+    from dashboard import cache as analytics_cache
+    from .models import ReceivableSnapshot
+
+    count = rebuild()
+    # Cached receivables analytics were bucketed as of yesterday
+    for organization_id in ReceivableSnapshot.objects.values_list('organization_id', flat=True).distinct():
+        analytics_cache.bump_generation(organization_id, 'transactiondata.invoice')
+    logger.info(f"Re-aged receivables for {count} customers")
+    return count
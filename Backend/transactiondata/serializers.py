@@ -6,9 +6,11 @@ from .models import (
     TransactionCategory, Expense, Purchase
 )
 from users.models import CustomUser
+from crm_back.annotations import computed
+from crm_back.mixins import QueryNeedsMixin, SparseFieldsMixin
 
 
-class TimeWindowSerializer(serializers.ModelSerializer):
+class TimeWindowSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     time_display = serializers.SerializerMethodField()
     
@@ -19,6 +21,12 @@ class TimeWindowSerializer(serializers.ModelSerializer):
             'display_order', 'created_at', 'updated_at', 'created_by', 'created_by_name'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by',)
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+        'time_display': ('start_time', 'end_time'),
+    }
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -29,7 +37,7 @@ class TimeWindowSerializer(serializers.ModelSerializer):
         return f"{obj.start_time.strftime('%I:%M %p')} - {obj.end_time.strftime('%I:%M %p')}"
 
 
-class ChargeCategorySerializer(serializers.ModelSerializer):
+class ChargeCategorySerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -39,6 +47,11 @@ class ChargeCategorySerializer(serializers.ModelSerializer):
             'created_at', 'updated_at', 'created_by', 'created_by_name'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by',)
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+    }
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -46,7 +59,7 @@ class ChargeCategorySerializer(serializers.ModelSerializer):
         return None
 
 
-class ChargeDefinitionSerializer(serializers.ModelSerializer):
+class ChargeDefinitionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     category_name = serializers.SerializerMethodField()
     percent_applied_on_name = serializers.SerializerMethodField()
@@ -77,7 +90,7 @@ class ChargeDefinitionSerializer(serializers.ModelSerializer):
         return [st.service_type for st in obj.applies_to.all()]
 
 
-class TemplateLineItemSerializer(serializers.ModelSerializer):
+class TemplateLineItemSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     charge_name = serializers.SerializerMethodField()
     charge_type = serializers.SerializerMethodField()
     category_name = serializers.SerializerMethodField()
@@ -88,6 +101,8 @@ class TemplateLineItemSerializer(serializers.ModelSerializer):
             'id', 'template', 'charge', 'charge_name', 'charge_type', 'category_name',
             'rate', 'percentage', 'is_editable', 'display_order'
         ]
+
+    select_related = ('charge__category',)
     
     def get_charge_name(self, obj):
         return obj.charge.name if obj.charge else None
@@ -99,7 +114,7 @@ class TemplateLineItemSerializer(serializers.ModelSerializer):
         return obj.charge.category.name if obj.charge and obj.charge.category else None
 
 
-class EstimateTemplateSerializer(serializers.ModelSerializer):
+class EstimateTemplateSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     service_type_name = serializers.SerializerMethodField()
     items = TemplateLineItemSerializer(many=True, read_only=True)
@@ -113,6 +128,13 @@ class EstimateTemplateSerializer(serializers.ModelSerializer):
             'items', 'items_count'
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by', 'service_type')
+    annotations = ('items_count',)
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+        'service_type_name': ('service_type__service_type',),
+    }
     
     def get_created_by_name(self, obj):
         if obj.created_by:
@@ -123,10 +145,10 @@ class EstimateTemplateSerializer(serializers.ModelSerializer):
         return obj.service_type.service_type if obj.service_type else None
     
     def get_items_count(self, obj):
-        return obj.items.count()
+        return computed(obj, 'items_count', obj.items.count)
 
 
-class EstimateLineItemSerializer(serializers.ModelSerializer):
+class EstimateLineItemSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     category_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -135,12 +157,14 @@ class EstimateLineItemSerializer(serializers.ModelSerializer):
             'id', 'estimate', 'charge', 'charge_name', 'charge_type', 'category_name',
             'rate', 'percentage', 'quantity', 'amount', 'is_user_modified', 'display_order'
         ]
+
+    select_related = ('charge__category',)
     
     def get_category_name(self, obj):
         return obj.charge.category.name if obj.charge and obj.charge.category else None
 
 
-class EstimateSerializer(serializers.ModelSerializer):
+class EstimateSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     customer_name = serializers.SerializerMethodField()
     customer_job_number = serializers.SerializerMethodField()
@@ -173,6 +197,25 @@ class EstimateSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at', 'created_by', 'subtotal', 'tax_amount', 'total_amount', 'public_token']
 
+    select_related = (
+        'customer', 'template_used', 'service_type', 'created_by', 'pickup_time_window',
+        'delivery_time_window', 'assigned_contractor',
+    )
+    annotations = ('items_count', 'document_signing_token')
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+        'customer_name': ('customer__full_name',),
+        'customer_job_number': ('customer__id',),
+        'template_name': ('template_used__name',),
+        'service_type_name': ('service_type__service_type',),
+        'service_type_estimate_content': ('service_type__estimate_content',),
+        'origin_address': ('customer__origin_address',),
+        'destination_address': ('customer__destination_address',),
+        'pickup_time_window_display': ('pickup_time_window',),
+        'delivery_time_window_display': ('delivery_time_window',),
+        'assigned_contractor_name': ('assigned_contractor__name',),
+    }
+
     def get_created_by_name(self, obj):
         if obj.created_by:
             return obj.created_by.fullname
@@ -210,16 +253,13 @@ class EstimateSerializer(serializers.ModelSerializer):
         return None
 
     def get_items_count(self, obj):
-        return obj.items.count()
+        return computed(obj, 'items_count', obj.items.count)
 
     def get_document_signing_token(self, obj):
         """Get the separate token for document signing"""
-        try:
-            if hasattr(obj, 'document_batch'):
-                return obj.document_batch.signing_token
-        except:
-            pass
-        return None
+        return computed(obj, 'document_signing_token', lambda: DocumentSigningBatch.objects.filter(
+            estimate=obj
+        ).values_list('signing_token', flat=True).first())
 
     def get_assigned_contractor_name(self, obj):
         if obj.assigned_contractor:
@@ -227,6 +267,19 @@ class EstimateSerializer(serializers.ModelSerializer):
         return None
 
 
+class EstimateListSerializer(EstimateSerializer):
+    """
+    Estimate list rows; line items, the service type's estimate content and notes are
+    left to the detail
+    """
+
+    class Meta(EstimateSerializer.Meta):
+        fields = [
+            field for field in EstimateSerializer.Meta.fields
+            if field not in ('items', 'service_type_estimate_content', 'notes', 'external_notes')
+        ]
+
+
 # Simple serializers for dropdowns
 class ChargeCategorySimpleSerializer(serializers.ModelSerializer):
     class Meta:
@@ -271,7 +324,7 @@ class TimeWindowSimpleSerializer(serializers.ModelSerializer):
         return f"{obj.start_time.strftime('%I:%M %p')} - {obj.end_time.strftime('%I:%M %p')}"
 
 
-class CustomerActivitySerializer(serializers.ModelSerializer):
+class CustomerActivitySerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     customer_name = serializers.SerializerMethodField()
     estimate_id = serializers.SerializerMethodField()
@@ -284,6 +337,13 @@ class CustomerActivitySerializer(serializers.ModelSerializer):
             'created_at', 'created_by', 'created_by_name'
         ]
         read_only_fields = ['created_at', 'created_by']
+
+    select_related = ('customer', 'created_by')
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+        'customer_name': ('customer__full_name',),
+        'estimate_id': ('estimate',),
+    }
     
     def get_created_by_name(self, obj):
         return obj.created_by.fullname if obj.created_by else 'System'
@@ -292,10 +352,10 @@ class CustomerActivitySerializer(serializers.ModelSerializer):
         return obj.customer.full_name if obj.customer else None
     
     def get_estimate_id(self, obj):
-        return obj.estimate.id if obj.estimate else None
+        return obj.estimate_id
 
 
-class EstimateDocumentSerializer(serializers.ModelSerializer):
+class EstimateDocumentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     document_title = serializers.SerializerMethodField()
     document_url = serializers.SerializerMethodField()
     document_type = serializers.SerializerMethodField()
@@ -419,7 +479,7 @@ class DocumentSigningBatchSerializer(serializers.ModelSerializer):
         read_only_fields = ['signing_token', 'created_at', 'created_by']
 
 
-class PaymentReceiptSerializer(serializers.ModelSerializer):
+class PaymentReceiptSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     estimate_public_token = serializers.SerializerMethodField()
     
@@ -427,6 +487,12 @@ class PaymentReceiptSerializer(serializers.ModelSerializer):
         model = PaymentReceipt
         fields = '__all__'
         read_only_fields = ['created_at', 'created_by']
+
+    select_related = ('created_by', 'invoice__estimate')
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+        'estimate_public_token': ('invoice__estimate__public_token',),
+    }
         
     def get_created_by_name(self, obj):
         return obj.created_by.fullname if obj.created_by else 'System'
@@ -434,7 +500,7 @@ class PaymentReceiptSerializer(serializers.ModelSerializer):
     def get_estimate_public_token(self, obj):
         return obj.invoice.estimate.public_token if obj.invoice and obj.invoice.estimate else None
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(QueryNeedsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     customer_name = serializers.SerializerMethodField()
     estimate_public_token = serializers.SerializerMethodField()
@@ -444,6 +510,13 @@ class InvoiceSerializer(serializers.ModelSerializer):
         model = Invoice
         fields = '__all__'
         read_only_fields = ['created_at', 'updated_at', 'created_by']
+
+    select_related = ('created_by', 'customer', 'estimate')
+    field_sources = {
+        'created_by_name': ('created_by__fullname',),
+        'customer_name': ('customer__full_name',),
+        'estimate_public_token': ('estimate__public_token',),
+    }
         
     def get_created_by_name(self, obj):
         return obj.created_by.fullname if obj.created_by else 'System'
@@ -455,7 +528,7 @@ class InvoiceSerializer(serializers.ModelSerializer):
         return obj.estimate.public_token if obj.estimate else None
 
 
-class FeedbackSerializer(serializers.ModelSerializer):
+class FeedbackSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     customer_name = serializers.SerializerMethodField()
     
@@ -475,13 +548,13 @@ class FeedbackSerializer(serializers.ModelSerializer):
         return obj.customer.full_name if obj.customer else None
 
 
-class ContractorEstimateLineItemSerializer(serializers.ModelSerializer):
+class ContractorEstimateLineItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ContractorEstimateLineItem
         fields = '__all__'
 
 
-class WorkOrderSerializer(serializers.ModelSerializer):
+class WorkOrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     contractor_name = serializers.SerializerMethodField()
     items = ContractorEstimateLineItemSerializer(many=True, read_only=True)
@@ -510,7 +583,7 @@ class WorkOrderSerializer(serializers.ModelSerializer):
         return None
 
 
-class TransactionCategorySerializer(serializers.ModelSerializer):
+class TransactionCategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     
     class Meta:
@@ -525,7 +598,7 @@ class TransactionCategorySerializer(serializers.ModelSerializer):
         return obj.created_by.fullname if obj.created_by else 'System'
 
 
-class ExpenseSerializer(serializers.ModelSerializer):
+class ExpenseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     category_name = serializers.SerializerMethodField()
     customer_name = serializers.SerializerMethodField()
@@ -553,7 +626,7 @@ class ExpenseSerializer(serializers.ModelSerializer):
         return obj.work_order.id if obj.work_order else None
 
 
-class PurchaseSerializer(serializers.ModelSerializer):
+class PurchaseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     created_by_name = serializers.SerializerMethodField()
     category_name = serializers.SerializerMethodField()
     
@@ -1,9 +1,12 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
+from crm_back import search
+from masterdata.models import Customer
 from .models import Estimate, Invoice, PaymentReceipt
+from . import receivables
 from .utils import generate_invoice_pdf, generate_payment_receipt_pdf
 from .tasks import send_invoice_async, send_receipt_async
-from django_q.tasks import async_task
+from crm_back.queues import enqueue
 from datetime import date
 import random
 import string
@@ -48,7 +51,7 @@ def invoice_saved(sender, instance, created, **kwargs):
             
         # Queue email automation
         if instance.customer and instance.customer.email:
-            async_task(send_invoice_async, instance.id)
+            enqueue(send_invoice_async, instance.id, idempotency_key=instance.id)
 
 @receiver(post_save, sender=PaymentReceipt)
 def payment_receipt_created(sender, instance, created, **kwargs):
@@ -62,4 +65,56 @@ def payment_receipt_created(sender, instance, created, **kwargs):
             
         # Queue email automation
         if instance.invoice.customer and instance.invoice.customer.email:
-            async_task(send_receipt_async, instance.id)
+            enqueue(send_receipt_async, instance.id, idempotency_key=instance.id)
+
+
+@receiver(post_save, sender=Estimate)
+def estimate_search_index(sender, instance, **kwargs):
+    """
+    Keep the estimate full-text index in sync
+    """
+    search.index_instance('estimates', instance)
+
+
+@receiver(post_delete, sender=Estimate)
+def estimate_search_remove(sender, instance, **kwargs):
+    search.remove_instance('estimates', instance.pk)
+
+
+@receiver(post_save, sender=Customer)
+def customer_estimates_search_index(sender, instance, created, **kwargs):
+    """
+    Estimates are searchable by customer name and email, so re-index them when the customer changes
+    """
+    if not created:
+        search.index_queryset('estimates', Estimate.objects.filter(customer=instance))
+
+
+@receiver(pre_save, sender=Invoice)
+def invoice_capture_customer(sender, instance, raw=False, **kwargs):
+    """
+    Remember the customer a re-assigned invoice leaves, so their receivables are refreshed too
+    """
+    instance._previous_customer_id = None
+    if instance.pk and not raw:
+        instance._previous_customer_id = Invoice.objects.filter(pk=instance.pk).values_list('customer_id', flat=True).first()
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invoice_receivables(sender, instance, raw=False, **kwargs):
+    """
+    Refresh the receivables snapshot of the invoice's customer
+    """
+    if raw:
+        return
+    receivables.refresh_customers({instance.customer_id, getattr(instance, '_previous_customer_id', None)})
+
+
+@receiver(post_save, sender=PaymentReceipt)
+@receiver(post_delete, sender=PaymentReceipt)
+def payment_receivables(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    customer_id = Invoice.objects.filter(pk=instance.invoice_id).values_list('customer_id', flat=True).first()
+    receivables.refresh_customers({customer_id})
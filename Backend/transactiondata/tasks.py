@@ -1,6 +1,7 @@
-from django_q.tasks import async_task
+from crm_back import queues
 from .email_utils import send_document_signature_email, send_invoice_pdf_email, send_receipt_pdf_email, send_estimate_pdf_email
 from django.db import models
+from .activity import activity_batch
 import logging
 
 logger = logging.getLogger(__name__)
@@ -64,6 +65,7 @@ def get_active_schedule(task_type, organization_id):
                 
     return None
 
+@activity_batch()
 def send_new_lead_welcome_email(customer_id, **kwargs):
     """
     Async task to send welcome email to a new lead.
@@ -114,8 +116,8 @@ def send_new_lead_welcome_email(customer_id, **kwargs):
             logger.info(f"Successfully sent welcome email to lead {customer_id}")
             # Log activity
             try:
-                from .models import CustomerActivity
-                CustomerActivity.objects.create(
+                from .activity import log_activity
+                log_activity(
                     customer=customer,
                     activity_type='email_sent',
                     title='Welcome Email Sent',
@@ -137,6 +139,7 @@ def send_new_lead_welcome_email(customer_id, **kwargs):
     return {"sent": 1 if success else 0, "message": message, "customer": customer.full_name}
 
 
+@activity_batch()
 def send_invoice_async(invoice_id, **kwargs):
     """
     Immediate async task to send an invoice.
@@ -185,8 +188,8 @@ def send_invoice_async(invoice_id, **kwargs):
             
             # Log activity
             try:
-                from .models import CustomerActivity
-                CustomerActivity.objects.create(
+                from .activity import log_activity
+                log_activity(
                     customer=invoice.customer,
                     activity_type='email_sent',
                     title='Invoice Emailed',
@@ -318,6 +321,7 @@ def send_estimate_async(estimate_id, **kwargs):
         return {"sent": 0, "error": str(e)}
 
 
+@activity_batch()
 def send_booked_async(customer_id, **kwargs):
     """
     Async task to send booking confirmation.
@@ -363,8 +367,8 @@ def send_booked_async(customer_id, **kwargs):
         if success:
             # Log activity
             try:
-                from .models import CustomerActivity
-                CustomerActivity.objects.create(
+                from .activity import log_activity
+                log_activity(
                     customer=customer,
                     activity_type='email_sent',
                     title='Booking Confirmation Sent',
@@ -383,6 +387,7 @@ def send_booked_async(customer_id, **kwargs):
         return {"sent": 0, "error": str(e)}
 
 
+@activity_batch()
 def send_closed_async(customer_id, base_url, **kwargs):
     """
     Async task to send closing email with feedback link.
@@ -449,8 +454,8 @@ def send_closed_async(customer_id, base_url, **kwargs):
             logger.info(f"Successfully sent Closed Email to customer {customer_id}")
             # Log activity
             try:
-                from .models import CustomerActivity
-                CustomerActivity.objects.create(
+                from .activity import log_activity
+                log_activity(
                     customer=customer,
                     activity_type='email_sent',
                     title='Closed/Feedback Email Sent',
@@ -531,20 +536,27 @@ def send_pending_invoices(organization_id=None, **kwargs):
                 skipped_count += 1
                 continue
             
-            try:
-                success, message = send_invoice_pdf_email(invoice, template=template)
-                if success:
-                    invoice.email_sent_at = timezone.now()
-                    invoice.save(update_fields=['email_sent_at'])
-                    sent_count += 1
-                    sent_customers.append(invoice.customer.full_name)
-                    logger.info(f"Successfully sent invoice {invoice.invoice_number}")
-                else:
+            # Skip invoices whose send_invoice_async is queued or running, or already went out
+            with queues.claimed(send_invoice_async, invoice.id) as acquired:
+                if not acquired or Invoice.objects.filter(pk=invoice.pk, email_sent_at__isnull=False).exists():
+                    logger.info(f"Skipping Invoice {invoice.id}: already being sent")
+                    skipped_count += 1
+                    continue
+
+                try:
+                    success, message = send_invoice_pdf_email(invoice, template=template)
+                    if success:
+                        invoice.email_sent_at = timezone.now()
+                        invoice.save(update_fields=['email_sent_at'])
+                        sent_count += 1
+                        sent_customers.append(invoice.customer.full_name)
+                        logger.info(f"Successfully sent invoice {invoice.invoice_number}")
+                    else:
+                        failed_count += 1
+                        logger.error(f"Failed to send invoice {invoice.invoice_number}: {message}")
+                except Exception as e:
                     failed_count += 1
-                    logger.error(f"Failed to send invoice {invoice.invoice_number}: {message}")
-            except Exception as e:
-                failed_count += 1
-                logger.error(f"Error sending invoice {invoice.invoice_number}: {e}")
+                    logger.error(f"Error sending invoice {invoice.invoice_number}: {e}")
         
         summary = {
             'sent': sent_count,
@@ -623,20 +635,27 @@ def send_pending_receipts(organization_id=None, **kwargs):
                 skipped_count += 1
                 continue
             
-            try:
-                success, message = send_receipt_pdf_email(receipt, template=template)
-                if success:
-                    receipt.email_sent_at = timezone.now()
-                    receipt.save(update_fields=['email_sent_at'])
-                    sent_count += 1
-                    sent_customers.append(receipt.invoice.customer.full_name)
-                    logger.info(f"Successfully sent receipt {receipt.id}")
-                else:
+            # Skip receipts whose send_receipt_async is queued or running, or already went out
+            with queues.claimed(send_receipt_async, receipt.id) as acquired:
+                if not acquired or PaymentReceipt.objects.filter(pk=receipt.pk, email_sent_at__isnull=False).exists():
+                    logger.info(f"Skipping Receipt {receipt.id}: already being sent")
+                    skipped_count += 1
+                    continue
+
+                try:
+                    success, message = send_receipt_pdf_email(receipt, template=template)
+                    if success:
+                        receipt.email_sent_at = timezone.now()
+                        receipt.save(update_fields=['email_sent_at'])
+                        sent_count += 1
+                        sent_customers.append(receipt.invoice.customer.full_name)
+                        logger.info(f"Successfully sent receipt {receipt.id}")
+                    else:
+                        failed_count += 1
+                        logger.error(f"Failed to send receipt {receipt.id}: {message}")
+                except Exception as e:
                     failed_count += 1
-                    logger.error(f"Failed to send receipt {receipt.id}: {message}")
-            except Exception as e:
-                failed_count += 1
-                logger.error(f"Error sending receipt {receipt.id}: {e}")
+                    logger.error(f"Error sending receipt {receipt.id}: {e}")
         
         summary = {
             'sent': sent_count,
@@ -1,3 +1,472 @@
-from django.test import TestCase
+import csv
+from datetime import date, timedelta
+from io import StringIO
+from crm_back.testing import OrganizationTestCase, QueryPlanTestCase
 
-# Create your tests here.
+
+class TransactionQueryPlanTests(QueryPlanTestCase):
+    """
+    Hot estimate, invoice, payment and activity queries must stay on an index
+    """
+
+    def test_estimate_list(self):
+        for params in ({}, {'status': 'sent'}, {'customer': self.customer.id}, {'search': 'walker'}, {'cursor': ''}):
+            with self.subTest(params=params):
+                self.assertNoFullScans('/api/transactiondata/estimates', params)
+
+    def test_invoice_list(self):
+        for params in ({}, {'customer': self.customer.id}, {'cursor': ''}):
+            with self.subTest(params=params):
+                self.assertNoFullScans('/api/transactiondata/invoices', params)
+
+    def test_payment_list(self):
+        self.assertNoFullScans('/api/transactiondata/payments')
+
+    def test_customer_activity_list(self):
+        for params in ({'customer': self.customer.id}, {'customer': self.customer.id, 'activity_type': 'note_added'}):
+            with self.subTest(params=params):
+                self.assertNoFullScans('/api/transactiondata/customer-activities', params)
+
+    def test_accounting(self):
+        self.assertNoFullScans('/api/transactiondata/accounting')
+        self.assertNoFullScans('/api/transactiondata/accounting/by_customer')
+
+
+class ListQueryTests(OrganizationTestCase):
+    """
+    Estimate, invoice and activity lists cost the same number of queries for any page size
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        from transactiondata.models import (
+            ChargeCategory, ChargeDefinition, CustomerActivity, DocumentSigningBatch, Estimate, EstimateLineItem,
+            Invoice, PaymentReceipt, TimeWindow,
+        )
+        category = ChargeCategory.objects.create(name='Labour', organization=cls.organization)
+        cls.charge = charge = ChargeDefinition.objects.create(
+            name='Movers', organization=cls.organization, category=category, charge_type='hourly'
+        )
+        window = TimeWindow.objects.create(
+            name='Morning', organization=cls.organization, start_time='08:00', end_time='12:00'
+        )
+        for number in range(10):
+            estimate = Estimate.objects.create(
+                customer=cls.customer, organization=cls.organization, service_type=cls.estimate.service_type,
+                status='draft', pickup_time_window=window, created_by=cls.user
+            )
+            EstimateLineItem.objects.create(
+                estimate=estimate, charge=charge, charge_name='Movers', charge_type='hourly', amount=50
+            )
+            invoice = Invoice.objects.create(
+                organization=cls.organization, estimate=estimate, customer=cls.customer,
+                invoice_number=f'INV-LIST-{number}', issue_date=date.today(), due_date=date.today(),
+                total_amount=50, balance_due=50, status='sent', pdf_file='invoices/list.pdf', created_by=cls.user
+            )
+            PaymentReceipt.objects.create(
+                organization=cls.organization, invoice=invoice, amount=10, payment_date=date.today(),
+                payment_method='cash', pdf_file='payments/list.pdf'
+            )
+            CustomerActivity.objects.create(
+                customer=cls.customer, organization=cls.organization, estimate=estimate,
+                activity_type='note_added', title='Note', created_by=cls.user
+            )
+        DocumentSigningBatch.objects.create(estimate=estimate, signing_token='sign-list-token')
+
+    def test_estimates(self):
+        response = self.assertConstantQueries('/api/transactiondata/estimates')
+        first = response.data['results'][0]
+        self.assertEqual(first['items_count'], 1)
+        self.assertTrue(first['pickup_time_window_display'].startswith('Morning'))
+        self.assertEqual(first['document_signing_token'], 'sign-list-token')
+        # Line items and long texts are left to the detail
+        self.assertNotIn('items', first)
+        self.assertNotIn('service_type_estimate_content', first)
+        detail = self.client.get(f"/api/transactiondata/estimates/{first['id']}").data
+        self.assertEqual(detail['items'][0]['category_name'], 'Labour')
+
+        # Objects loaded without the annotations fall back to the per-row lookups
+        from transactiondata.models import Estimate
+        from transactiondata.serializers import EstimateSerializer
+        data = EstimateSerializer(Estimate.objects.get(pk=first['id'])).data
+        self.assertEqual((data['items_count'], data['document_signing_token']), (1, 'sign-list-token'))
+
+    def test_sparse_fields(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(
+                '/api/transactiondata/estimates', {'cursor': '', 'fields': 'id,customer_name,total_amount'}
+            )
+        self.assertEqual(set(response.data['results'][0]), {'id', 'customer_name', 'total_amount'})
+        page_query = next(
+            query['sql'] for query in captured.captured_queries
+            if 'FROM "transactiondata_estimate"' in query['sql'] and 'LIMIT' in query['sql']
+        )
+        self.assertIn('"masterdata_customer"."full_name"', page_query)
+        for column in ('"notes"', '"weight_lbs"', '"origin_address"', 'transactiondata_documentsigningbatch'):
+            self.assertNotIn(column, page_query)
+
+        first = response.data['results'][0]
+        response = self.client.get(f"/api/transactiondata/estimates/{first['id']}", {'omit': 'items,notes'})
+        self.assertNotIn('items', response.data)
+        self.assertEqual(response.data['customer_name'], 'Jane Walker')
+
+        # Writes keep every field
+        response = self.client.patch(
+            f"/api/transactiondata/estimates/{first['id']}?fields=id", {'notes': 'Fragile'}, format='json'
+        )
+        self.assertEqual(response.data['notes'], 'Fragile')
+
+    def test_estimate_templates(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from transactiondata.models import EstimateTemplate, TemplateLineItem
+
+        def list_queries():
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get('/api/transactiondata/estimate-templates')
+            self.assertEqual(response.status_code, 200)
+            return len(captured), response.data
+
+        for number in range(5):
+            template = EstimateTemplate.objects.create(
+                name=f'Template {number}', organization=self.organization,
+                service_type=self.estimate.service_type, created_by=self.user
+            )
+            TemplateLineItem.objects.create(template=template, charge=self.charge)
+        list_queries()
+        queries, data = list_queries()
+        self.assertEqual([template['items_count'] for template in data], [1] * 5)
+
+        template = EstimateTemplate.objects.create(
+            name='Template 5', organization=self.organization, service_type=self.estimate.service_type
+        )
+        TemplateLineItem.objects.create(template=template, charge=self.charge)
+        self.assertEqual(list_queries()[0], queries)
+
+    def test_invoices(self):
+        response = self.assertConstantQueries('/api/transactiondata/invoices')
+        first = response.data['results'][0]
+        self.assertEqual(first['customer_name'], 'Jane Walker')
+        self.assertEqual(len(first['payments']), 1)
+
+    def test_activities(self):
+        self.assertConstantQueries('/api/transactiondata/customer-activities', {'customer': self.customer.id})
+
+
+class ConditionalGetTests(OrganizationTestCase):
+    """
+    Unchanged estimates answer If-None-Match with 304 before serializing
+    """
+
+    def test_detail(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from masterdata.models import Customer
+
+        url = f'/api/transactiondata/estimates/{self.estimate.id}'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        serialized = [query for query in captured.captured_queries if 'transactiondata_estimatelineitem' in query['sql']]
+        self.assertFalse(serialized)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        # The customer name is part of the estimate
+        Customer.objects.filter(pk=self.customer.pk).update(full_name='Jane Walker-Smith', updated_at=timezone.now())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['customer_name'], 'Jane Walker-Smith')
+
+        self.assertEqual(self.client.get('/api/transactiondata/estimates/0', HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_list(self):
+        from transactiondata.models import Estimate
+
+        url = '/api/transactiondata/estimates'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Other filters are another representation
+        self.assertEqual(self.client.get(url, {'status': 'sent'}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        extra = Estimate.objects.create(
+            customer=self.customer, organization=self.organization, service_type=self.estimate.service_type, status='draft'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # Deleting a row leaves max(updated_at) alone but changes the count
+        Estimate.objects.filter(pk=extra.pk).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_related_names(self):
+        from datetime import time
+        from masterdata.models import Customer
+        from transactiondata.models import TimeWindow
+
+        Customer.objects.filter(pk=self.customer.pk).update(assigned_to=self.user)
+        url = '/api/masterdata/customers'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Names read through relations are part of the customers
+        service_type = self.customer.service_type
+        service_type.service_type = 'Long Distance'
+        service_type.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['service_type_name'], 'Long Distance')
+
+        etag = response['ETag']
+        self.user.fullname = 'Plan Reviewer'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['assigned_to_name'], 'Plan Reviewer')
+
+        # Reference data shows its creator's name
+        TimeWindow.objects.create(
+            name='Morning', start_time=time(8), end_time=time(12), organization=self.organization, created_by=self.user
+        )
+        url = '/api/transactiondata/time-windows'
+        etag = self.client.get(url)['ETag']
+        self.user.fullname = 'Plan Tester'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['created_by_name'], 'Plan Tester')
+
+
+class ReceivableSnapshotTests(OrganizationTestCase):
+    """
+    The aging snapshot follows invoice and payment writes and matches a fresh aggregation of the invoices
+    """
+
+    def setUp(self):
+        super().setUp()
+        from transactiondata.models import Invoice
+        self.overdue = Invoice.objects.create(
+            organization=self.organization, customer=self.customer, invoice_number='INV-AGED-1',
+            issue_date=date.today() - timedelta(days=60), due_date=date.today() - timedelta(days=45),
+            total_amount=200, balance_due=200, status='sent', pdf_file='invoices/aged.pdf'
+        )
+
+    def test_snapshot_follows_writes(self):
+        from transactiondata.models import PaymentReceipt, ReceivableSnapshot
+
+        snapshot = ReceivableSnapshot.objects.get(customer=self.customer)
+        self.assertEqual((snapshot.current, snapshot.days_31_60, snapshot.open_balance), (60, 200, 260))
+        self.assertEqual((snapshot.invoice_count, snapshot.oldest_due_date), (2, self.overdue.due_date))
+
+        PaymentReceipt.objects.create(
+            organization=self.organization, invoice=self.overdue, amount=200, payment_date=date.today(),
+            payment_method='cash', pdf_file='payments/aged.pdf'
+        )
+        # Refreshes replace the customer's row
+        snapshot = ReceivableSnapshot.objects.get(customer=self.customer)
+        self.assertEqual((snapshot.days_31_60, snapshot.open_balance, snapshot.open_invoice_count), (0, 60, 1))
+
+        self.invoice.delete()
+        self.overdue.delete()
+        self.assertFalse(ReceivableSnapshot.objects.filter(customer=self.customer).exists())
+
+    def test_accounting_reads_snapshot(self):
+        overview = self.assertNoFullScans('/api/transactiondata/accounting').json()
+        self.assertEqual(overview['overall_balance'], 260)
+        self.assertEqual(overview['aging']['current'], 60)
+        self.assertEqual(overview['aging']['days_31_60'], 200)
+
+        balances = self.assertNoFullScans('/api/transactiondata/accounting/by_customer').json()
+        self.assertEqual([(row['customer__id'], row['total_balance'], row['invoice_count']) for row in balances], [(self.customer.id, 260, 2)])
+
+        aging = self.client.get('/api/dashboard/analytics/data/', {'source': 'receivables_aging'}).json()['data']
+        self.assertEqual([point['value'] for point in aging], [60, 0, 200, 0, 0])
+        filtered = self.client.get('/api/dashboard/analytics/data/', {'source': 'receivables_aging', 'rep_id': self.user.id}).json()['data']
+        self.assertEqual(filtered, [{**point, 'value': 0} for point in aging])
+
+    def test_reconcile(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from transactiondata.models import Invoice
+        from transactiondata import receivables
+
+        # Bulk updates skip signals
+        Invoice.objects.filter(pk=self.overdue.pk).update(balance_due=150)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_receivables', stdout=StringIO())
+        call_command('reconcile_receivables', '--fix', stdout=StringIO())
+        self.assertEqual(receivables.find_mismatches(), [])
+
+        receivables.rebuild(today=date.today() + timedelta(days=60))
+        snapshot = self.customer.receivable_snapshots.get()
+        self.assertEqual((snapshot.days_31_60, snapshot.days_over_90), (60, 150))
+
+    def test_backfill_migration(self):
+        from importlib import import_module
+        from django.apps import apps
+        from transactiondata.models import ReceivableSnapshot
+        from transactiondata import receivables
+
+        migration = import_module('transactiondata.migrations.0031_backfill_receivables')
+        ReceivableSnapshot.objects.all().delete()
+        migration.backfill_receivables(apps, None)
+        self.assertEqual(receivables.find_mismatches(), [])
+        self.assertEqual(ReceivableSnapshot.objects.get(customer=self.customer).open_balance, 260)
+
+
+class ExportTests(OrganizationTestCase):
+    """
+    Estimate, invoice and analytics exports stream CSV in the list's scope
+    """
+
+    def rows(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        return list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_invoices(self):
+        rows = self.rows('/api/transactiondata/invoices/export')
+        self.assertEqual(rows[0][:3], ['id', 'invoice_number', 'customer_id'])
+        self.assertEqual([(row[1], row[3], row[11]) for row in rows[1:]], [('INV-PLAN-1', 'Jane Walker', '60.00')])
+
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.rows('/api/transactiondata/invoices/export', {'end_date': yesterday})), 1)
+        self.assertEqual(len(self.rows('/api/transactiondata/invoices/export', {'f_customer_id': self.customer.id})), 2)
+
+    def test_estimates(self):
+        rows = self.rows('/api/transactiondata/estimates/export', {'status': 'draft'})
+        self.assertEqual(rows, [rows[0]])
+        rows = self.rows('/api/transactiondata/estimates/export', {'status': 'sent'})
+        self.assertEqual([int(row[0]) for row in rows[1:]], [self.estimate.id])
+
+    def test_analytics(self):
+        rows = self.rows('/api/dashboard/analytics/export/', {'source': 'receivables_aging'})
+        self.assertIn('value', rows[0])
+        self.assertEqual(len(rows), 6)
+
+        response = self.client.get('/api/dashboard/analytics/export/', {'source': 'receivables_aging', 'output': 'parquet'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RetentionTests(OrganizationTestCase):
+    """
+    Old activity rows move to archive files and come back unchanged on restore
+    """
+
+    def test_archive_and_restore(self):
+        import tempfile
+        from django.core.management import call_command
+        from django.test import override_settings
+        from django.utils import timezone
+        from crm_back import retention
+        from transactiondata.models import CustomerActivity
+
+        recent = CustomerActivity.objects.get()
+        old_dates = [timezone.now() - timedelta(days=800 + offset) for offset in range(3)]
+        old = []
+        for created_at in old_dates:
+            activity = CustomerActivity.objects.create(
+                customer=self.customer, organization=self.organization, estimate=self.estimate,
+                activity_type='note_added', title='Old note'
+            )
+            # auto_now_add ignores values passed to create
+            CustomerActivity.objects.filter(pk=activity.pk).update(created_at=created_at)
+            old.append(activity.pk)
+
+        with tempfile.TemporaryDirectory() as root, override_settings(RETENTION_ARCHIVE_ROOT=root):
+            call_command('archive_rows', '--model', 'transactiondata.customeractivity', '--chunk-size', '2', stdout=StringIO())
+            self.assertEqual(list(CustomerActivity.objects.values_list('pk', flat=True)), [recent.pk])
+            files = retention.archive_files('transactiondata.customeractivity')
+            self.assertEqual(len(files), 2)
+
+            call_command(
+                'restore_archive', 'transactiondata.customeractivity',
+                '--since', old_dates[1].date().isoformat(), stdout=StringIO()
+            )
+            restored = CustomerActivity.objects.filter(pk__in=old).order_by('-created_at')
+            self.assertEqual(len(restored), 2)
+            self.assertEqual([activity.created_at for activity in restored], old_dates[:2])
+            self.assertEqual(len(retention.archive_files('transactiondata.customeractivity')), 1)
+
+
+class ActivityLogTests(OrganizationTestCase):
+    """
+    Activities are written after their transaction commits, once per request batch, or by the write-behind task
+    """
+
+    def log(self, title, **kwargs):
+        from transactiondata.activity import log_activity
+        log_activity(self.customer, 'note_added', title, organization=self.organization, created_by=self.user, **kwargs)
+
+    def titles(self):
+        from transactiondata.models import CustomerActivity
+        return sorted(CustomerActivity.objects.exclude(title='Called customer').values_list('title', flat=True))
+
+    def test_written_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.log('Quoted')
+            self.assertEqual(self.titles(), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(), ['Quoted'])
+
+    def test_rolled_back(self):
+        from django.db import transaction
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.log('Never happened')
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.titles(), [])
+
+    def test_flushed_at_request_end(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from transactiondata.activity import ActivityBatchMiddleware
+
+        def view(request):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.log('First')
+                self.log('Second')
+            # Committed, but held until the request is done
+            self.assertEqual(self.titles(), [])
+            return 'response'
+
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(ActivityBatchMiddleware(view)(None), 'response')
+        self.assertEqual(self.titles(), ['First', 'Second'])
+        inserts = [q for q in captured.captured_queries if q['sql'].startswith('INSERT INTO "transactiondata_customeractivity"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_write_behind(self):
+        from django.test import override_settings
+        from django_q.models import OrmQ
+        from transactiondata.activity import write_activity_rows
+
+        OrmQ.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.log('Emailed', write_behind=True)
+        self.assertEqual(self.titles(), [])
+
+        task = OrmQ.objects.get().task
+        self.assertEqual(task['func'], 'transactiondata.activity.write_activity_rows')
+        self.assertEqual(write_activity_rows(*task['args']), {'written': 1})
+        self.assertEqual(self.titles(), ['Emailed'])
+
+        # Switched off, write-behind activities are written inline
+        with override_settings(ACTIVITY_LOG_WRITE_BEHIND=False), self.captureOnCommitCallbacks(execute=True):
+            self.log('Inline', write_behind=True)
+        self.assertEqual(self.titles(), ['Emailed', 'Inline'])
+        self.assertEqual(OrmQ.objects.count(), 1)
@@ -7,16 +7,19 @@ from django.db.models import Count, Q, Sum
 from django.http import HttpResponse, FileResponse
 from io import BytesIO
 from crm_back.custom_methods import isAuthenticatedCustom
-from crm_back.mixins import OrganizationContextMixin
+from crm_back.exports import ExportMixin
+from crm_back.mixins import ConditionalGetMixin, OrganizationContextMixin, SerializerQuerysetMixin
+from crm_back.search import search_queryset
+from crm_back.utils import KeysetPagination
 from .models import (
     ChargeCategory, ChargeDefinition, EstimateTemplate, TemplateLineItem,
     Estimate, EstimateLineItem, CustomerActivity, EstimateDocument, DocumentSigningBatch, TimeWindow,
     Invoice, PaymentReceipt, Feedback, WorkOrder, ContractorEstimateLineItem,
-    TransactionCategory, Expense, Purchase, EmailLog
+    TransactionCategory, Expense, Purchase, EmailLog, ReceivableSnapshot
 )
 from .serializers import (
     ChargeCategorySerializer, ChargeDefinitionSerializer, EstimateTemplateSerializer,
-    TemplateLineItemSerializer, EstimateSerializer, EstimateLineItemSerializer,
+    TemplateLineItemSerializer, EstimateSerializer, EstimateListSerializer, EstimateLineItemSerializer,
     ChargeCategorySimpleSerializer, ChargeDefinitionSimpleSerializer, EstimateTemplateSimpleSerializer,
     ChargeCategorySimpleSerializer, ChargeDefinitionSimpleSerializer, EstimateTemplateSimpleSerializer,
     CustomerActivitySerializer, EstimateDocumentSerializer, TimeWindowSerializer, TimeWindowSimpleSerializer,
@@ -24,6 +27,8 @@ from .serializers import (
     WorkOrderSerializer, ContractorEstimateLineItemSerializer,
     TransactionCategorySerializer, ExpenseSerializer, PurchaseSerializer
 )
+from .activity import log_activity
+from . import receivables
 from .utils import create_estimate_from_template, calculate_estimate, process_document_template, generate_invoice_pdf
 from .email_utils import send_estimate_email, send_document_signature_email, send_invoice_pdf_email, send_receipt_pdf_email
 from masterdata.models import Customer
@@ -34,7 +39,7 @@ import string
 from datetime import date
 
 
-class TimeWindowViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class TimeWindowViewSet(ConditionalGetMixin, SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing time windows
     """
@@ -68,7 +73,7 @@ class TimeWindowViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class ChargeCategoryViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class ChargeCategoryViewSet(ConditionalGetMixin, SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing charge categories
     """
@@ -110,7 +115,7 @@ class ChargeCategoryViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class ChargeDefinitionViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class ChargeDefinitionViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing charge definitions
     """
@@ -185,7 +190,7 @@ class ChargeDefinitionViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class EstimateTemplateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class EstimateTemplateViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing estimate templates
     """
@@ -287,13 +292,35 @@ class TemplateLineItemViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class EstimateViewSet(ConditionalGetMixin, SerializerQuerysetMixin, ExportMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing estimates
     """
     queryset = Estimate.objects.all()
     serializer_class = EstimateSerializer
+    serializer_action_classes = {'list': EstimateListSerializer}
     permission_classes = (isAuthenticatedCustom,)
+    pagination_class = KeysetPagination
+    etag_related = {'customer': 'updated_at', 'document_batch': 'created_at'}
+    export_name = 'estimates'
+    export_columns = (
+        ('id', 'id'),
+        ('customer_id', 'customer'),
+        ('customer', 'customer__full_name'),
+        ('status', 'status'),
+        ('payment_status', 'payment_status'),
+        ('service_type', 'service_type__service_type'),
+        ('pickup_date', 'pickup_date_from'),
+        ('delivery_date', 'delivery_date_from'),
+        ('subtotal', 'subtotal'),
+        ('discount_amount', 'discount_amount'),
+        ('tax_amount', 'tax_amount'),
+        ('total_amount', 'total_amount'),
+        ('amount_paid', 'amount_paid'),
+        ('balance_due', 'balance_due'),
+        ('assigned_to', 'assigned_to__fullname'),
+        ('created_at', 'created_at'),
+    )
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -316,11 +343,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         # Search functionality
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                Q(customer__full_name__icontains=search) |
-                Q(customer__email__icontains=search) |
-                Q(notes__icontains=search)
-            )
+            queryset = search_queryset(queryset, 'estimates', search, rank=not self.request.query_params.get('ordering'))
         
         return queryset
     
@@ -374,7 +397,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         )
         
         # Create activity record
-        CustomerActivity.objects.create(
+        log_activity(
             customer=customer,
             estimate=estimate,
             activity_type='estimate_created',
@@ -432,7 +455,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         }
         
         if new_status in activity_titles:
-            CustomerActivity.objects.create(
+            log_activity(
                 customer=estimate.customer,
                 estimate=estimate,
                 activity_type=f'estimate_{new_status}',
@@ -493,7 +516,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         estimate.save(update_fields=['status', 'updated_at'])
         
         # Create activity record
-        CustomerActivity.objects.create(
+        log_activity(
             customer=estimate.customer,
             estimate=estimate,
             activity_type='other',
@@ -563,7 +586,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         if success:
             # Create activity
-            CustomerActivity.objects.create(
+            log_activity(
                 customer=estimate.customer,
                 estimate=estimate,
                 activity_type='estimate_sent',
@@ -907,7 +930,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             estimate.save()
             
             # Create activity
-            CustomerActivity.objects.create(
+            log_activity(
                 customer=estimate.customer,
                 estimate=estimate,
                 activity_type='estimate_approved',
@@ -957,7 +980,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             estimate.save()
             
             # Create activity
-            CustomerActivity.objects.create(
+            log_activity(
                 customer=estimate.customer,
                 estimate=estimate,
                 activity_type='estimate_rejected',
@@ -990,7 +1013,7 @@ class EstimateViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         
         if success:
             # Create activity
-            CustomerActivity.objects.create(
+            log_activity(
                 customer=estimate.customer,
                 estimate=estimate,
                 activity_type='other',
@@ -1097,16 +1120,17 @@ class EstimateLineItemViewSet(viewsets.ModelViewSet):
         calculate_estimate(estimate)
 
 
-class CustomerActivityViewSet(viewsets.ModelViewSet):
+class CustomerActivityViewSet(SerializerQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing customer activities
     """
     queryset = CustomerActivity.objects.all()
     serializer_class = CustomerActivitySerializer
     permission_classes = (isAuthenticatedCustom,)
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
-        queryset = CustomerActivity.objects.all()
+        queryset = super().get_queryset()
         
         # Filter by customer
         customer_id = self.request.query_params.get('customer', None)
@@ -1399,9 +1423,14 @@ class EstimateDocumentViewSet(viewsets.ModelViewSet):
             defaults={'created_by': request.user}
         )
         
-        # Async task
-        from django_q.tasks import async_task
-        async_task('transactiondata.tasks.process_document_signing', doc.estimate.id, base_url)
+        # Async task; repeated requests for the same batch coalesce into one email
+        from crm_back.queues import enqueue
+        task_id = enqueue(
+            'transactiondata.tasks.process_document_signing', doc.estimate.id, base_url,
+            idempotency_key=(doc.estimate.id, batch.id), debounce=settings.TASK_DEBOUNCE_SECONDS
+        )
+        if task_id is None:
+            return Response({'message': 'Signature request email already queued'})
         
         return Response({'message': 'Signature request email queued'})
 
@@ -1427,7 +1456,7 @@ class EstimateDocumentViewSet(viewsets.ModelViewSet):
         estimate_document.save()
         
         # Create activity
-        CustomerActivity.objects.create(
+        log_activity(
             customer=estimate_document.estimate.customer,
             estimate=estimate_document.estimate,
             activity_type='other',
@@ -1440,13 +1469,32 @@ class EstimateDocumentViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class InvoiceViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class InvoiceViewSet(ConditionalGetMixin, SerializerQuerysetMixin, ExportMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing invoices
     """
     queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
     permission_classes = (isAuthenticatedCustom,)
+    pagination_class = KeysetPagination
+    etag_related = {'customer': 'updated_at', 'payments': 'created_at'}
+    export_name = 'invoices'
+    export_columns = (
+        ('id', 'id'),
+        ('invoice_number', 'invoice_number'),
+        ('customer_id', 'customer'),
+        ('customer', 'customer__full_name'),
+        ('estimate_id', 'estimate'),
+        ('status', 'status'),
+        ('issue_date', 'issue_date'),
+        ('due_date', 'due_date'),
+        ('subtotal', 'subtotal'),
+        ('tax_amount', 'tax_amount'),
+        ('total_amount', 'total_amount'),
+        ('balance_due', 'balance_due'),
+        ('assigned_to', 'assigned_to__fullname'),
+        ('created_at', 'created_at'),
+    )
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -1509,7 +1557,7 @@ class InvoiceViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class PaymentReceiptViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class PaymentReceiptViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing payments
     """
@@ -1584,11 +1632,19 @@ class AccountingViewSet(viewsets.ViewSet):
         """
         # Filter by org
         invoices = Invoice.objects.all()
+        snapshots = ReceivableSnapshot.objects.all()
         if hasattr(request, 'organization') and request.organization:
             invoices = invoices.filter(organization=request.organization)
+            snapshots = snapshots.filter(organization=request.organization)
             
         valid_invoices = invoices.exclude(status__in=['draft', 'void'])
-        overall_balance = valid_invoices.aggregate(sum=Sum('balance_due'))['sum'] or 0
+
+        # Balances and aging come from the receivables snapshot, one row per customer
+        totals = snapshots.aggregate(
+            overall_balance=Sum('total_balance'),
+            **{bucket: Sum(bucket) for bucket in receivables.BUCKET_NAMES}
+        )
+        overall_balance = totals.pop('overall_balance') or 0
         
         # Monthly Stats (for current month)
         now = timezone.now()
@@ -1604,6 +1660,7 @@ class AccountingViewSet(viewsets.ViewSet):
         
         return Response({
             "overall_balance": overall_balance,
+            "aging": {bucket: totals[bucket] or 0 for bucket in receivables.BUCKET_NAMES},
             "current_month": {
                 "billed": monthly_billed,
                 "collected": monthly_collected,
@@ -1617,21 +1674,20 @@ class AccountingViewSet(viewsets.ViewSet):
         """
         Get balances grouped by customer
         """
-        invoices = Invoice.objects.all()
+        snapshots = ReceivableSnapshot.objects.all()
         if hasattr(request, 'organization') and request.organization:
-            invoices = invoices.filter(organization=request.organization)
+            snapshots = snapshots.filter(organization=request.organization)
             
-        # Group by customer and sum balance_due
-        # We also need customer name
-        balances = invoices.exclude(status__in=['draft', 'void']).values('customer__id', 'customer__full_name').annotate(
-            total_balance=Sum('balance_due'),
-            invoice_count=Count('id')
-        ).filter(total_balance__gt=0).order_by('-total_balance')
+        # One snapshot row per customer, with the customer name
+        balances = snapshots.filter(total_balance__gt=0).values(
+            'customer__id', 'customer__full_name', 'total_balance', 'invoice_count',
+            'open_balance', 'oldest_due_date', *receivables.BUCKET_NAMES
+        ).order_by('-total_balance')
         
         return Response(balances)
 
 
-class FeedbackViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class FeedbackViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing customer feedback/reviews
     """
@@ -1707,7 +1763,7 @@ class FeedbackViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             
             # Log activity if customer exists
             if feedback.customer:
-                CustomerActivity.objects.create(
+                log_activity(
                     customer=feedback.customer,
                     activity_type='feedback_received',
                     title='Customer Feedback Received',
@@ -1727,7 +1783,7 @@ class FeedbackViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             return Response({'error': 'Invalid token'}, status=status.HTTP_404_NOT_FOUND)
 
 
-class WorkOrderViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class WorkOrderViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing contractor work orders
     """
@@ -1783,7 +1839,7 @@ class WorkOrderViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         # Handle both internal and external work orders
         contractor_name = work_order.contractor.name if work_order.contractor else 'Internal Team'
         
-        CustomerActivity.objects.create(
+        log_activity(
             customer=work_order.estimate.customer,
             estimate=work_order.estimate,
             activity_type='status_changed',
@@ -1833,7 +1889,7 @@ class WorkOrderViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         estimate.save(update_fields=['status', 'updated_at'])
         
         # Create activity
-        CustomerActivity.objects.create(
+        log_activity(
             customer=estimate.customer,
             estimate=estimate,
             activity_type='estimate_invoiced',
@@ -1881,7 +1937,7 @@ class WorkOrderViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             work_order.save(update_fields=['status', 'updated_at'])
             
             # Log activity
-            CustomerActivity.objects.create(
+            log_activity(
                 customer=work_order.estimate.customer,
                 estimate=work_order.estimate,
                 activity_type='status_changed',
@@ -1894,7 +1950,7 @@ class WorkOrderViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
             return Response({'error': 'Invalid or expired token'}, status=status.HTTP_404_NOT_FOUND)
 
 
-class ContractorEstimateLineItemViewSet(viewsets.ModelViewSet):
+class ContractorEstimateLineItemViewSet(SerializerQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing individual items on a contractor work order
     """
@@ -1912,7 +1968,7 @@ class ContractorEstimateLineItemViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class TransactionCategoryViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class TransactionCategoryViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing transaction categories
     """
@@ -1950,7 +2006,7 @@ class TransactionCategoryViewSet(OrganizationContextMixin, viewsets.ModelViewSet
         serializer.save(**kwargs)
 
 
-class ExpenseViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class ExpenseViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing expenses
     """
@@ -1992,7 +2048,7 @@ class ExpenseViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
         serializer.save(**kwargs)
 
 
-class PurchaseViewSet(OrganizationContextMixin, viewsets.ModelViewSet):
+class PurchaseViewSet(SerializerQuerysetMixin, OrganizationContextMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing purchases
     """
@@ -2040,7 +2096,7 @@ def track_email_open(request, token):
     Tracking pixel endpoint: serves a 1x1 transparent GIF and records an 'open' event.
     """
     try:
-        from .models import EmailLog, CustomerActivity
+        from .models import EmailLog
         from django.utils import timezone
         log = EmailLog.objects.get(tracking_token=token)
         if not log.is_opened:
@@ -2049,13 +2105,14 @@ def track_email_open(request, token):
             log.save()
             
             # Create activity record
-            CustomerActivity.objects.create(
+            log_activity(
                 customer=log.customer,
                 organization=log.organization,
                 activity_type='email_opened',
                 title=f"Email Opened: {log.subject}",
                 description=f"Automated tracking: Email with subject '{log.subject}' was opened.",
-                created_by=None
+                created_by=None,
+                write_behind=True
             )
     except Exception:
         pass